@@ -0,0 +1,330 @@
+"""Микробенчмарки модели процессора и транслятора.
+
+Запуск: `PYTHONPATH=src python benchmark.py <name>`, без имени выполняются все.
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from ruamel.yaml import YAML
+
+import layout
+import machine
+import tracer
+import translator
+
+PROB2_SOURCE = """
+(begin
+    (setq n input)
+    (setq i 0)
+    (setq sum 0)
+    (setq sum2 0)
+    (while (<= i n)
+        (setq sum (+ sum i))
+        (setq sum2 (+ sum2 (* i i)))
+        (setq i (+ i 1))
+    )
+    (setq sum (* sum sum))
+    (setq res (- sum sum2))
+    (print res)
+)
+"""
+
+# константные подвыражения в цикле: то, что сворачивает оптимизатор
+CONSTANTS_SOURCE = """
+(begin
+    (setq n input)
+    (setq i 0)
+    (setq seconds 0)
+    (while (<= i n)
+        (setq seconds (+ seconds (* (* 24 60) 60)))
+        (setq i (+ i (- 2 1)))
+    )
+    (cond (> 1 2) (print 0))
+    (print seconds)
+)
+"""
+
+# маленькие функции в цикле: то, что подставляет оптимизатор
+HELPERS_SOURCE = """
+(begin
+    (defun square (begin x) (begin (* x x)))
+    (defun step (begin acc x) (begin (+ acc (square x))))
+    (setq n input)
+    (setq i 0)
+    (setq acc 0)
+    (while (<= i n)
+        (setq acc (step acc i))
+        (setq i (+ i 1))
+    )
+    (print acc)
+)
+"""
+
+
+def translate(source):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        source_file = os.path.join(tmpdirname, "source.lisp")
+        target = os.path.join(tmpdirname, "target.bin")
+        with open(source_file, "w", encoding="utf-8") as f:
+            f.write(source)
+        with contextlib.redirect_stdout(io.StringIO()):
+            translator.main(source_file, target)
+        with open(target, "rb") as f:
+            _, binary_code = layout.split_header(f.read())
+            code = machine.from_bytes(binary_code)
+        with open(target + "_data.bin", "rb") as f:
+            data = machine.from_bytes_data(f.read())
+    return code, data
+
+
+def execute_signal_step(control_unit):
+    """Исполнение одной микрокоманды разбором кортежа mprogram, как до компиляции микропрограммы."""
+    mpc_now = control_unit.mprogram_counter
+    signal, *maybe_sel = control_unit.mprogram[mpc_now]
+    if maybe_sel and maybe_sel[0] is not None:
+        control_unit.execute_signal(signal, maybe_sel[0])
+    else:
+        control_unit.execute_signal(signal)
+    control_unit.datapath.tick += 1
+    if control_unit.mprogram_counter == mpc_now:
+        control_unit.mprogram_counter += 1
+
+
+def bench_microcode(ticks=1_000_000):
+    code, data = translate(PROB2_SOURCE)
+
+    datapath = machine.load_datapath(400, 401, code, data, [10**9])
+    start = time.perf_counter()
+    for _ in range(ticks // 10):
+        execute_signal_step(datapath.control_unit)
+    signals_rate = ticks // 10 / (time.perf_counter() - start)
+
+    datapath = machine.load_datapath(400, 401, code, data, [10**9])
+    start = time.perf_counter()
+    datapath.control_unit.run(ticks)
+    compiled_rate = ticks / (time.perf_counter() - start)
+
+    print(f"microcode: execute_signal {signals_rate:,.0f} uops/s, compiled {compiled_rate:,.0f} uops/s, "
+          f"x{compiled_rate / signals_rate:.1f}")
+
+
+def bench_fast(ticks=5_000_000):
+    code, data = translate(PROB2_SOURCE)
+
+    datapath = machine.load_datapath(400, 401, code, data, [10**9])
+    start = time.perf_counter()
+    datapath.control_unit.run(ticks)
+    microcode_rate = datapath.tick / (time.perf_counter() - start)
+
+    datapath = machine.load_datapath(400, 401, code, data, [10**9])
+    simulator = machine.InstructionSimulator(datapath)
+    start = time.perf_counter()
+    simulator.run(ticks)
+    fast_rate = datapath.tick / (time.perf_counter() - start)
+
+    print(f"fast: microcode {microcode_rate:,.0f} ticks/s, instruction-level {fast_rate:,.0f} ticks/s, "
+          f"x{fast_rate / microcode_rate:.1f}")
+
+
+def bench_trace(ticks=500_000):
+    code, data = translate(PROB2_SOURCE)
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        datapath = machine.load_datapath(400, 401, code, data, [10**9])
+        trace = tracer.Tracer(tracer.FileSink(os.path.join(tmpdirname, "trace.txt")), tracer.Granularity.MICRO)
+        start = time.perf_counter()
+        machine.traced_run(datapath, lambda _: datapath.control_unit.run_single_micro(), datapath.control_unit.run,
+                           trace, ticks)
+        trace.close()
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(os.path.join(tmpdirname, "trace.txt"))
+
+    print(f"trace: {ticks / elapsed:,.0f} lines/s, {size / elapsed / 2**20:.1f} MiB/s")
+
+
+def generated_source(statements):
+    """Синтетическая программа: statements присваиваний, 12 токенов на каждое."""
+    body = "\n".join(f"    (setq x{i % 50} (+ (* x{i % 7} 3) {i}))" for i in range(statements))
+    return f"(begin\n{body}\n)"
+
+
+def parse_pop(parser, tokens):
+    """Рекурсивный разбор через tokens.pop(0), как до итеративного парсера."""
+    token = tokens.pop(0)
+    if token == "(":
+        op_token = tokens.pop(0)
+        try:
+            op = translator.Operation(op_token)
+        except ValueError:
+            op = parser.atom(op_token)
+        args = []
+        while tokens[0] != ")":
+            args.append(parse_pop(parser, tokens))
+        tokens.pop(0)
+        return translator.Exp(operation=op, operands=args)
+    return parser.atom(token)
+
+
+def bench_parse(sizes=(10**4, 10**5, 10**6)):
+    for tokens_amount in sizes:
+        tokens = translator.Tokenizer().tokenize(generated_source(tokens_amount // 12))
+        start = time.perf_counter()
+        translator.Parser().parse(tokens)
+        elapsed = time.perf_counter() - start
+        line = f"parse: {len(tokens):,} tokens in {elapsed:.3f} s ({len(tokens) / elapsed:,.0f} tokens/s)"
+        if len(tokens) <= 2 * 10**5:
+            texts = [token.text for token in tokens]
+            start = time.perf_counter()
+            parse_pop(translator.Parser(), texts)
+            line += f", pop(0) {time.perf_counter() - start:.3f} s"
+        print(line)
+
+
+def bench_tokenize(tokens_amount=2 * 10**5):
+    source = generated_source(tokens_amount // 12)
+    for name, tokens in (
+        ("list", lambda: translator.Tokenizer().tokenize(source)),
+        ("stream", lambda: translator.Tokenizer().stream(io.StringIO(source))),
+    ):
+        start = time.perf_counter()
+        translator.Parser().parse(tokens())
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        translator.Parser().parse(tokens())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"tokenize+parse ({name}): {elapsed:.3f} s, peak {peak / 2**20:.1f} MiB")
+
+
+def benchmark_programs(extra):
+    programs = list(extra)
+    for path in sorted(Path("golden").glob("*.yml")):
+        golden = YAML(typ="safe").load(path)
+        programs.append((path.name, golden["in_source"], golden["in_stdin"] or "", golden["is_char_io"]))
+    return programs
+
+
+def measure(source, stdin, is_char_io, level, inline_threshold=None):
+    input_tokens = [ord(ch) for ch in stdin + "\0"] if is_char_io else [int(num) for num in stdin.split()]
+    code, data = translator.translate(source, layout.DEFAULT_LAYOUT, level, inline_threshold)
+    datapath = machine.load_datapath(400, 401, code, data, input_tokens)
+    machine.run_datapath(datapath, fast=True)
+    return len(code), datapath.tick
+
+
+def from_bytes_loop(binary_code):
+    """Декодирование образа сборкой каждого слова из 4 байтов, как до machine.words_from_bytes."""
+    code = []
+    i = 0
+    while i + 3 < len(binary_code):
+        word = (binary_code[i] << 24) | (binary_code[i + 1] << 16) | (binary_code[i + 2] << 8) | binary_code[i + 3]
+        instruction = machine.decode_instruction(word)
+        code.append(instruction)
+        for _ in range(machine.immediates_amount(instruction.opcode, instruction.n)):
+            i += 4
+            code.append((binary_code[i] << 24) | (binary_code[i + 1] << 16) | (binary_code[i + 2] << 8)
+                        | binary_code[i + 3])
+        i += 4
+    return code
+
+
+def to_bytes_loop(code):
+    """Кодирование по 4 байта на слово в bytearray, как до machine.encode_program."""
+    binary = bytearray()
+    for cell in code:
+        word = machine.encode_instruction(cell) if isinstance(cell, machine.Instruction) else cell
+        binary.extend(((word >> 24) & 0xFF, (word >> 16) & 0xFF, (word >> 8) & 0xFF, word & 0xFF))
+    return bytes(binary)
+
+
+def bench_codecs(words=2**20):
+    """Кодирование и загрузка образов кода и данных по words слов (4 MiB) против побайтовых циклов."""
+    code, _ = translator.translate(PROB2_SOURCE)
+    code = code * (words // len(code))
+    binary_code = translator.to_bytes(code)
+    binary_data = bytes(range(256)) * (4 * words // 256)
+    for name, new, old in (
+        ("to_bytes", lambda: translator.to_bytes(code), lambda: to_bytes_loop(code)),
+        ("from_bytes", lambda: machine.from_bytes(binary_code), lambda: from_bytes_loop(binary_code)),
+        ("from_bytes_data", lambda: machine.from_bytes_data(binary_data),
+         lambda: [int.from_bytes(binary_data[i:i + 4], "big") for i in range(0, len(binary_data), 4)]),
+    ):
+        start = time.perf_counter()
+        result = new()
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        assert old() == result
+        print(f"codecs {name:16} {len(binary_data) / 2**20:.0f} MiB: {elapsed * 1000:.1f} ms, "
+              f"loop {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+def bench_mmap(words=2**20):
+    """Время от файлов образов до остановки короткой программы, дополненной до words слов кода и данных."""
+    big = layout.MemoryLayout(text_size=words, data_base=words, data_size=words, heap_base=2 * words,
+                              stack_base=2 * words + 300, input_port=2 * words + 600, output_port=2 * words + 601)
+    code, data = translator.translate(PROB2_SOURCE, big)
+    code *= words // len(code)
+    data += [0] * (words - len(data))
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        code_file, data_file = os.path.join(tmpdirname, "code.bin"), os.path.join(tmpdirname, "data.bin")
+        input_file = os.path.join(tmpdirname, "input.txt")
+        with open(code_file, "wb") as f:
+            f.write(big.header() + translator.to_bytes(code))
+        with open(data_file, "wb") as f:
+            f.write(translator.to_bytes(data))
+        with open(input_file, "w", encoding="utf-8") as f:
+            f.write("10")
+        del code, data
+        for backend in machine.MEMORY_BACKENDS:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()) as stdout:
+                machine.main(code_file, data_file, input_file, None, None, 0, fast=True, memory_backend=backend)
+            elapsed = time.perf_counter() - start
+            print(f"mmap {backend:5} {2 * os.path.getsize(data_file) / 2**20:.0f} MiB: {elapsed * 1000:.1f} ms, "
+                  f"output {stdout.getvalue().strip()}")
+
+
+def bench_optimize(levels=(0, 1, 2, 3)):
+    """Размер кода и такты golden-программ на каждом уровне оптимизаций, сокращение - относительно -O0."""
+    for name, source, stdin, is_char_io in benchmark_programs([("constants", CONSTANTS_SOURCE, "50", 0)]):
+        results = [measure(source, stdin, is_char_io, level) for level in levels]
+        ticks = results[0][1]
+        print(f"optimize {name:20}", ", ".join(
+            f"-O{level} {size} words {tick} ticks ({(ticks - tick) / ticks:.1%})"
+            for level, (size, tick) in zip(levels, results, strict=True)))
+
+
+def bench_inline(level=2, thresholds=(0, 8, 16, 32)):
+    """Рост кода против выигрыша в тактах от подстановки функций: по порогам --inline, относительно 0."""
+    for name, source, stdin, is_char_io in benchmark_programs([("helpers", HELPERS_SOURCE, "40", 0)]):
+        results = [measure(source, stdin, is_char_io, level, threshold) for threshold in thresholds]
+        size, ticks = results[0]
+        print(f"inline {name:20}", ", ".join(
+            f"--inline {threshold} {words} words ({words - size:+}) {tick} ticks ({(ticks - tick) / ticks:.1%})"
+            for threshold, (words, tick) in zip(thresholds, results, strict=True)))
+
+
+BENCHMARKS = {
+    "microcode": bench_microcode,
+    "fast": bench_fast,
+    "trace": bench_trace,
+    "parse": bench_parse,
+    "tokenize": bench_tokenize,
+    "optimize": bench_optimize,
+    "inline": bench_inline,
+    "codecs": bench_codecs,
+    "mmap": bench_mmap,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
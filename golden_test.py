@@ -4,13 +4,27 @@
 """
 
 import contextlib
+import dataclasses
 import io
+import json
 import logging
 import os
+import sys
 import tempfile
 
+import batch
+import cache
+import container
+import devices
+import enums
+import isa
+import layout
 import machine
+import microcoverage
+import profiler
 import pytest
+import tracer
+import translation_cache
 import translator
 
 MAX_LOG = 50000
@@ -83,4 +97,823 @@ def test_translator_and_machine(golden, caplog):
         assert code == golden.out["out_code"]
         assert code_hex == golden.out["out_code_hex"]
         assert stdout.getvalue() == golden.out["out_stdout"]
-        assert caplog.text[0:MAX_LOG] + "EOF" == golden.out["out_log"]
\ No newline at end of file
+        assert caplog.text[0:MAX_LOG] + "EOF" == golden.out["out_log"]
+
+def translate_golden(golden, tmpdirname):
+    """Транслирует программу из golden-файла и возвращает код, данные и ввод процессора."""
+    source = os.path.join(tmpdirname, "source.bf")
+    target = os.path.join(tmpdirname, "target.bin")
+    with open(source, "w", encoding="utf-8") as file:
+        file.write(golden["in_source"])
+    with contextlib.redirect_stdout(io.StringIO()):
+        translator.main(source, target)
+    with open(target, "rb") as file:
+        _, binary_code = layout.split_header(file.read())
+        code = machine.from_bytes(binary_code)
+    with open(target + "_data.bin", "rb") as file:
+        data = machine.from_bytes_data(file.read())
+
+    if golden["is_char_io"]:
+        input_tokens = [ord(ch) for ch in golden["in_stdin"] + "\0"]
+    elif golden["in_stdin"] != "":
+        input_tokens = [int(num) for num in golden["in_stdin"].split("\n")]
+    else:
+        input_tokens = []
+    return code, data, input_tokens
+
+
+def datapath_state(datapath):
+    alu = datapath.alu
+    return (
+        repr(datapath),
+        datapath.tick,
+        dict(datapath.registers.registers_value),
+        alu._ALU__left_term,
+        alu._ALU__right_term,
+        alu.result,
+        dict(alu.flags),
+        datapath.address_register,
+        datapath.data_register,
+        datapath.src_left_register,
+        datapath.src_right_register,
+        datapath.dst_register,
+        datapath.selected_flag,
+        datapath.inverse_flag,
+        datapath.jump_register,
+        datapath.control_unit.mprogram_counter,
+        datapath.control_unit.n,
+        list(datapath.output_device.values),
+        datapath.memory.cells(),
+    )
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_compiled_microcode_matches_signals(golden):
+    """Скомпилированная микропрограмма должна совпадать по тактам с исполнением через execute_signal."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        code, data, input_tokens = translate_golden(golden, tmpdirname)
+
+    reference = machine.load_datapath(400, 401, code, data, list(input_tokens))
+    compiled = machine.load_datapath(400, 401, code, data, list(input_tokens))
+    control_unit = reference.control_unit
+
+    halted = False
+    while not halted and reference.tick < machine.MAX_CYCLES:
+        mpc_now = control_unit.mprogram_counter
+        signal, *maybe_sel = control_unit.mprogram[mpc_now]
+        try:
+            if maybe_sel and maybe_sel[0] is not None:
+                control_unit.execute_signal(signal, maybe_sel[0])
+            else:
+                control_unit.execute_signal(signal)
+            reference.tick += 1
+            if control_unit.mprogram_counter == mpc_now:
+                control_unit.mprogram_counter += 1
+        except machine.HltError:
+            halted = True
+
+        with pytest.raises(machine.HltError) if halted else contextlib.nullcontext():
+            compiled.control_unit.run_single_micro()
+        assert datapath_state(compiled) == datapath_state(reference)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_fast_simulation_matches_microcode(golden):
+    """Покомандная модель должна совпадать с микропрограммной на каждой границе инструкций."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        code, data, input_tokens = translate_golden(golden, tmpdirname)
+
+    reference = machine.load_datapath(400, 401, code, data, list(input_tokens))
+    fast = machine.load_datapath(400, 401, code, data, list(input_tokens))
+    simulator = machine.InstructionSimulator(fast)
+    control_unit = reference.control_unit
+
+    halted = False
+    while not halted and reference.tick < machine.MAX_CYCLES:
+        try:
+            control_unit.run_single_micro()
+            while control_unit.mprogram_counter != 0 and reference.tick < machine.MAX_CYCLES:
+                control_unit.run_single_micro()
+        except machine.HltError:
+            halted = True
+
+        with pytest.raises(machine.HltError) if halted else contextlib.nullcontext():
+            simulator.step(machine.MAX_CYCLES)
+        assert datapath_state(fast) == datapath_state(reference)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_tracer_matches_debug_log(golden, caplog):
+    """Пошаговая трассировка в буфер должна совпадать с отладочным журналом модели."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        code, data, input_tokens = translate_golden(golden, tmpdirname)
+
+    caplog.set_level(logging.DEBUG)
+    machine.simulation(400, 401, code, data, list(input_tokens), golden["is_char_io"])
+    states = [record.message for record in caplog.records if record.message.startswith("TICK")]
+
+    sink = tracer.RingBufferSink(capacity=machine.MAX_CYCLES)
+    trace = tracer.Tracer(sink, tracer.Granularity.MICRO)
+    machine.simulation(400, 401, code, data, list(input_tokens), golden["is_char_io"], tracer=trace)
+    assert list(sink.records) == states
+
+
+@pytest.mark.golden_test("golden/*.yml")
+@pytest.mark.parametrize("fast", [False, True])
+def test_snapshot_resume_matches_single_run(golden, fast):
+    """Исполнение кусками по бюджету тактов со снимком между кусками совпадает с исполнением за один раз."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        code, data, input_tokens = translate_golden(golden, tmpdirname)
+
+    assert_resume_matches_single_run(code, data, input_tokens, fast, 997)
+
+
+@pytest.mark.parametrize("fast", [False, True])
+@pytest.mark.parametrize("budget", [7, 97])
+def test_snapshot_resume_nary(fast, budget):
+    """Снимок посреди N-арной инструкции сохраняет N операндов и счетчик N."""
+    code, data = translator.translate("""(begin
+        (setq a 1) (setq b 2) (setq c 3) (setq s 0) (setq i 0)
+        (while (<= i 3) (begin (setq s (+ s a b c)) (setq i (+ i 1))))
+        (print s))""")
+    assert any(isinstance(word, isa.Instruction) and word.n for word in code)
+    datapath = assert_resume_matches_single_run(code, data, [], fast, budget)
+    assert datapath.output_device.values == [24]
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_snapshot_resume_wide_values(fast):
+    """Снимок хранит значения за пределами 64 бит: АЛУ их не обрезает."""
+    code, data = translator.translate("""(begin
+        (setq y (* 100000 100000))
+        (setq y (* y 1000000000))
+        (setq z (- 0 y))
+        (setq i 0)
+        (while (<= i 3) (begin (setq y (* y 7)) (setq i (+ i 1))))
+        (print y)
+        (print z))""")
+    datapath = assert_resume_matches_single_run(code, data, [], fast, 300)
+    assert datapath.output_device.values == [10**19 * 7**4, -10**19]
+
+
+def assert_resume_matches_single_run(code, data, input_tokens, fast, budget):
+    reference = machine.load_datapath(400, 401, code, data, list(input_tokens))
+    machine.run_datapath(reference, fast=fast)
+
+    datapath = machine.load_datapath(400, 401, code, data, list(input_tokens))
+    while not machine.run_datapath(datapath, fast=fast, max_cycles=budget) and datapath.tick < machine.MAX_CYCLES:
+        snapshot = datapath.snapshot()
+        datapath = machine.load_datapath(400, 401, [], [], list(input_tokens))
+        datapath.restore(snapshot)
+    assert datapath_state(datapath) == datapath_state(reference)
+    return datapath
+
+
+@pytest.mark.golden_test("golden/*.yml")
+@pytest.mark.parametrize("binary", [False, True])
+def test_stream_devices_match_lists(golden, binary):
+    """Ввод мелкими кусками из потока и вывод через маленький буфер дают тот же результат, что и списки."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        code, data, input_tokens = translate_golden(golden, tmpdirname)
+    is_char = bool(golden["is_char_io"])
+
+    reference = machine.load_datapath(400, 401, code, data, list(input_tokens))
+    machine.run_datapath(reference)
+
+    text = golden["in_stdin"]
+    stream = io.BytesIO(text.encode()) if binary else io.StringIO(text)
+    output = io.StringIO()
+    output_device = devices.StreamOutput(output, is_char=is_char, buffer_size=2)
+    datapath = machine.load_datapath(400, 401, code, data, devices.StreamInput(stream, is_char=is_char, chunk_size=3),
+                                     output_device=output_device)
+    machine.run_datapath(datapath)
+    output_device.close()
+    assert datapath.input_device.position == reference.input_device.position
+    assert output.getvalue() == machine.format_output(reference.output_device.values, is_char)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_batch_matches_simulation(golden, tmp_path):
+    """Пакетный прогон транслирует исходник один раз и дает тот же вывод и такты, что и simulation."""
+    (tmp_path / "source.lisp").write_text(golden["in_source"], encoding="utf-8")
+    (tmp_path / "input.txt").write_text(golden["in_stdin"], encoding="utf-8")
+    manifest = tmp_path / "manifest.jsonl"
+    job = {"source": "source.lisp", "input": "input.txt", "is_char_io": golden["is_char_io"]}
+    budget = 100
+    manifest.write_text(f"{json.dumps(job)}\n{json.dumps({**job, 'max_cycles': budget})}\n", encoding="utf-8")
+    batch.main(str(manifest), str(tmp_path / "results.jsonl"), workers=2)
+    full, limited = (json.loads(line) for line in (tmp_path / "results.jsonl").read_text().splitlines())
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        code, data, input_tokens = translate_golden(golden, tmpdirname)
+    reference = machine.load_datapath(400, 401, code, data, list(input_tokens))
+    machine.run_datapath(reference, fast=True)
+    assert full["status"] == "halted"
+    assert full["output"] == machine.format_output(reference.output_device.values, golden["is_char_io"])
+    assert full["ticks"] == reference.tick
+    assert full["instructions"] > 0
+    assert limited["status"] == "cycle-limit"
+    assert limited["ticks"] >= budget
+
+
+def test_parser_positions_and_depth():
+    tokenizer, parser = translator.Tokenizer(), translator.Parser()
+    assert tokenizer.tokenize('(print "a\nb")\n  x')[-1] == translator.Token("x", 3, 3)
+    with pytest.raises(SyntaxError, match="unclosed '\\(' at line 2, column 3"):
+        parser.parse(tokenizer.tokenize("(begin\n  (print 1"))
+    with pytest.raises(SyntaxError, match="unexpected '\\)' at line 1, column 2"):
+        parser.parse(tokenizer.tokenize(" )"))
+
+    depth = 10 * sys.getrecursionlimit()
+    expression = parser.parse(tokenizer.tokenize("(+ " * depth + "1" + ")" * depth))
+    for _ in range(depth):
+        expression = expression.operands[0]
+    assert expression == translator.Atom(translator.Number(1))
+
+
+def test_streaming_tokenizer_chunks():
+    """Токены и строки, разрезанные границей куска, и комментарии разбираются так же, как для целого текста."""
+    source = '(begin ; comment (print 1)\n  (print "a;b \\" c")\n  (setq long_name 12345)) ; tail'
+    tokenizer = translator.Tokenizer()
+    expected = tokenizer.tokenize(source)
+    assert [token.text for token in expected] == [
+        "(", "begin", "(", "print", '"a;b \\" c"', ")", "(", "setq", "long_name", "12345", ")", ")",
+    ]
+    for chunk_size in range(1, 8):
+        assert list(tokenizer.stream(io.StringIO(source), chunk_size)) == expected
+
+
+def test_translation_cache(tmp_path, monkeypatch):
+    """Повторная трансляция того же исходника берется из кэша, не запуская транслятор."""
+    source = tmp_path / "source.lisp"
+    source.write_text("(print 42)", encoding="utf-8")
+    cache = translation_cache.TranslationCache(tmp_path / "cache")
+    translator.main(str(source), str(tmp_path / "a.bin"), cache=cache)
+
+    def fail(*_args: object) -> None:
+        raise AssertionError
+
+    monkeypatch.setattr(translator, "build", fail)
+    translator.main(str(source), str(tmp_path / "b.bin"), cache=cache)
+    for suffix in (".bin", ".bin.hex", ".bin_data.bin"):
+        assert (tmp_path / f"a{suffix}").read_bytes() == (tmp_path / f"b{suffix}").read_bytes()
+
+    # другая карта памяти - другой ключ
+    with pytest.raises(AssertionError):
+        translator.main(str(source), str(tmp_path / "c.bin"), layout.sized_layout(1000), cache=cache)
+    monkeypatch.undo()
+
+    cache.max_bytes = 0
+    source.write_text("(print 43)", encoding="utf-8")
+    translator.main(str(source), str(tmp_path / "c.bin"), cache=cache)
+    assert list((tmp_path / "cache").iterdir()) == []
+
+
+@pytest.mark.golden_test("golden/*.yml")
+@pytest.mark.parametrize(("compress", "memory_backend"), [(False, "list"), (True, "list"), (False, "mmap")])
+def test_executable_container(golden, tmp_path, compress, memory_backend):
+    """Контейнер исполняется так же, как бинарный код и файл данных."""
+    source, stdin = tmp_path / "source.lisp", tmp_path / "input.txt"
+    source.write_text(golden["in_source"], encoding="utf-8")
+    stdin.write_text(golden["in_stdin"], encoding="utf-8")
+    translator.main(str(source), str(tmp_path / "target.bin"))
+    translator.main(str(source), str(tmp_path / "target.csx"), executable=True, compress=compress)
+    outputs = []
+    for code_file, data_file in ((tmp_path / "target.bin", tmp_path / "target.bin_data.bin"),
+                                 (tmp_path / "target.csx", None)):
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            machine.main(str(code_file), data_file and str(data_file), str(stdin), None, None, golden["is_char_io"],
+                         fast=True, memory_backend=memory_backend)
+        outputs.append(stdout.getvalue())
+    assert outputs[0] == outputs[1]
+
+
+def test_container_symbols_and_lines():
+    source = """(begin
+        (defun square (begin x)
+            (begin (* x x)))
+        (setq a 3)
+        (print (square a)))"""
+    for optimization in (0, 1):
+        code, data, symbols, lines = translator.translate_program(source, optimization=optimization)
+        executable = container.unpack(translator.build(source, optimization=optimization).executable)
+        assert bytes(executable.text) == translator.to_bytes(code)
+        assert bytes(executable.data) == translator.to_bytes(data)
+        assert executable.symbols == symbols
+        assert executable.lines == lines
+        assert executable.entry == 0
+
+        square = next(symbol for symbol in symbols if symbol.name == "square")
+        assert square.kind == container.SymbolKind.FUNCTION
+        assert code[square.address + square.size - 1].opcode == isa.Opcode.RET
+        assert container.SymbolEntry(container.SymbolKind.VARIABLE, 201, 1, "a") in symbols  # 200 - параметр x
+        # тело функции - со строки 3, вызов и печать - со строки 5
+        assert [line for address, line in lines if square.address <= address < square.address + square.size] == [3, 2]
+        assert [line for _, line in lines][-2:] == [5, 0]
+        assert [address for address, _ in lines] == sorted({address for address, _ in lines})
+
+    with pytest.raises(ValueError, match="Not an executable container"):
+        container.unpack(b"CSA4")
+
+
+def test_profiler():
+    """Такты профиля равны счетчику тактов модели; покомандная и микропрограммная модели дают одинаковый профиль."""
+    source = """(begin
+        (defun fact (begin n)
+            (begin (cond (<= n 1) 1 (> n 1) (* n (fact (- n 1))))))
+        (setq i 1)
+        (while (<= i 4)
+            (print (fact i))
+            (setq i (+ i 1))))"""
+    code, data, symbols, lines = translator.translate_program(source, optimization=1)
+    profiles = []
+    for fast in (False, True):
+        profile = profiler.Profiler(symbols, lines)
+        datapath = machine.load_datapath(400, 401, code, data, [])
+        machine.run_datapath(datapath, fast=fast, profiler=profile)
+        assert machine.format_output(datapath.output_device.values, 0) == "1 2 6 24"
+        assert sum(profile.ticks.values()) == datapath.tick
+        profiles.append((profile.report(), profile.collapsed()))
+    assert profiles[0] == profiles[1]
+
+    assert profile.by_opcode()["CALL"][0] == 1 + 2 + 3 + 4
+    functions = profile.by_function()
+    assert functions[profiler.ROOT_FRAME][1] == datapath.tick
+    assert functions["fact"][0] == functions["fact"][1] < datapath.tick
+    stacks = [line.rsplit(" ", 1) for line in profile.collapsed().splitlines()]
+    assert sum(int(ticks) for _, ticks in stacks) == datapath.tick
+    assert max(stack.count("fact") for stack, _ in stacks) == 4
+    assert {stack.split(";")[-1] for stack, _ in stacks} <= {"line ?", *(f"line {line}" for line in range(1, 8))}
+    assert profile.by_line()[3] > profile.by_line()[5]
+
+    # трассировка идет мимо profiled_run: вместе они не включаются, выключенный трассировщик не мешает
+    trace = tracer.Tracer(tracer.RingBufferSink(capacity=16), tracer.Granularity.INSTRUCTION)
+    datapath = machine.load_datapath(400, 401, code, data, [])
+    with pytest.raises(ValueError, match="Profiler and tracer"):
+        machine.run_datapath(datapath, profiler=profiler.Profiler(symbols, lines), tracer=trace)
+    profile = profiler.Profiler(symbols, lines)
+    trace = tracer.Tracer(tracer.RingBufferSink(capacity=16), tracer.Granularity.NONE)
+    machine.run_datapath(datapath, profiler=profile, tracer=trace)
+    assert sum(profile.ticks.values()) == datapath.tick
+
+
+def test_microcode_coverage():
+    """Счетчики микроадресов одинаковы при исполнении через run и по одной микрокоманде, как при включенном кэше."""
+    code, data, _, _ = translator.translate_program(
+        "(begin (setq i 1) (while (<= i 5) (begin (print (* i i)) (setq i (+ i 1)))))", optimization=1)
+    coverages, ticks = [], []
+    for cache_config in (None, cache.CacheConfig()):
+        coverage = microcoverage.MicrocodeCoverage(machine.DECODE_PLANS)
+        datapath = machine.load_datapath(400, 401, code, data, [], cache_config=cache_config)
+        compiled = datapath.control_unit.compiled_mprogram
+        coverage.attach(datapath.control_unit)
+        assert machine.run_datapath(datapath)
+        coverage.detach(datapath.control_unit)
+        assert datapath.control_unit.compiled_mprogram is compiled
+        assert machine.format_output(datapath.output_device.values, 0) == "1 4 9 16 25"
+        coverages.append(coverage)
+        ticks.append(datapath.tick)
+    assert coverages[0].counts == coverages[1].counts
+    # HLT исполняется, но такта не добавляет
+    assert sum(coverage.counts) == ticks[0] + 1
+
+    dead = set(coverage.dead())
+    assert not any(coverage.counts[address] for address in dead)
+    fetch = coverage.by_segment()[0]
+    assert fetch[1] == sum(row[1] for row in coverage.by_segment()[1:]) - sum(coverage.fall_through.values())
+    copy = ((enums.Signal.LATCH_LEFT_ALU, enums.Sel.LeftALU.ZERO), (enums.Signal.LATCH_RIGHT_ALU, enums.Sel.RightALU.DR),
+            (enums.Signal.EXECUTE_ALU, enums.ALUOperations.ADD))
+    assert coverage.sequences()[copy][0] > 1
+    assert "LATCH_LEFT_ALU ZERO / LATCH_RIGHT_ALU DR / EXECUTE_ALU ADD" in coverage.report()
+
+
+def run_optimized(source, input_tokens, is_char_io, optimization, inline_threshold=None):
+    """Трансляция на заданном уровне оптимизаций и прогон: вывод, такты и размер кода."""
+    code, data = translator.translate(source, layout.DEFAULT_LAYOUT, optimization, inline_threshold)
+    datapath = machine.load_datapath(400, 401, code, data, list(input_tokens))
+    machine.run_datapath(datapath, fast=True)
+    return machine.format_output(datapath.output_device.values, is_char_io), datapath.tick, len(code)
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_optimized_goldens(golden):
+    """Вывод на всех уровнях одинаков; такты и размер кода по уровням записаны в out_optimized."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        _, _, input_tokens = translate_golden(golden, tmpdirname)
+
+    output, ticks, words = run_optimized(golden["in_source"], input_tokens, golden["is_char_io"], 0)
+    levels = [f"O0: {ticks} ticks, {words} words"]
+    for optimization in (1, 2, 3):
+        optimized_output, optimized_ticks, optimized_words = run_optimized(
+            golden["in_source"], input_tokens, golden["is_char_io"], optimization)
+        assert optimized_output == output
+        assert optimized_ticks <= ticks
+        # подстановка функций обменивает размер кода на такты, остальные оптимизации код не увеличивают
+        assert optimized_words <= words or run_optimized(
+            golden["in_source"], input_tokens, golden["is_char_io"], optimization, 0)[2] <= words
+        levels.append(f"O{optimization}: {optimized_ticks} ticks, {optimized_words} words")
+    assert "\n".join(levels) + "\n" == golden.out["out_optimized"]
+
+
+@pytest.mark.golden_test("golden/constants.yml")
+def test_optimized_constants(golden):
+    """-O1 сворачивает константы в цикле и удаляет ветвь и цикл, условие которых всегда ложно."""
+    results = [run_optimized(golden["in_source"], [], 0, optimization) for optimization in (0, 1)]
+    assert results[0][0] == results[1][0] == "86400 172800 259200 345600 432000 518400 604800"
+    (_, ticks, words), (_, optimized_ticks, optimized_words) = results
+    assert optimized_words * 2 <= words
+    assert optimized_ticks * 3 <= ticks * 2
+
+
+def test_optimizer_folds_and_removes_dead_code():
+    source = """(begin
+        (defun helper (begin a) (begin (+ a 1)))
+        (defun unused (begin a) (begin (helper a)))
+        (defun twice (begin a) (begin (* a 2)))
+        (setq x input)
+        (+ x 1)
+        (print (twice x))
+        (print (* (+ 1 2) (- 10 4)))
+        (cond (== 1 2) (print 100) (> 1 2) (print 200))
+        (while (> 1 2) (print 300))
+    )"""
+    results = [run_optimized(source, [5], 0, optimization) for optimization in (0, 1, 2)]
+    # cond с == исполняет тело при разных операндах (Generator.handle_cond меняет == и !=)
+    assert [output for output, _, _ in results] == ["10 18 100"] * 3
+    assert results[0][1] > results[1][1] > results[2][1]
+    assert results[0][2] > results[1][2] > results[2][2]
+
+    tokens = translator.Tokenizer().tokenize("(print (* (+ 1 2) (- 10 x)))")
+    expression = translator.Optimizer(1, ["print"]).optimize(translator.Parser().parse(tokens))
+    assert expression.operands[0].operands[0] == translator.Atom(translator.Number(3))
+
+
+def test_loop_registers():
+    """-O3: переменные циклов на время цикла в регистрах, в памяти - только до и после цикла."""
+    source = """(begin
+        (setq s 0)
+        (setq i 0)
+        (while (> 10 i)
+            (setq j 0)
+            (while (> i j) (setq s (+ s j)) (setq j (+ j 1)))
+            (setq i (+ i 1)))
+        (print s)
+        (print j)
+    )"""
+    results = [run_optimized(source, [], 0, optimization) for optimization in (2, 3)]
+    assert [output for output, _, _ in results] == ["120 9"] * 2
+    assert results[1][1] * 5 < results[0][1] * 3
+
+    code, _ = translator.translate(source, layout.DEFAULT_LAYOUT, 3)
+    instructions = [word for word in code if isinstance(word, isa.Instruction)]
+    jumps = [index for index, word in enumerate(instructions) if word.opcode == isa.Opcode.JMP_imm]
+    # внутри внешнего цикла (от первой загрузки до последнего перехода назад) к памяти не обращаются
+    loop = instructions[[word.opcode for word in instructions].index(isa.Opcode.BGZ):jumps[-1]]
+    assert not {word.opcode for word in loop} & {isa.Opcode.MOV_da2r, isa.Opcode.STORE_r2da}
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_stack_frames(fast):
+    """Параметры и локальные переменные функций - в кадре на стеке, свои для каждого рекурсивного вызова."""
+    source = """(begin
+        (defun fib (begin n)
+            (begin
+                (cond (<= n 1) (setq a n)
+                      (> n 1) (setq a (+ (fib (- n 1)) (fib (- n 2)))))
+                a))
+        (defun sum (begin n)
+            (begin
+                (setq t (* n 10))
+                (cond (<= n 0) (setq r 0)
+                      (> n 0) (setq r (+ t (sum (- n 1)))))
+                r))
+        (print (fib 6))
+        (print (sum 3))
+    )"""
+    code, data = translator.translate(source)
+    opcodes = {word.opcode for word in code if isinstance(word, isa.Instruction)}
+    assert {isa.Opcode.MOV_rel2r, isa.Opcode.STORE_r2rel} <= opcodes
+    assert not data  # статических ячеек под переменные функций нет
+
+    datapath = machine.load_datapath(400, 401, code, data, [])
+    machine.run_datapath(datapath, fast=fast)
+    assert machine.format_output(datapath.output_device.values, 0) == "8 60"
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_static_functions(fast):
+    """Переменные нерекурсивных функций - статические ячейки, кадр получают только рекурсивные."""
+    source = """(begin
+        (defun add (begin a b)
+            (begin
+                (setq s (+ a b))
+                s))
+        (defun pick (begin n)
+            (begin (cond (<= n 0) 0
+                         (== (add n 0) 1) 10
+                         (> n 1) (add n 100))))
+        (defun depth (begin n)
+            (begin
+                (setq half (/ n 2))
+                (setq rest (- n half))
+                (cond (<= n 1) n
+                      (> n 1) (+ (depth half) (depth rest)))))
+        (print (add (add 1 2) (add 3 4)))
+        (print (pick 1))
+        (print (pick 5))
+        (print (depth 7))
+    )"""
+    code, data, symbols, _ = translator.translate_program(source)
+    functions = {symbol.name: symbol for symbol in symbols if symbol.kind == container.SymbolKind.FUNCTION}
+    for name, frame in (("add", False), ("pick", False), ("depth", True)):
+        start = functions[name].address
+        end = start + functions[name].size
+        body = {word.opcode for word in code[start:end] if isinstance(word, isa.Instruction)}
+        assert (isa.Opcode.MOV_rel2r in body) == frame, name
+        assert code[end - 1].opcode == isa.Opcode.RET
+
+    datapath = machine.load_datapath(400, 401, code, data, [])
+    machine.run_datapath(datapath, fast=fast)
+    assert machine.format_output(datapath.output_device.values, 0) == "10 10 105 7"
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_tail_calls(fast):
+    """Хвостовой самовызов - переход на начало функции: 300 вызовов не помещались бы в стек из 224 слов."""
+    source = """(begin
+        (defun sum (begin n acc)
+            (begin (cond (<= n 0) acc
+                         (> n 0) (sum (- n 1) (+ acc n)))))
+        (print (sum 300 0))
+    )"""
+    code, data = translator.translate(source)
+    assert [word.opcode for word in code if isinstance(word, isa.Instruction)].count(isa.Opcode.CALL) == 1
+
+    datapath = machine.load_datapath(400, 401, code, data, [])
+    assert machine.run_datapath(datapath, fast=fast, max_cycles=100_000)
+    assert machine.format_output(datapath.output_device.values, 0) == "45150"
+    assert datapath.registers[machine.Registers.Registers.RSP] == layout.DEFAULT_LAYOUT.stack_top
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_inline(fast):
+    """При -O2 маленькие функции подставляются в место вызова (и вложенные вызовы тоже), --inline 0 это отключает."""
+    source = """(begin
+        (defun square (begin x) (begin (* x x)))
+        (defun step (begin acc x) (begin (+ acc (square x))))
+        (setq i 0)
+        (setq acc 0)
+        (while (<= i 5)
+            (setq acc (step acc i))
+            (setq i (+ i 1)))
+        (print acc)
+    )"""
+    ticks = []
+    for inline_threshold in (0, None):
+        code, data = translator.translate(source, layout.DEFAULT_LAYOUT, 2, inline_threshold)
+        calls = [word.opcode for word in code if isinstance(word, isa.Instruction)].count(isa.Opcode.CALL)
+        assert calls == (2 if inline_threshold == 0 else 0)
+
+        datapath = machine.load_datapath(400, 401, code, data, [])
+        assert machine.run_datapath(datapath, fast=fast)
+        assert machine.format_output(datapath.output_device.values, 0) == "55"
+        ticks.append(datapath.tick)
+    assert ticks[1] < ticks[0]
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_nary_operations(fast):
+    """(op a b c ...) - левая свертка; переменные в памяти после первого операнда читает одна N-арная инструкция."""
+    source = """(begin
+        (setq a 12) (setq b 5) (setq c 3) (setq d 6)
+        (print (+ a b c d))
+        (print (- a b c d))
+        (print (* a b c d))
+        (print (& a d b d))
+        (print (| a b c d))
+        (print (^ a b c d))
+        (print (+ 1 a b))
+        (print (- (* a 2) b c (+ d 1)))
+    )"""
+    code, data = translator.translate(source)
+    opcodes = [word.opcode for word in code if isinstance(word, isa.Instruction)]
+    assert set(isa.N_ARY_OPCODES) <= set(opcodes)
+    assert machine.from_bytes(translator.to_bytes(code)) == code
+
+    datapath = machine.load_datapath(400, 401, code, data, [])
+    assert machine.run_datapath(datapath, fast=fast)
+    assert machine.format_output(datapath.output_device.values, 0) == "26 -2 1080 4 15 12 18 9"
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_peephole(fast):
+    """Окно из двух инструкций переписывается, адрес перехода в цикл пересчитывается."""
+    r1, r2, r3 = machine.Registers.Registers.R1, machine.Registers.Registers.R2, machine.Registers.Registers.R3
+    opcode, instruction, term = isa.Opcode, isa.Instruction, isa.Term
+    code = [
+        instruction(opcode.MOV_da2r, [term(r1)]), 200,
+        instruction(opcode.STORE_r2da, [term(r1)]), 201,
+        instruction(opcode.MOV_da2r, [term(r2)]), 201,  # MOV_r2r R2 R1
+        instruction(opcode.MOV_imm2r, [term(r3)]), 1,
+        instruction(opcode.ADD_reg2reg, [term(r2), term(r2), term(r3)]),  # INC_r R2
+        instruction(opcode.MOV_da2r, [term(r3)]), 201,
+        instruction(opcode.ADD_reg2reg, [term(r2), term(r3), term(r2)]),  # ADD_mix2reg R2 R2 201
+        instruction(opcode.MOV_da2r, [term(r3)]), 201,
+        instruction(opcode.SUB_reg2reg, [term(r2), term(r2), term(r3)]),  # SUB_mix2reg1 R2 R2 201
+        instruction(opcode.STORE_r2da, [term(r2)]), 401,  # 15: начало цикла
+        instruction(opcode.MOV_imm2r, [term(r3)]), 1,
+        instruction(opcode.SUB_reg2reg, [term(r2), term(r2), term(r3)]),  # DEC_r R2
+        instruction(opcode.MOV_imm2r, [term(r3)]), 0,
+        instruction(opcode.BEQZ, [term(r2)]), 15,
+        instruction(opcode.JMP_imm, []), 26,  # на следующую инструкцию
+        instruction(opcode.MOV_r2r, [term(r1), term(r1)]),
+    ]
+    program = list(code)
+    end = translator.Peephole().optimize(program, 0, len(program))
+    assert [word.opcode for word in program[:end] if isinstance(word, isa.Instruction)] == [
+        opcode.MOV_da2r, opcode.STORE_r2da, opcode.MOV_r2r, opcode.INC_r, opcode.ADD_mix2reg2, opcode.SUB_mix2reg1,
+        opcode.STORE_r2da, opcode.DEC_r, opcode.MOV_imm2r, opcode.BEQZ,
+    ]
+
+    results = []
+    for optimized in (code, program[:end]):
+        datapath = machine.load_datapath(400, 401, [*optimized, instruction(opcode.HLT, [])], [5], [])
+        assert machine.run_datapath(datapath, fast=fast, max_cycles=1000)
+        results.append((datapath.output_device.values, datapath.tick))
+    assert results[0][0] == results[1][0] == [6, 5, 4, 3, 2, 1]
+    assert results[1][1] < results[0][1]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_array_memory_matches_list_memory(golden):
+    """Программы из golden-тестов укладываются в 32-битные слова и ведут себя одинаково на обеих памятях."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        code, data, input_tokens = translate_golden(golden, tmpdirname)
+
+    reference = machine.load_datapath(400, 401, code, data, list(input_tokens))
+    machine.run_datapath(reference)
+    datapath = machine.load_datapath(400, 401, code, data, list(input_tokens), memory_backend="array")
+    machine.run_datapath(datapath, fast=True)
+    assert datapath_state(datapath) == datapath_state(reference)
+
+
+def test_array_memory_signed_words():
+    memory = machine.ArrayMemory(4)
+    memory.write(0, 2**32 + 5)
+    memory.write(1, -1)
+    memory.write(2, machine.from_bytes(bytes([0x01, 0x00, 0x00, 0x00]))[0])
+    assert memory.read(0) == 2**32 + 5
+    assert memory.read(1) == -1
+    assert memory.read(2) == machine.decode_instruction(0x01000000)
+    assert memory[machine.Address(0)] == 2**32 + 5
+    with pytest.raises(ValueError, match="does not fit"):
+        memory.write(3, 2**63)
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_array_memory_negative_and_wide_values(fast):
+    """Отрицательные и не помещающиеся в 32 бита значения проходят через память так же, как в списке."""
+    source = """(begin
+        (setq x (- 1 3))
+        (print x)
+        (print (+ x 5))
+        (setq y (* 100000 100000))
+        (print y)
+        (print (- 0 y)))"""
+    code, data = translator.translate(source)
+    outputs = []
+    for backend in ("list", "array"):
+        datapath = machine.load_datapath(400, 401, code, data, [], memory_backend=backend)
+        machine.run_datapath(datapath, fast=fast)
+        outputs.append(machine.format_output(datapath.output_device.values, 0))
+    assert outputs == ["-2 3 10000000000 -10000000000"] * 2
+
+
+def test_word_codecs():
+    code, data = translator.translate("(begin (setq a 2) (setq b 3) (print (+ input a b)))")
+    binary = translator.to_bytes(code)
+    assert binary == b"".join(word.to_bytes(4, "big") for word in machine.encode_program(code))
+    assert machine.from_bytes(binary) == code
+    assert machine.from_bytes(binary + b"\x01\x02") == code
+    assert "".join(translator.to_hex(code)) == binary.hex().upper()
+    assert machine.from_bytes_data(translator.to_bytes([*data, -1, 2**32 + 7])) == [*data, 2**32 - 1, 7]
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_mapped_memory_matches_list_memory(golden):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        code, data, input_tokens = translate_golden(golden, tmpdirname)
+        target = os.path.join(tmpdirname, "target.bin")
+        code_image, data_image = machine.map_file(target), machine.map_file(target + "_data.bin")
+
+    reference = machine.load_datapath(400, 401, code, data, list(input_tokens))
+    machine.run_datapath(reference, fast=True)
+    datapath = machine.load_datapath(400, 401, [], [], list(input_tokens), memory_backend="mmap")
+    datapath.memory.map(0, code_image, layout.read_header(code_image)[1], is_code=True)
+    datapath.memory.map(200, data_image)
+    machine.run_datapath(datapath, fast=True)
+    assert datapath_state(datapath) == datapath_state(reference)
+
+
+def test_mapped_memory_decodes_touched_pages():
+    """Страницы декодируются при обращении, инструкции и значения различаются на любой странице."""
+    code, _ = translator.translate("(begin (setq a 1) (setq b (+ a 2 input)) (print (* a b)))")
+    code *= 10 * machine.PAGE_WORDS // len(code)
+    binary = bytearray(translator.to_bytes(code))
+    memory = machine.MappedMemory(len(code) + 4)
+    memory.map(0, binary, is_code=True)
+    assert memory.read(len(code) - 1) == code[-1]
+    assert sum(page is not None for page in memory.pages) == 1
+
+    memory.write(3, 7)
+    assert memory.read(3) == 7
+    assert machine.from_bytes(binary) == code
+    assert memory.cells() == [*code[:3], 7, *code[4:], 0, 0, 0, 0]
+
+
+def test_large_heap_layout(tmp_path):
+    """Карта памяти из заголовка бинарного файла задает размер памяти и начальные RSP/RHP."""
+    source = tmp_path / "source.lisp"
+    source.write_text("(begin (setq buf (alloc 60000)) (store (+ buf 59999) 42) (print (deref (+ buf 59999))))")
+    (tmp_path / "input.txt").write_text("")
+    target = str(tmp_path / "target.bin")
+    big_layout = layout.sized_layout(heap_size=2**16)
+
+    with contextlib.redirect_stdout(io.StringIO()) as stdout:
+        translator.main(str(source), target, big_layout)
+        machine.main(target, target + "_data.bin", str(tmp_path / "input.txt"), None, None, is_char_io=False)
+    assert stdout.getvalue() == "42\n"
+    with open(target, "rb") as file:
+        assert layout.split_header(file.read())[0] == big_layout
+    assert big_layout.memory_size == 500 + 2**16 + layout.DEFAULT_LAYOUT.stack_size
+
+
+@pytest.mark.golden_test("golden/*.yml")
+@pytest.mark.parametrize("config", [
+    cache.CacheConfig(),
+    cache.CacheConfig(size=16, line_size=2, associativity=1, write_policy=cache.WritePolicy.WRITE_THROUGH),
+    cache.CacheConfig(size=32, associativity=4, replacement=cache.Replacement.FIFO),
+])
+def test_cache_stalls_match_between_models(golden, config):
+    """Покомандная и микропрограммная модели обращаются к кэшу в одном порядке и простаивают одинаково."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        code, data, input_tokens = translate_golden(golden, tmpdirname)
+
+    results = []
+    for fast in (False, True):
+        datapath = machine.load_datapath(400, 401, code, data, list(input_tokens), cache_config=config)
+        # с простоями программа может не уложиться в MAX_CYCLES, а на границе бюджета модели расходятся
+        machine.run_datapath(datapath, fast=fast, max_cycles=10 * machine.MAX_CYCLES)
+        results.append((datapath_state(datapath), datapath.cache.stats))
+    assert results[0] == results[1]
+    assert sum(stats.misses for stats in results[0][1].values()) > 0
+
+
+@pytest.mark.golden_test("golden/*.yml")
+def test_instruction_cache_matches_between_models(golden):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        code, data, input_tokens = translate_golden(golden, tmpdirname)
+
+    results = []
+    for fast in (False, True):
+        datapath = machine.load_datapath(400, 401, code, data, list(input_tokens), cache_config=cache.CacheConfig(),
+                                         icache_config=cache.CacheConfig(size=16, hit_ticks=1))
+        machine.run_datapath(datapath, fast=fast, max_cycles=10 * machine.MAX_CYCLES)
+        results.append((datapath_state(datapath), datapath.cache.stats, datapath.instruction_cache.stats))
+    assert results[0] == results[1]
+    # через кэш инструкций идет только выборка, непосредственные операнды читаются через кэш данных
+    instruction_stats = results[0][2]
+    assert instruction_stats["text"].hits > 0
+    assert all(stats.hits + stats.misses == 0 for name, stats in instruction_stats.items() if name != "text")
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_decoded_instruction_cache_invalidation(fast):
+    """Запись в ячейку, где лежит уже декодированная инструкция, сбрасывает запись кэша декодера."""
+    r1 = machine.Registers.Registers.R1
+    code = [isa.Instruction(isa.Opcode.MOV_imm2r, [isa.Term(r1)]), 7, isa.Instruction(isa.Opcode.JMP_imm, []), 0]
+    datapath = machine.load_datapath(400, 401, code, [], [])
+    assert not machine.run_datapath(datapath, fast=fast, max_cycles=100)
+    assert 0 in datapath.control_unit.decoded
+    while datapath.control_unit.mprogram_counter != 0:
+        datapath.control_unit.run_single_micro()
+
+    datapath.write_memory(0, isa.Instruction(isa.Opcode.HLT, []))
+    assert 0 not in datapath.control_unit.decoded
+    assert machine.run_datapath(datapath, fast=fast, max_cycles=100)
+    assert datapath.program_counter == 0
+
+
+def test_cache_write_policies():
+    config = cache.CacheConfig(size=4, line_size=2, associativity=1, miss_ticks=10, write_ticks=5)
+    write_back = cache.Cache(config, layout.DEFAULT_LAYOUT)
+    assert write_back.access(200, write=True) == 10
+    assert write_back.access(201, write=False) == 0
+    assert write_back.access(204, write=False) == 10 + 5  # вытеснение измененной строки
+    assert write_back.stats["data"] == cache.CacheStats(hits=1, misses=2, evictions=1, writebacks=1, stall_ticks=25)
+
+    write_through = cache.Cache(dataclasses.replace(config, write_policy=cache.WritePolicy.WRITE_THROUGH),
+                                layout.DEFAULT_LAYOUT)
+    assert write_through.access(200, write=True) == 5
+    assert write_through.access(200, write=False) == 10
+    assert write_through.access(200, write=True) == 5
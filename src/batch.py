@@ -0,0 +1,153 @@
+"""Пакетный прогон программ: по манифесту заданий пишет результаты в JSON lines.
+
+Манифест - JSON lines, одно задание на строку: {"source": ..., "input": ..., "is_char_io": 0},
+необязательно "max_cycles" и "timeout". Пути считаются от каталога манифеста.
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import sys
+import time
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from enum import Enum
+from pathlib import Path
+
+import machine
+import translator
+from devices import ListOutput, StreamInput
+from layout import DEFAULT_LAYOUT, split_header
+from translation_cache import DEFAULT_CACHE_DIR, TranslationCache
+
+# как часто (в инструкциях) исполнитель сверяется с часами
+CLOCK_CHECK_INTERVAL = 10_000
+
+
+class Status(Enum):
+    HALTED = "halted"
+    CYCLE_LIMIT = "cycle-limit"
+    TIMEOUT = "timeout"
+    ERROR = "error"
+
+
+@dataclass(frozen=True)
+class Job:
+    source: str
+    input: str
+    is_char_io: int = 0
+    max_cycles: int = machine.MAX_CYCLES
+    timeout: float = 60.0
+
+
+@dataclass
+class JobResult:
+    source: str
+    input: str
+    status: str
+    output: str = ""
+    ticks: int = 0
+    instructions: int = 0
+    wall_time: float = 0.0
+    error: str = ""
+
+
+def read_manifest(path: str, *, max_cycles: int, timeout: float) -> list[Job]:
+    base = Path(path).resolve().parent
+    jobs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            jobs.append(Job(str(base / entry["source"]), str(base / entry["input"]),
+                            entry.get("is_char_io", 0), entry.get("max_cycles", max_cycles),
+                            entry.get("timeout", timeout)))
+    return jobs
+
+
+def translate_source(source: str, cache_dir: str | None = None) -> tuple[bytes, bytes] | str:
+    """Транслирует файл в образы кода (включая заголовок карты памяти) и данных; при ошибке - текст ошибки."""
+    try:
+        with open(source, encoding="utf-8") as f:
+            text = f.read()
+        if cache_dir is None:
+            output = translator.build(text, DEFAULT_LAYOUT)
+        else:
+            output = translator.cached_build(text, DEFAULT_LAYOUT, TranslationCache(cache_dir))
+    except Exception as e:  # noqa: BLE001
+        return f"{type(e).__name__}: {e}"
+    return output.code, output.data
+
+
+def execute(datapath: machine.DataPath, *, fast: bool, max_cycles: int, deadline: float) -> tuple[Status, int]:
+    """Исполняет по инструкциям до HLT, бюджета тактов или deadline, возвращает статус и число инструкций."""
+    tick_limit = datapath.tick + max_cycles
+    step = machine.InstructionSimulator(datapath).step if fast else datapath.control_unit.run_instruction
+    instructions = 0
+    try:
+        while datapath.tick < tick_limit:
+            step(tick_limit)
+            instructions += 1
+            if instructions % CLOCK_CHECK_INTERVAL == 0 and time.monotonic() > deadline:
+                return Status.TIMEOUT, instructions
+    except machine.HltError:
+        return Status.HALTED, instructions
+    return Status.CYCLE_LIMIT, instructions
+
+
+def run_job(job: Job, image: tuple[bytes, bytes] | str, *, fast: bool = True) -> JobResult:
+    if isinstance(image, str):
+        return JobResult(job.source, job.input, Status.ERROR.value, error=image)
+    start = time.monotonic()
+    binary_code, binary_data = image
+    layout, binary_code = split_header(binary_code)
+    try:
+        with open(job.input, encoding="utf-8") as input_stream:
+            datapath = machine.load_datapath(
+                layout.input_port, layout.output_port, machine.from_bytes(binary_code),
+                machine.from_bytes_data(binary_data), StreamInput(input_stream, is_char=bool(job.is_char_io)),
+                output_device=ListOutput(), layout=layout)
+            status, instructions = execute(datapath, fast=fast, max_cycles=job.max_cycles,
+                                           deadline=start + job.timeout)
+    except Exception as e:  # noqa: BLE001
+        return JobResult(job.source, job.input, Status.ERROR.value, error=f"{type(e).__name__}: {e}",
+                         wall_time=time.monotonic() - start)
+    return JobResult(job.source, job.input, status.value,
+                     machine.format_output(datapath.output_device.values, job.is_char_io),
+                     datapath.tick, instructions, time.monotonic() - start)
+
+
+def run_batch(jobs: list[Job], *, workers: int | None = None, fast: bool = True,
+              cache_dir: str | None = None) -> Iterator[JobResult]:
+    """Транслирует каждый исходник один раз и раздает прогоны по процессам; результаты - в порядке заданий."""
+    sources = list(dict.fromkeys(job.source for job in jobs))
+    with ProcessPoolExecutor(workers) as pool:
+        images = dict(zip(sources, pool.map(functools.partial(translate_source, cache_dir=cache_dir), sources), strict=True))
+        yield from pool.map(functools.partial(run_job, fast=fast), jobs, [images[job.source] for job in jobs])
+
+
+def main(manifest, results, *, workers=None, fast=True, max_cycles=machine.MAX_CYCLES, timeout=60.0,
+         cache_dir=None) -> None:
+    jobs = read_manifest(manifest, max_cycles=max_cycles, timeout=timeout)
+    output = contextlib.nullcontext(sys.stdout) if results == "-" else open(results, "w", encoding="utf-8")  # noqa: SIM115
+    with output as f:
+        for result in run_batch(jobs, workers=workers, fast=fast, cache_dir=cache_dir):
+            f.write(json.dumps(asdict(result), ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пакетный прогон программ")
+    parser.add_argument("manifest", help="JSON lines: source, input, is_char_io[, max_cycles, timeout]")
+    parser.add_argument("results", help='куда писать результаты (JSON lines), "-" - stdout')
+    parser.add_argument("--workers", type=int, help="число процессов, по умолчанию - число ядер")
+    parser.add_argument("--microcode", action="store_true", help="микропрограммная модель вместо покомандной")
+    parser.add_argument("--max-cycles", type=int, default=machine.MAX_CYCLES, help="бюджет тактов на задание")
+    parser.add_argument("--timeout", type=float, default=60.0, help="лимит времени на задание, секунды")
+    parser.add_argument("--no-cache", action="store_true", help="не использовать кэш трансляций")
+    parser.add_argument("--cache-dir", default=str(DEFAULT_CACHE_DIR), help="каталог кэша трансляций")
+    args = parser.parse_args()
+    main(args.manifest, args.results, workers=args.workers, fast=not args.microcode,
+         max_cycles=args.max_cycles, timeout=args.timeout, cache_dir=None if args.no_cache else args.cache_dir)
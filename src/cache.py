@@ -0,0 +1,133 @@
+import collections
+import random
+from dataclasses import dataclass, field
+from enum import Enum
+
+from layout import MemoryLayout
+
+
+class Replacement(Enum):
+    LRU = "lru"
+    FIFO = "fifo"
+    RANDOM = "random"
+
+
+class WritePolicy(Enum):
+    WRITE_BACK = "write-back"
+    WRITE_THROUGH = "write-through"
+
+
+@dataclass(frozen=True)
+class CacheConfig:
+    """Параметры кэша: размеры в машинных словах, задержки в тактах."""
+
+    size: int = 64
+    line_size: int = 4
+    associativity: int = 2
+    replacement: Replacement = Replacement.LRU
+    write_policy: WritePolicy = WritePolicy.WRITE_BACK
+    hit_ticks: int = 0
+    miss_ticks: int = 10
+    write_ticks: int = 10
+    seed: int = 0
+
+    def __post_init__(self) -> None:
+        if self.size % (self.line_size * self.associativity) != 0:
+            raise ValueError("Cache size must be a multiple of line_size * associativity")
+
+    @property
+    def sets(self) -> int:
+        return self.size // (self.line_size * self.associativity)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    writebacks: int = 0
+    stall_ticks: int = 0
+
+
+@dataclass
+class Cache:
+    """Модель кэша: хранит только теги строк, данные остаются в памяти.
+
+    access() возвращает число тактов простоя. Статистика ведется по секциям карты памяти;
+    адреса вне секций попадают в "other". Write-back кэш выделяет строку и при записи,
+    write-through кэш при промахе записи строку не выделяет; каждая запись стоит write_ticks.
+    """
+
+    config: CacheConfig
+    layout: MemoryLayout
+    stats: dict[str, CacheStats] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        # по множеству: тег -> строка изменена (порядок ключей - порядок вытеснения)
+        self.lines: list[collections.OrderedDict[int, bool]] = [
+            collections.OrderedDict() for _ in range(self.config.sets)
+        ]
+        self.random = random.Random(self.config.seed)  # noqa: S311
+        self.sections = self.layout.sections()
+        for name in (*self.sections, "other"):
+            self.stats.setdefault(name, CacheStats())
+
+    def section(self, address: int) -> str:
+        for name, section in self.sections.items():
+            if address in section:
+                return name
+        return "other"
+
+    def access(self, address: int, *, write: bool) -> int:
+        config = self.config
+        stats = self.stats[self.section(address)]
+        line = address // config.line_size
+        set_index = line % config.sets
+        lines = self.lines[set_index]
+        tag = line // config.sets
+        write_through = config.write_policy == WritePolicy.WRITE_THROUGH
+
+        if tag in lines:
+            stats.hits += 1
+            stall = config.hit_ticks
+            if config.replacement == Replacement.LRU:
+                lines.move_to_end(tag)
+        else:
+            stats.misses += 1
+            stall = config.miss_ticks
+            if write and write_through:
+                stats.stall_ticks += config.write_ticks
+                return config.write_ticks
+            if len(lines) == config.associativity:
+                stall += self.evict(set_index)
+            lines[tag] = False
+
+        if write_through and write:
+            stall += config.write_ticks
+        elif write:
+            lines[tag] = True
+        stats.stall_ticks += stall
+        return stall
+
+    def evict(self, set_index: int) -> int:
+        """Вытесняет строку из множества, вытеснение учитывается в секции вытесненной строки."""
+        lines = self.lines[set_index]
+        if self.config.replacement == Replacement.RANDOM:
+            victim = self.random.choice(list(lines))
+            dirty = lines.pop(victim)
+        else:
+            victim, dirty = lines.popitem(last=False)
+        stats = self.stats[self.section((victim * self.config.sets + set_index) * self.config.line_size)]
+        stats.evictions += 1
+        if dirty:
+            stats.writebacks += 1
+            return self.config.write_ticks
+        return 0
+
+    def report(self) -> str:
+        rows = [f"{'section':8} {'hits':>8} {'misses':>8} {'evict':>8} {'wback':>8} {'stall':>8}"]
+        for name, stats in self.stats.items():
+            if stats.hits or stats.misses:
+                rows.append(f"{name:8} {stats.hits:8} {stats.misses:8} {stats.evictions:8} "
+                            f"{stats.writebacks:8} {stats.stall_ticks:8}")
+        return "\n".join(rows)
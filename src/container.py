@@ -0,0 +1,117 @@
+"""Исполняемый файл одним контейнером: карта памяти, точка входа, секции кода и данных, таблицы символов и строк.
+
+Формат (числа big-endian):
+- заголовок: MAGIC, версия (u16), флаги (u16), карта памяти (layout.HEADER_FORMAT), точка входа (u32),
+  число секций (u32);
+- таблица секций: имя (8 байт) и размер содержимого в байтах (u32);
+- содержимое секций подряд; если установлен флаг COMPRESSED - одним потоком zlib.
+
+.text и .data - слова, как в translator.to_bytes. .symtab - записи (вид u8, адрес u32, размер u32, длина
+имени u16, имя в utf-8). .lines - пары (адрес u32, строка исходника u32) по возрастанию адреса: код от адреса
+до следующей пары порожден формой, начатой на этой строке; 0 - строка неизвестна.
+"""
+
+import struct
+import zlib
+from dataclasses import astuple, dataclass, field
+from enum import Enum, IntFlag
+from typing import NamedTuple
+
+from layout import HEADER_FORMAT, MemoryLayout
+
+MAGIC = b"CSAX"
+VERSION = 1
+# магия, версия, флаги, карта памяти, точка входа, число секций
+HEADER = f">4sHH{HEADER_FORMAT.removeprefix('>')}II"
+SECTION_ENTRY = ">8sI"
+SYMBOL_ENTRY = ">BIIH"
+LINE_ENTRY = ">II"
+
+
+class Flags(IntFlag):
+    COMPRESSED = 1
+
+
+class SymbolKind(Enum):
+    FUNCTION = 1
+    VARIABLE = 2
+
+
+class SymbolEntry(NamedTuple):
+    kind: SymbolKind
+    address: int
+    size: int
+    name: str
+
+
+@dataclass
+class Executable:
+    """Содержимое контейнера; text и data - слова big-endian (при чтении без сжатия - срезы исходного буфера)."""
+
+    layout: MemoryLayout
+    entry: int
+    text: bytes | memoryview
+    data: bytes | memoryview
+    symbols: list[SymbolEntry] = field(default_factory=list)
+    lines: list[tuple[int, int]] = field(default_factory=list)
+
+
+def is_executable(binary: bytes) -> bool:
+    return binary[:len(MAGIC)] == MAGIC
+
+
+def pack(executable: Executable, *, compress: bool = False) -> bytes:
+    symtab = bytearray()
+    for symbol in executable.symbols:
+        name = symbol.name.encode()
+        symtab += struct.pack(SYMBOL_ENTRY, symbol.kind.value, symbol.address, symbol.size, len(name)) + name
+    lines = b"".join(struct.pack(LINE_ENTRY, address, line) for address, line in executable.lines)
+    sections = {".text": executable.text, ".data": executable.data}
+    if symtab:
+        sections[".symtab"] = symtab
+    if lines:
+        sections[".lines"] = lines
+
+    header = struct.pack(HEADER, MAGIC, VERSION, Flags.COMPRESSED if compress else 0, *astuple(executable.layout),
+                         executable.entry, len(sections))
+    table = b"".join(struct.pack(SECTION_ENTRY, name.encode(), len(body)) for name, body in sections.items())
+    payload = b"".join(sections.values())
+    return header + table + (zlib.compress(payload) if compress else payload)
+
+
+def unpack(binary: bytes) -> Executable:
+    """Читает контейнер за один проход; без сжатия секции кода и данных не копируются."""
+    if not is_executable(binary):
+        raise ValueError("Not an executable container")
+    _, version, flags, *values = struct.unpack_from(HEADER, binary)
+    *layout_values, entry, sections_amount = values
+    if version != VERSION:
+        raise ValueError(f"Unsupported container version {version}")
+    offset = struct.calcsize(HEADER)
+    table = []
+    for _ in range(sections_amount):
+        name, size = struct.unpack_from(SECTION_ENTRY, binary, offset)
+        table.append((name.rstrip(b"\0").decode(), size))
+        offset += struct.calcsize(SECTION_ENTRY)
+
+    payload = memoryview(binary)[offset:]
+    if flags & Flags.COMPRESSED:
+        payload = memoryview(zlib.decompress(payload))
+    sections = {}
+    offset = 0
+    for name, size in table:
+        sections[name] = payload[offset:offset + size]
+        offset += size
+    if offset > len(payload):
+        raise ValueError("Truncated executable container")
+
+    symbols = []
+    symtab = sections.get(".symtab", b"")
+    offset = 0
+    while offset < len(symtab):
+        kind, address, size, name_size = struct.unpack_from(SYMBOL_ENTRY, symtab, offset)
+        offset += struct.calcsize(SYMBOL_ENTRY)
+        symbols.append(SymbolEntry(SymbolKind(kind), address, size, bytes(symtab[offset:offset + name_size]).decode()))
+        offset += name_size
+    lines = list(struct.iter_unpack(LINE_ENTRY, sections.get(".lines", b"")))
+    return Executable(MemoryLayout(*layout_values), entry, sections[".text"], sections[".data"], symbols, lines)
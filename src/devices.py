@@ -0,0 +1,141 @@
+import codecs
+from typing import IO, Protocol
+
+
+class InputDevice(Protocol):
+    """Устройство на порту ввода: read() возвращает None, когда ввод закончился."""
+
+    position: int
+
+    def read(self) -> int | None: ...
+
+    def seek(self, position: int) -> None: ...
+
+
+class OutputDevice(Protocol):
+    """Устройство на порту вывода; values - значения, которые еще не отданы дальше."""
+
+    values: list
+
+    def write(self, value: object) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class ListInput:
+    """Ввод из заранее подготовленного списка токенов."""
+
+    def __init__(self, tokens: list[int]):
+        self.tokens = tokens
+        self.position = 0
+
+    def read(self) -> int | None:
+        if self.position >= len(self.tokens):
+            return None
+        self.position += 1
+        return self.tokens[self.position - 1]
+
+    def seek(self, position: int) -> None:
+        self.position = position
+
+
+class StreamInput:
+    """Ввод из текстового или двоичного (UTF-8) потока, читается кусками по chunk_size по мере обращений к порту.
+
+    Символьный режим: токен - код символа, после конца потока подается 0. Иначе токены - целые числа,
+    разделенные пробельными символами.
+    """
+
+    def __init__(self, stream: IO, *, is_char: bool, chunk_size: int = 1 << 16):
+        self.stream = stream
+        self.is_char = is_char
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.tokens: list[int] = []
+        self.cursor = 0
+        self.position = 0
+        self.tail = ""  # начало числа, разрезанного границей куска
+        self.eof = False
+
+    def read(self) -> int | None:
+        if self.cursor == len(self.tokens) and not self.fill():
+            return None
+        self.cursor += 1
+        self.position += 1
+        return self.tokens[self.cursor - 1]
+
+    def seek(self, position: int) -> None:
+        """Пропускает токены до позиции position; назад поток не перематывается."""
+        if position < self.position:
+            raise ValueError("Can't seek input stream backwards")
+        while self.position < position and self.read() is not None:
+            pass
+
+    def fill(self) -> bool:
+        """Читает куски потока, пока не появятся токены; False - токенов больше не будет."""
+        while not self.eof:
+            chunk = self.stream.read(self.chunk_size)
+            self.eof = not chunk
+            text = chunk if isinstance(chunk, str) else self.decoder.decode(chunk, final=self.eof)
+            if self.is_char:
+                tokens = [ord(char) for char in text]
+                if self.eof:
+                    tokens.append(0)
+            else:
+                text = self.tail + text
+                words = text.split()
+                cut = words and not self.eof and not text[-1].isspace()
+                self.tail = words.pop() if cut else ""
+                tokens = [int(word) for word in words]
+            if tokens:
+                self.tokens, self.cursor = tokens, 0
+                return True
+        return False
+
+
+class ListOutput:
+    """Накапливает весь вывод в памяти."""
+
+    def __init__(self) -> None:
+        self.values: list = []
+
+    def write(self, value: object) -> None:
+        self.values.append(value)
+
+    def close(self) -> None:
+        pass
+
+
+class StreamOutput:
+    """Форматирует вывод и пишет в поток, как только в буфере наберется buffer_size значений.
+
+    Формат вывода - как в machine.format_output: символы после разбора escape-последовательностей
+    либо числа через пробел.
+    """
+
+    def __init__(self, stream: IO[str], *, is_char: bool, buffer_size: int = 4096):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.values: list = []
+        self.decoder = codecs.getincrementaldecoder("unicode_escape")() if is_char else None
+        self.started = False
+
+    def write(self, value: object) -> None:
+        self.values.append(value)
+        if len(self.values) >= self.buffer_size:
+            self.flush()
+
+    def flush(self, *, final: bool = False) -> None:
+        if self.decoder is not None:
+            text = self.decoder.decode("".join(chr(value) for value in self.values).encode(), final=final)
+        else:
+            text = " ".join(str(value) for value in self.values)
+            if self.started and text:
+                text = " " + text
+        self.started = self.started or bool(self.values)
+        self.values.clear()
+        self.stream.write(text)
+        self.stream.flush()
+
+    def close(self) -> None:
+        self.flush(final=True)
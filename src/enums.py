@@ -71,7 +71,7 @@ class Sel:
         PLUS_1: int = 3
         MINUS_1: int = 4
         ZERO: int = 5
-        PLUS_2: int = 3
+        PLUS_2: int = 6
 
     class Register(Enum):
         REGISTER: int = 0
@@ -90,6 +90,11 @@ class Opcode(Enum):
     MOV_ri2r: int = HLT + 1
     GET_CARRY: int = MOV_ri2r + 15
 
+    MOV_rel2r: int = GET_CARRY + 3
+    STORE_r2rel: int = MOV_rel2r + 11
+
+    __hash__ = object.__hash__
+
 
 OPCODE_TO_TERMS_AMOUNT: dict[Opcode, list[int]] = {
     Opcode.MOV_r2r        : [2, 0],
@@ -98,6 +103,7 @@ OPCODE_TO_TERMS_AMOUNT: dict[Opcode, list[int]] = {
     Opcode.MOV_da2r       : [1, 1],
     Opcode.MOV_ia2r       : [1, 1],
     Opcode.MOV_ri2r       : [2, 0],
+    Opcode.MOV_rel2r      : [2, 1],
 
     Opcode.INC_r          : [1, 0],
     Opcode.INC_mem        : [0, 1],
@@ -108,12 +114,13 @@ OPCODE_TO_TERMS_AMOUNT: dict[Opcode, list[int]] = {
     Opcode.STORE_r2ri     : [2, 0],
     Opcode.STORE_r2da     : [1, 1],
     Opcode.STORE_r2ia     : [1, 1],
+    Opcode.STORE_r2rel    : [2, 1],
 
-    Opcode.NADD_mem       : [1, 2],
-    Opcode.NSUB_mem       : [1, 2],
-    Opcode.NMUL_mem       : [1, 2],
-    Opcode.NAND_mem       : [1, 2],
-    Opcode.NOR_mem        : [1, 2],
+    Opcode.NADD_mem       : [1, 0],
+    Opcode.NSUB_mem       : [1, 0],
+    Opcode.NMUL_mem       : [1, 0],
+    Opcode.NAND_mem       : [1, 0],
+    Opcode.NOR_mem        : [1, 0],
 
     Opcode.BEQZ           : [1, 1],
     Opcode.BNEZ           : [1, 1],
@@ -177,6 +184,17 @@ OPCODE_TO_TERMS_AMOUNT: dict[Opcode, list[int]] = {
     Opcode.GET_CARRY      : [1, 0],
 }
 
+# N-арные операции: Rd = Rd op mem[a1] op ... op mem[an], число адресов n (1..31) - в младших битах
+# слова инструкции, сами адреса - в n следующих словах
+N_ARY_OPCODES = (Opcode.NADD_mem, Opcode.NSUB_mem, Opcode.NMUL_mem, Opcode.NAND_mem, Opcode.NOR_mem)
+N_OPERANDS_MASK = 0b11111
+MAX_N_OPERANDS = N_OPERANDS_MASK
+
+
+def immediates_amount(opcode: Opcode, n: int = 0) -> int:
+    """Число слов, следующих за инструкцией."""
+    return n if opcode in N_ARY_OPCODES else OPCODE_TO_TERMS_AMOUNT[opcode][1]
+
 
 
 @dataclass
@@ -189,4 +207,5 @@ class Term:
 class Instruction:
     opcode: Opcode
     terms: list[Term]
+    n: int = 0  # число операндов N-арной операции
 
@@ -0,0 +1,84 @@
+import itertools
+import struct
+from dataclasses import dataclass, fields
+
+HEADER_MAGIC = b"CSA4"
+HEADER_FORMAT = ">10I"
+
+
+@dataclass(frozen=True)
+class MemoryLayout:
+    """Карта памяти, общая для транслятора и модели процессора.
+
+    Код и статические данные размещает транслятор, куча растет вверх от heap_base (RHP),
+    стек - вниз от последней ячейки стековой секции (RSP). Порты ввода-вывода лежат вне секций.
+    """
+
+    text_base: int = 0
+    text_size: int = 200
+    data_base: int = 200
+    data_size: int = 200
+    heap_base: int = 500
+    heap_size: int = 300
+    stack_base: int = 800
+    stack_size: int = 224
+    input_port: int = 400
+    output_port: int = 401
+
+    def __post_init__(self) -> None:
+        sections = sorted(self.sections().items(), key=lambda item: item[1].start)
+        for (name, section), (next_name, next_section) in itertools.pairwise(sections):
+            if section.stop > next_section.start:
+                raise ValueError(f"Memory sections {name} and {next_name} overlap")
+        for port in (self.input_port, self.output_port):
+            for name, section in sections:
+                if port in section:
+                    raise ValueError(f"Port {port} is inside {name} section")
+
+    def sections(self) -> dict[str, range]:
+        return {
+            "text": range(self.text_base, self.text_base + self.text_size),
+            "data": range(self.data_base, self.data_base + self.data_size),
+            "heap": range(self.heap_base, self.heap_base + self.heap_size),
+            "stack": range(self.stack_base, self.stack_base + self.stack_size),
+        }
+
+    @property
+    def memory_size(self) -> int:
+        ends = [section.stop for section in self.sections().values()]
+        return max(*ends, self.input_port + 1, self.output_port + 1)
+
+    @property
+    def stack_top(self) -> int:
+        return self.stack_base + self.stack_size - 1
+
+    def header(self) -> bytes:
+        return HEADER_MAGIC + struct.pack(HEADER_FORMAT, *(getattr(self, field.name) for field in fields(self)))
+
+
+DEFAULT_LAYOUT = MemoryLayout()
+
+
+def sized_layout(heap_size: int, stack_size: int = DEFAULT_LAYOUT.stack_size) -> MemoryLayout:
+    """Карта по умолчанию, но другого размера кучи и стека (стек идет сразу после кучи)."""
+    heap_base = DEFAULT_LAYOUT.heap_base
+    return MemoryLayout(heap_base=heap_base, heap_size=heap_size,
+                        stack_base=heap_base + heap_size, stack_size=stack_size)
+
+
+def read_header(binary) -> tuple[MemoryLayout, int]:
+    """Карта памяти из заголовка и смещение кода за ним; для файла без заголовка - карта по умолчанию.
+
+    binary - bytes или mmap: заголовок читается без копирования остального файла.
+    """
+    if binary[:len(HEADER_MAGIC)] != HEADER_MAGIC:
+        return DEFAULT_LAYOUT, 0
+    offset = len(HEADER_MAGIC)
+    values = struct.unpack_from(HEADER_FORMAT, binary, offset)
+    return MemoryLayout(*values), offset + struct.calcsize(HEADER_FORMAT)
+
+
+def split_header(binary: bytes) -> tuple[MemoryLayout, bytes]:
+    """Отделяет заголовок, описывающий карту памяти; для файла без заголовка - карта по умолчанию."""
+    layout, offset = read_header(binary)
+    return layout, binary[offset:]
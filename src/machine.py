@@ -1,25 +1,33 @@
+import argparse
+import contextlib
 import logging
+import mmap
+import struct
 import sys
+import zlib
+from array import array
 from collections.abc import Callable
 from dataclasses import dataclass
 from enum import Enum
+from typing import NamedTuple
 
+from cache import Cache, CacheConfig, Replacement, WritePolicy
+from container import SymbolEntry, is_executable, unpack
+from devices import InputDevice, ListInput, ListOutput, OutputDevice, StreamInput, StreamOutput
 from enums import ALUOperations, Sel, Signal
-from isa import OPCODE_TO_TERMS_AMOUNT, Instruction, Opcode, Term
+from isa import N_ARY_OPCODES, N_OPERANDS_MASK, OPCODE_TO_TERMS_AMOUNT, Instruction, Opcode, Term, immediates_amount
+from layout import DEFAULT_LAYOUT, MemoryLayout, read_header
+from microcoverage import MicrocodeCoverage
 from microprogram import mprogram
+from profiler import Profiler
+from tracer import FileSink, Granularity, Tracer, parse_range
 
 MAX_CYCLES = 20_000
 
 class HltError(Exception):
     pass
 
-N_ALU_mem_operations = (
-    Opcode.NADD_mem,
-    Opcode.NSUB_mem,
-    Opcode.NMUL_mem,
-    Opcode.NAND_mem,
-    Opcode.NOR_mem,
-)
+N_ALU_mem_operations = N_ARY_OPCODES
 ALU_reg2reg_operations = (
     Opcode.ADD_reg2reg,
     Opcode.SUB_reg2reg,
@@ -79,6 +87,7 @@ MOV_codes = (
     Opcode.MOV_ia2r,
     Opcode.MOV_mem2mem,
     Opcode.MOV_ri2r,
+    Opcode.MOV_rel2r,
 )
 INC_DEC_codes = (Opcode.INC_mem, Opcode.INC_r, Opcode.DEC_mem, Opcode.DEC_r)
 STORE_codes = (
@@ -86,9 +95,113 @@ STORE_codes = (
     Opcode.STORE_r2ri,
     Opcode.STORE_r2ia,
     Opcode.STORE_r2da,
+    Opcode.STORE_r2rel,
 )
 
 
+# индексы термов, из которых декодер берет dst, left и right регистры (N берется из Instruction.n)
+DecodePlan = tuple[int | None, int | None, int | None]
+
+
+def decode_plan(opcode: Opcode) -> DecodePlan:
+    plan: DecodePlan = (None, None, None)
+    if opcode in MOV_codes:
+        if opcode in (Opcode.MOV_r2r, Opcode.MOV_rd2r, Opcode.MOV_ri2r, Opcode.MOV_rel2r):
+            plan = (0, 1, None)
+        elif opcode == Opcode.MOV_mem2mem:
+            pass
+        else:
+            plan = (0, None, None)
+
+    elif opcode in INC_DEC_codes:
+        if opcode in (Opcode.INC_r, Opcode.DEC_r):
+            plan = (0, 0, None)
+
+    elif opcode in STORE_codes:
+        plan = (None, 1, 0) if opcode in (Opcode.STORE_r2rd, Opcode.STORE_r2ri, Opcode.STORE_r2rel) \
+            else (None, None, 0)
+
+    elif opcode in N_ALU_mem_operations:
+        plan = (0, 0, None)  # результат накапливается в том же регистре
+
+    elif opcode in (
+        Opcode.BEQZ,
+        Opcode.BNEZ,
+        Opcode.BGZ,
+        Opcode.BLZ,
+    ) or opcode in (Opcode.PUSH, Opcode.JMP_r):
+        plan = (None, 0, None)
+    elif opcode in (Opcode.JMP_imm, Opcode.CALL, Opcode.RET):
+        pass
+
+    elif opcode in ALU_reg2reg_operations:
+        plan = (0, 1, 2)
+    elif opcode in ALU_mem2reg_operations:
+        plan = (0, None, None)
+    elif opcode in ALU_mix2reg1_operations:
+        plan = (0, 1, None)  # set left register
+    elif opcode in ALU_mix2reg2_operations:
+        plan = (0, None, 1)  # set right register
+    elif opcode in ALU_mem2mem_operations:
+        pass
+
+    elif opcode == Opcode.POP:
+        plan = (0, None, None)
+    elif opcode == Opcode.HLT:
+        pass
+    elif opcode == Opcode.GET_CARRY:
+        plan = (0, None, None)
+    else:
+        raise RuntimeError
+    return plan
+
+
+DECODE_PLANS: dict[Opcode, DecodePlan] = {
+    opcode: decode_plan(opcode) for opcode in Opcode if opcode not in (Opcode.LT, Opcode.GT, Opcode.EQ)
+}
+
+
+class DecodedInstruction(NamedTuple):
+    """Результат декодирования: точка входа в микропрограмму, N и выбранные регистры (None - не меняется)."""
+
+    opcode: Opcode
+    terms: list[Term]
+    entry_point: int
+    n: object
+    dst: "Registers.Registers | None"
+    left: "Registers.Registers | None"
+    right: "Registers.Registers | None"
+
+
+def decode_terms(instruction: Instruction) -> DecodedInstruction:
+    if instruction.opcode not in DECODE_PLANS:
+        raise RuntimeError
+    terms = instruction.terms
+    indices = DECODE_PLANS[instruction.opcode]
+    dst, left, right = (None if index is None else terms[index].value for index in indices)
+    n = instruction.n if instruction.opcode in N_ALU_mem_operations else None
+    return DecodedInstruction(instruction.opcode, terms, instruction.opcode.value, n, dst, left, right)
+
+
+ALU_OPERATIONS: dict[ALUOperations, Callable[[int, int], int]] = {
+    ALUOperations.ADD: lambda x, y: x + y,
+    ALUOperations.SUB: lambda x, y: x - y,
+    ALUOperations.AND: lambda x, y: x & y,
+    ALUOperations.OR: lambda x, y: x | y,
+    ALUOperations.XOR: lambda x, y: x ^ y,
+    ALUOperations.MUL: lambda x, y: x * y,
+    ALUOperations.DIV: lambda x, y: x // y,
+    ALUOperations.RMD: lambda x, y: x % y,
+}
+LEFT_ALU_CONSTANTS: dict[Sel.LeftALU, int] = {Sel.LeftALU.ZERO: 0, Sel.LeftALU.PLUS_1: 1, Sel.LeftALU.MINUS_1: -1}
+RIGHT_ALU_CONSTANTS: dict[Sel.RightALU, int] = {
+    Sel.RightALU.PLUS_1: 1,
+    Sel.RightALU.PLUS_2: 2,
+    Sel.RightALU.MINUS_1: -1,
+    Sel.RightALU.ZERO: 0,
+}
+
+
 class ALU:
     class Flags(Enum):
         ZERO: int = 0
@@ -96,6 +209,8 @@ class ALU:
         OVERFLOW: int = 2
         NEGATIVE: int = 3
 
+        __hash__ = object.__hash__
+
     def __init__(self, datapath: "DataPath"):
         self.datapath = datapath
 
@@ -108,16 +223,7 @@ class ALU:
             self.Flags.OVERFLOW: False,
             self.Flags.NEGATIVE: False,
         }
-        self.__operations: dict[ALUOperations, Callable[[int, int], int]] = {
-            ALUOperations.ADD: lambda x, y: x + y,
-            ALUOperations.SUB: lambda x, y: x - y,
-            ALUOperations.AND: lambda x, y: x & y,
-            ALUOperations.OR: lambda x, y: x | y,
-            ALUOperations.XOR: lambda x, y: x ^ y,
-            ALUOperations.MUL: lambda x, y: x * y,
-            ALUOperations.DIV: lambda x, y: x // y,
-            ALUOperations.RMD: lambda x, y: x % y,
-        }
+        self.__operations: dict[ALUOperations, Callable[[int, int], int]] = ALU_OPERATIONS
 
     def __set_flags(self) -> None:
         self.flags[self.Flags.ZERO] = self.result == 0
@@ -164,6 +270,94 @@ class ALU:
         self.result = self.__operations[operation](self.__left_term, self.__right_term)
         self.__set_flags()
 
+    def load(self, left_term: int, right_term: int, result: int) -> None:
+        """Выставляет защелки, результат и флаги так, как их оставляет последняя операция инструкции."""
+        self.__left_term = left_term
+        self.__right_term = right_term
+        self.result = result
+        self.__set_flags()
+
+    def latches(self) -> tuple[int, int]:
+        return self.__left_term, self.__right_term
+
+    def compile_latch_left_alu(self, sel: Sel.LeftALU) -> Callable[[], None]:
+        assert isinstance(sel, Sel.LeftALU), "selector must be LeftALU selector"
+        datapath = self.datapath
+        registers = datapath.registers.registers_value
+
+        def latch_register() -> None:
+            self.__left_term = registers[datapath.src_left_register]
+
+        def latch_pc() -> None:
+            self.__left_term = datapath.program_counter
+
+        def latch_dr() -> None:
+            self.__left_term = datapath.data_register
+
+        dynamic = {
+            Sel.LeftALU.REGISTER: latch_register,
+            Sel.LeftALU.PC: latch_pc,
+            Sel.LeftALU.DR: latch_dr,
+        }
+        if sel in dynamic:
+            return dynamic[sel]
+        if sel not in LEFT_ALU_CONSTANTS:
+            return lambda: None
+        value = LEFT_ALU_CONSTANTS[sel]
+
+        def latch_constant() -> None:
+            self.__left_term = value
+
+        return latch_constant
+
+    def compile_latch_right_alu(self, sel: Sel.RightALU) -> Callable[[], None]:
+        assert isinstance(sel, Sel.RightALU), "selector must be RightALU selector"
+        datapath = self.datapath
+        registers = datapath.registers.registers_value
+
+        def latch_register() -> None:
+            self.__right_term = registers[datapath.src_right_register]
+
+        def latch_dr() -> None:
+            self.__right_term = datapath.data_register
+
+        dynamic = {
+            Sel.RightALU.REGISTER: latch_register,
+            Sel.RightALU.DR: latch_dr,
+        }
+        if sel in dynamic:
+            return dynamic[sel]
+        if sel not in RIGHT_ALU_CONSTANTS:
+            return lambda: None
+        value = RIGHT_ALU_CONSTANTS[sel]
+
+        def latch_constant() -> None:
+            self.__right_term = value
+
+        return latch_constant
+
+    def compile_perform(self, operation: ALUOperations) -> Callable[[], None]:
+        function = self.__operations[operation]
+        flags = self.flags
+        zero, negative, carry = self.Flags.ZERO, self.Flags.NEGATIVE, self.Flags.CARRY
+
+        def perform() -> None:
+            result = self.result = function(self.__left_term, self.__right_term)
+            flags[zero] = result == 0
+            flags[negative] = result < 0
+            flags[carry] = result > (2**31 - 1)
+
+        return perform
+
+
+FLAG_BY_SELECTOR: dict[Sel.Flag, ALU.Flags | None] = {
+    Sel.Flag.CARRY: ALU.Flags.CARRY,
+    Sel.Flag.OVERFLOW: ALU.Flags.OVERFLOW,
+    Sel.Flag.NEGATIVE: ALU.Flags.NEGATIVE,
+    Sel.Flag.ZERO: ALU.Flags.ZERO,
+    Sel.Flag.NONE: None,
+}
+
 
 class Registers:
     class Registers(Enum):
@@ -176,6 +370,8 @@ class Registers:
         RSP: int = 6
         RHP: int = 7
 
+        __hash__ = object.__hash__
+
     def __init__(self) -> None:
         self.registers_value: dict[Registers.Registers, int] = {
             Registers.Registers.RSP: 0,
@@ -200,6 +396,20 @@ class Registers:
         if sel == Sel.RSP.MINUS_1:
             self.registers_value[Registers.Registers.RSP] -= 1
 
+    def compile_latch_rsp(self, sel: Sel.RSP) -> Callable[[], None]:
+        registers = self.registers_value
+        rsp = Registers.Registers.RSP
+        delta = {Sel.RSP.PLUS_1: 1, Sel.RSP.MINUS_1: -1}[sel]
+
+        def latch_rsp() -> None:
+            registers[rsp] += delta
+
+        return latch_rsp
+
+
+# порядок ключей registers_value не меняется, поэтому имена регистров форматируются заранее
+REGISTERS_FORMAT = " ".join(f"{register.name}={{}}" for register in Registers().registers_value)
+
 
 @dataclass
 class Address:
@@ -207,9 +417,14 @@ class Address:
 
 
 class Memory:
+    """Память списком объектов: ячейка хранит int любого размера, Instruction или None."""
+
     def __init__(self, memory_size: int):
         self.memory_size = memory_size
         self.memory: list[int | Instruction | None] = [0] * memory_size
+        # чтение и запись по int-адресу без промежуточного Address
+        self.read: Callable[[int], int | Instruction | None] = self.memory.__getitem__
+        self.write: Callable[[int, int | Instruction | None], None] = self.memory.__setitem__
 
     def __getitem__(self, key: Address) -> int | Instruction | None:
         return self.memory[key.value]
@@ -217,6 +432,188 @@ class Memory:
     def __setitem__(self, key: Address, value: int | Instruction | None) -> None:
         self.memory[key.value] = value
 
+    def cells(self) -> list[int | Instruction | None]:
+        return list(self.memory)
+
+    def load_cells(self, cells: list[int | Instruction | None]) -> None:
+        self.memory[:] = cells
+
+
+WORD_MASK = 2**32 - 1
+
+
+def encode_instruction(instruction: Instruction) -> int:
+    """Машинное слово инструкции: опкод в старших 10 битах, далее регистры по 3 бита, в младших - N."""
+    word = instruction.opcode.value << 22 | instruction.n
+    for i, term in enumerate(instruction.terms):
+        word |= term.value.value << (19 - i * 3)
+    return word
+
+
+def decode_instruction(word: int) -> Instruction:
+    opcode = Opcode(word >> 22)
+    terms = [Term(Registers.Registers(word >> (19 - j * 3) & 0b111)) for j in range(OPCODE_TO_TERMS_AMOUNT[opcode][0])]
+    return Instruction(opcode, terms, word & N_OPERANDS_MASK)
+
+
+class ArrayMemory:
+    """Память на array: знаковые 64-битные слова и признак инструкции для каждой ячейки.
+
+    Данные хранятся без изменений, как в Memory (None хранится как 0); значение, которое не помещается
+    в слово, - ошибка. Инструкции хранятся закодированными и декодируются через кэш слово -> Instruction.
+    """
+
+    def __init__(self, memory_size: int):
+        self.memory_size = memory_size
+        self.words = array("q", bytes(8 * memory_size))
+        self.is_instruction = bytearray(memory_size)
+        self.decoded: dict[int, Instruction] = {}
+
+    def read(self, address: int) -> int | Instruction:
+        word = self.words[address]
+        if not self.is_instruction[address]:
+            return word
+        instruction = self.decoded.get(word)
+        if instruction is None:
+            instruction = self.decoded[word] = decode_instruction(word)
+        return instruction
+
+    def write(self, address: int, value: int | Instruction | None) -> None:
+        if isinstance(value, Instruction):
+            self.words[address] = encode_instruction(value)
+            self.is_instruction[address] = True
+        else:
+            try:
+                self.words[address] = value or 0
+            except OverflowError:
+                err_message = f"value {value} at address {address} does not fit in array memory word"
+                raise ValueError(err_message) from None
+            self.is_instruction[address] = False
+
+    def __getitem__(self, key: Address) -> int | Instruction:
+        return self.read(key.value)
+
+    def __setitem__(self, key: Address, value: int | Instruction | None) -> None:
+        self.write(key.value, value)
+
+    def cells(self) -> list[int | Instruction | None]:
+        return [self.read(address) for address in range(self.memory_size)]
+
+    def load_cells(self, cells: list[int | Instruction | None]) -> None:
+        for address, value in enumerate(cells):
+            self.write(address, value)
+
+
+# размер страницы MappedMemory в словах
+PAGE_BITS = 8
+PAGE_WORDS = 1 << PAGE_BITS
+
+
+@dataclass
+class MappedSection:
+    """Секция образа в MappedMemory: слова big-endian в buffer от смещения offset, загружаются по адресу base."""
+
+    base: int
+    buffer: bytes | mmap.mmap
+    offset: int
+    size: int
+    is_code: bool
+    # адрес первой инструкции на странице base // PAGE_WORDS + i или после ее начала
+    entries: list[int]
+
+
+class MappedMemory:
+    """Память поверх образов кода и данных, отображенных в память (mmap).
+
+    Образ не копируется и не декодируется при загрузке: страница в PAGE_WORDS слов декодируется в список
+    ячеек при первом обращении к ней, и дальше чтение и запись идут в этот список; файл остается
+    нетронутым (copy-on-write). Чтобы отличить в коде инструкции от непосредственных значений, до
+    затронутой страницы просматриваются только слова инструкций предыдущих страниц.
+    """
+
+    def __init__(self, memory_size: int):
+        self.memory_size = memory_size
+        self.pages: list[list[int | Instruction | None] | None] = [None] * -(-memory_size // PAGE_WORDS)
+        self.sections: list[MappedSection] = []
+        self.decoded: dict[int, tuple[Instruction, int]] = {}
+
+    def map(self, base: int, buffer: bytes | mmap.mmap, offset: int = 0, *, is_code: bool = False) -> None:
+        """Подключает образ по адресу base; страницы, уже декодированные раньше, не меняются."""
+        size = (len(buffer) - offset) // 4
+        if base + size > self.memory_size:
+            raise ValueError("Image does not fit in memory")
+        self.sections.append(MappedSection(base, buffer, offset, size, is_code, [base]))
+
+    def load_page(self, number: int) -> list[int | Instruction | None]:
+        start = number * PAGE_WORDS
+        page: list[int | Instruction | None] = [0] * min(PAGE_WORDS, self.memory_size - start)
+        for section in self.sections:
+            begin, end = max(start, section.base), min(start + len(page), section.base + section.size)
+            if begin >= end:
+                continue
+            words = struct.unpack_from(f">{end - begin}I", section.buffer, section.offset + 4 * (begin - section.base))
+            page[begin - start:end - start] = words
+            if section.is_code:
+                address = self.first_instruction(section, number)
+                while address < end:
+                    instruction, immediates = self.decode(page[address - start])
+                    page[address - start] = instruction
+                    address += 1 + immediates
+        self.pages[number] = page
+        return page
+
+    def decode(self, word: int) -> tuple[Instruction, int]:
+        """Инструкция и число непосредственных значений за ней; слово декодируется один раз, как в from_bytes."""
+        entry = self.decoded.get(word)
+        if entry is None:
+            instruction = decode_instruction(word)
+            entry = self.decoded[word] = instruction, immediates_amount(instruction.opcode, instruction.n)
+        return entry
+
+    def first_instruction(self, section: MappedSection, number: int) -> int:
+        """Адрес первой инструкции секции кода, начинающейся на странице number или дальше."""
+        first_page = section.base // PAGE_WORDS
+        while len(section.entries) <= number - first_page:
+            address = section.entries[-1]
+            page_end = (first_page + len(section.entries)) * PAGE_WORDS
+            while address < min(page_end, section.base + section.size):
+                (word,) = struct.unpack_from(">I", section.buffer, section.offset + 4 * (address - section.base))
+                address += 1 + self.decode(word)[1]
+            section.entries.append(address)
+        return section.entries[number - first_page]
+
+    def read(self, address: int) -> int | Instruction | None:
+        page = self.pages[address >> PAGE_BITS]
+        if page is None:
+            page = self.load_page(address >> PAGE_BITS)
+        return page[address & (PAGE_WORDS - 1)]
+
+    def write(self, address: int, value: int | Instruction | None) -> None:
+        page = self.pages[address >> PAGE_BITS]
+        if page is None:
+            page = self.load_page(address >> PAGE_BITS)
+        page[address & (PAGE_WORDS - 1)] = value
+
+    def __getitem__(self, key: Address) -> int | Instruction | None:
+        return self.read(key.value)
+
+    def __setitem__(self, key: Address, value: int | Instruction | None) -> None:
+        self.write(key.value, value)
+
+    def cells(self) -> list[int | Instruction | None]:
+        return [self.read(address) for address in range(self.memory_size)]
+
+    def load_cells(self, cells: list[int | Instruction | None]) -> None:
+        for address, value in enumerate(cells):
+            self.write(address, value)
+
+
+MEMORY_BACKENDS: dict[str, type[Memory] | type[ArrayMemory] | type[MappedMemory]] = {
+    "list": Memory,
+    "array": ArrayMemory,
+    "mmap": MappedMemory,
+}
+
 
 class ControlUnit:
     def __init__(self, datapath: "DataPath"):
@@ -226,6 +623,10 @@ class ControlUnit:
 
         self.mem_address: int = 0
         self.n: int = 0
+        self.decoded_n: int | None = None
+        self.entry_point: int = 0
+        # адрес инструкции -> результат декодирования
+        self.decoded: dict[int, DecodedInstruction] = {}
 
         self.signals: dict[Signal, Callable[..., None]] = {
             Signal.LATCH_N: self.latch_n,
@@ -246,72 +647,68 @@ class ControlUnit:
             Signal.HLT: self.datapath.hlt,
         }
 
-        self.mprogram = mprogram
-
-    def decode(self, instruction: Instruction) -> None:
-        self.opcode: Opcode = instruction.opcode
-        self.terms: list[Term] = instruction.terms
-        if self.opcode in MOV_codes:
-            if self.opcode in (Opcode.MOV_r2r, Opcode.MOV_rd2r, Opcode.MOV_ri2r):
-                self.datapath.select_dst_register(self.terms[0].value)
-                self.datapath.select_left_register(self.terms[1].value)
-            elif self.opcode == Opcode.MOV_mem2mem:
-                pass
-            else:
-                self.datapath.select_dst_register(self.terms[0].value)
-
-        elif self.opcode in INC_DEC_codes:
-            if self.opcode in (Opcode.INC_r, Opcode.DEC_r):
-                self.datapath.select_dst_register(self.terms[0].value)
-                self.datapath.select_left_register(self.terms[0].value)
+        self.compilers: dict[Signal, Callable[..., Callable[[], None]]] = {
+            Signal.LATCH_N: self.compile_latch_n,
+            Signal.LATCH_INSTRUCTION: self.compile_latch_instruction,
+            Signal.LATCH_PROGRAM_COUNTER: self.datapath.compile_latch_program_counter,
+            Signal.LATCH_JUMP: self.datapath.compile_latch_jump,
+            Signal.LATCH_FLAG: self.datapath.compile_latch_flag,
+            Signal.LATCH_INVERSE: self.datapath.compile_latch_inverse,
+            Signal.LATCH_ADDRESS_REGISTER: self.datapath.compile_latch_address_register,
+            Signal.LATCH_DATA_REGISTER: self.datapath.compile_latch_data_register,
+            Signal.LATCH_LEFT_ALU: self.datapath.alu.compile_latch_left_alu,
+            Signal.LATCH_RIGHT_ALU: self.datapath.alu.compile_latch_right_alu,
+            Signal.EXECUTE_ALU: self.datapath.alu.compile_perform,
+            Signal.LATCH_REGISTER: self.datapath.compile_latch_register,
+            Signal.LATCH_MEMORY: self.datapath.compile_latch_memory,
+            Signal.LATCH_RSP: self.datapath.registers.compile_latch_rsp,
+            Signal.HLT: self.datapath.compile_hlt,
+        }
 
-        elif self.opcode in STORE_codes:
-            if self.opcode in (Opcode.STORE_r2rd, Opcode.STORE_r2ri):
-                self.datapath.select_right_register(self.terms[0].value)
-                self.datapath.select_left_register(self.terms[1].value)
+        self.mprogram = mprogram
+        self.compiled_mprogram: list[Callable[[], int | None]] = self.compile(mprogram)
+
+    def compile(self, program: list[tuple]) -> list[Callable[[], int | None]]:
+        """Собирает микропрограмму в плоский список замыканий, по одному на микроадрес.
+
+        Селектор каждой микрокоманды разбирается один раз, при сборке. Замыкание
+        возвращает новый mPC, если микрокоманда защелкивает mPC, иначе None.
+        """
+        compiled: list[Callable[[], int | None]] = []
+        for address, (signal, *maybe_sel) in enumerate(program):
+            sel = maybe_sel[0] if maybe_sel else None
+            if signal == Signal.LATCH_MPROGRAM_COUNTER:
+                compiled.append(self.compile_latch_mprogram_counter(sel, address))
+            elif (signal == Signal.LATCH_DATA_REGISTER and sel == Sel.DataRegister.MEMORY
+                  and program[address + 1][0] == Signal.LATCH_INSTRUCTION):
+                compiled.append(self.datapath.compile_fetch())
+            elif sel is not None:
+                compiled.append(self.compilers[signal](sel))
             else:
-                self.datapath.select_right_register(self.terms[0].value)
-
-        elif self.opcode in N_ALU_mem_operations:
-            self.n = self.terms[0].value
-            self.datapath.select_dst_register(self.terms[1].value)
-            self.datapath.select_left_register(self.terms[1].value)
-
-        elif self.opcode in (
-            Opcode.BEQZ,
-            Opcode.BNEZ,
-            Opcode.BGZ,
-            Opcode.BLZ,
-        ) or self.opcode in (Opcode.PUSH, Opcode.JMP_r):
-            self.datapath.select_left_register(self.terms[0].value)
-        elif self.opcode in (Opcode.JMP_imm, Opcode.CALL, Opcode.RET):
-            pass
-
-        elif self.opcode in ALU_reg2reg_operations:
-            self.datapath.select_dst_register(self.terms[0].value)
-            self.datapath.select_left_register(self.terms[1].value)
-            self.datapath.select_right_register(self.terms[2].value)
-        elif self.opcode in ALU_mem2reg_operations:
-            self.datapath.select_dst_register(self.terms[0].value)
-        elif self.opcode in ALU_mix2reg1_operations:
-            self.datapath.select_dst_register(self.terms[0].value)
-            self.datapath.select_left_register(self.terms[1].value)  # set left register
-        elif self.opcode in ALU_mix2reg2_operations:
-            self.datapath.select_dst_register(self.terms[0].value)
-            self.datapath.select_right_register(self.terms[1].value)  # set right register
-        elif self.opcode in ALU_mem2mem_operations:
-            pass
-
-        elif self.opcode == Opcode.PUSH:
-            self.datapath.select_left_register(self.terms[0].value)
-        elif self.opcode == Opcode.POP:
-            self.datapath.select_dst_register(self.terms[0].value)
-        elif self.opcode == Opcode.HLT:
-            pass
-        elif self.opcode == Opcode.GET_CARRY:
-            self.datapath.select_dst_register(self.terms[0].value)
-        else:
-            raise RuntimeError
+                compiled.append(self.compilers[signal]())
+        return compiled
+
+    def decode(self, instruction: Instruction, address: int | None = None) -> None:
+        """Декодирует инструкцию; по адресу результат берется из кэша декодированных инструкций.
+
+        Запись в память по адресу из кэша (DataPath.write_memory) удаляет запись кэша.
+        """
+        decoded = self.decoded.get(address) if address is not None else None
+        if decoded is None:
+            decoded = decode_terms(instruction)
+            if address is not None:
+                self.decoded[address] = decoded
+        opcode, self.terms, self.entry_point, self.decoded_n, dst, left, right = decoded
+        self.opcode: Opcode = opcode
+        datapath = self.datapath
+        if self.decoded_n is not None:
+            self.n = self.decoded_n
+        if dst is not None:
+            datapath.dst_register = dst
+        if left is not None:
+            datapath.src_left_register = left
+        if right is not None:
+            datapath.src_right_register = right
 
     def latch_mprogram_counter(self, sel: Sel.MProgramCounter) -> None:
         assert isinstance(sel, Sel.MProgramCounter), (
@@ -323,53 +720,193 @@ class ControlUnit:
         if sel == Sel.MProgramCounter.PLUS_1:
             self.mprogram_counter += 1
         if sel == Sel.MProgramCounter.OPCODE:
-            self.mprogram_counter = self.opcode.value
+            self.mprogram_counter = self.entry_point
         if sel == Sel.MProgramCounter.N:
             if self.n == 0:
                 self.mprogram_counter += 1
             else:
-                self.mprogram_counter = self.opcode.value
+                self.mprogram_counter = self.entry_point
 
     def latch_instruction(self) -> None:
         assert isinstance(self.datapath.data_register, Instruction)
-        self.decode(self.datapath.data_register)
+        self.decode(self.datapath.data_register, self.datapath.address_register)
 
     def latch_n(self, sel: Sel.N) -> None:
         assert isinstance(sel, Sel.N), "selector must be N selector"
 
         if sel == Sel.N.DECODER:
-            self.n = self.terms[0].value
+            self.n = self.decoded_n
         if sel == Sel.N.MINUS_1:
             self.n -= 1
         if sel == Sel.N.ZERO:
             self.n = 0
 
+    def compile_latch_mprogram_counter(self, sel: Sel.MProgramCounter, address: int) -> Callable[[], int]:
+        assert isinstance(sel, Sel.MProgramCounter), (
+            "selector must be MProgramCounter selector"
+        )
+        # защелкивание текущего адреса эквивалентно переходу к следующей микрокоманде
+        following = address + 1
+
+        def latch_zero() -> int:
+            return 0 if address != 0 else following
+
+        def latch_plus_1() -> int:
+            return following
+
+        def latch_opcode() -> int:
+            target = self.entry_point
+            return target if target != address else following
+
+        def latch_n() -> int:
+            if self.n == 0:
+                return following
+            target = self.entry_point
+            return target if target != address else following
+
+        return {
+            Sel.MProgramCounter.ZERO: latch_zero,
+            Sel.MProgramCounter.PLUS_1: latch_plus_1,
+            Sel.MProgramCounter.OPCODE: latch_opcode,
+            Sel.MProgramCounter.N: latch_n,
+        }[sel]
+
+    def compile_latch_instruction(self) -> Callable[[], None]:
+        datapath = self.datapath
+
+        def latch_instruction() -> None:
+            instruction = datapath.data_register
+            assert isinstance(instruction, Instruction)
+            self.decode(instruction, datapath.address_register)
+
+        return latch_instruction
+
+    def compile_latch_n(self, sel: Sel.N) -> Callable[[], None]:
+        assert isinstance(sel, Sel.N), "selector must be N selector"
+
+        def latch_decoder() -> None:
+            self.n = self.decoded_n
+
+        def latch_minus_1() -> None:
+            self.n -= 1
+
+        def latch_zero() -> None:
+            self.n = 0
+
+        return {
+            Sel.N.DECODER: latch_decoder,
+            Sel.N.MINUS_1: latch_minus_1,
+            Sel.N.ZERO: latch_zero,
+        }[sel]
+
     def execute_signal(self, signal: Signal, *arg: tuple[Signal, None | Sel]) -> None:
         self.signals[signal](*arg)
 
     def run_single_micro(self) -> None:
         mpc_now = self.mprogram_counter
-        signal, *maybe_sel = self.mprogram[mpc_now]
-        if maybe_sel and maybe_sel[0] is not None:
-            self.execute_signal(signal, maybe_sel[0])
-        else:
-            self.execute_signal(signal)
+        mpc_next = self.compiled_mprogram[mpc_now]()
         self.datapath.tick += 1
-        if self.mprogram_counter == mpc_now:
-            self.mprogram_counter += 1
+        self.mprogram_counter = mpc_now + 1 if mpc_next is None else mpc_next
+
+    def run(self, tick_limit: int) -> None:
+        """Исполняет микрокоманды, пока счетчик тактов не достигнет tick_limit.
+
+        Состояние по тактам такое же, как при последовательных вызовах run_single_micro,
+        HltError пробрасывается наружу.
+        """
+        if self.datapath.cache is not None or self.datapath.instruction_cache is not None:
+            # простои кэша добавляются к tick внутри микрокоманд, локальный счетчик тактов не подходит
+            while self.datapath.tick < tick_limit:
+                self.run_single_micro()
+            return
+        program = self.compiled_mprogram
+        mpc = self.mprogram_counter
+        tick = self.datapath.tick
+        try:
+            while tick < tick_limit:
+                mpc_next = program[mpc]()
+                tick += 1
+                mpc = mpc + 1 if mpc_next is None else mpc_next
+        finally:
+            self.mprogram_counter = mpc
+            self.datapath.tick = tick
+
+    def run_instruction(self, tick_limit: int) -> None:
+        """Исполняет микрокоманды до конца текущей инструкции (mPC = 0) или до tick_limit."""
+        self.run_single_micro()
+        while self.mprogram_counter != 0 and self.datapath.tick < tick_limit:
+            self.run_single_micro()
+
+
+SNAPSHOT_MAGIC = b"CSNP\x03"
+# размер памяти, адреса ввода и вывода, tick, PC, mPC, позиции ввода и вывода, inverse, флаг, регистры-селекторы
+SNAPSHOT_HEADER = ">IIIQqIQQ?bBBB"
+
+
+class CellTag(Enum):
+    INT = 0
+    NONE = 1
+    BOOL = 2
+    INSTRUCTION = 3
+    REGISTER = 4
+
+
+def pack_cell(buffer: bytearray, value: object) -> None:
+    """Дописывает в buffer значение ячейки или регистра: тег и данные."""
+    if value is None:
+        buffer.append(CellTag.NONE.value)
+    elif isinstance(value, bool):
+        buffer += struct.pack(">B?", CellTag.BOOL.value, value)
+    elif isinstance(value, int):
+        # числа не ограничены разрядностью слова: длина в байтах, затем дополнительный код
+        data = value.to_bytes((value.bit_length() + 8) // 8, "big", signed=True)
+        buffer += struct.pack(">BH", CellTag.INT.value, len(data)) + data
+    elif isinstance(value, Registers.Registers):
+        buffer += struct.pack(">BB", CellTag.REGISTER.value, value.value)
+    elif isinstance(value, Instruction):
+        buffer += struct.pack(">BHBB", CellTag.INSTRUCTION.value, value.opcode.value, value.n, len(value.terms))
+        buffer += bytes(term.value.value for term in value.terms)
+    else:
+        raise TypeError(f"Can't snapshot value {value!r}")
+
+
+def unpack_cell(data: bytes, offset: int) -> tuple[object, int]:
+    tag = CellTag(data[offset])
+    offset += 1
+    value: object = None
+    if tag == CellTag.BOOL:
+        value = bool(data[offset])
+        offset += 1
+    elif tag == CellTag.INT:
+        (length,) = struct.unpack_from(">H", data, offset)
+        offset += 2
+        value = int.from_bytes(data[offset:offset + length], "big", signed=True)
+        offset += length
+    elif tag == CellTag.REGISTER:
+        value = Registers.Registers(data[offset])
+        offset += 1
+    elif tag == CellTag.INSTRUCTION:
+        opcode, n, terms_amount = struct.unpack_from(">HBB", data, offset)
+        offset += 4
+        terms = [Term(Registers.Registers(register)) for register in data[offset:offset + terms_amount]]
+        value = Instruction(Opcode(opcode), terms, n)
+        offset += terms_amount
+    return value, offset
 
 
 class DataPath:
-    def __init__(self, input_address: int, output_address: int):
+    def __init__(self, input_address: int, output_address: int, memory_backend: str = "list",
+                 layout: MemoryLayout = DEFAULT_LAYOUT):
         self.tick = 0
         self.alu: ALU = ALU(self)
         self.registers: Registers = Registers()
         self.control_unit: ControlUnit = ControlUnit(self)
-        self.memory = Memory(1024)
-        self.registers[Registers.Registers.RSP] = 1023
-        self.registers[Registers.Registers.RHP] = 500
+        self.layout = layout
+        self.memory = MEMORY_BACKENDS[memory_backend](layout.memory_size)
+        self.registers[Registers.Registers.RSP] = layout.stack_top
+        self.registers[Registers.Registers.RHP] = layout.heap_base
 
-        self.program_counter: int = 0
+        self.program_counter: int = layout.text_base
         self.selected_flag: ALU.Flags | None = None
         self.inverse_flag: bool = False
         self.jump_register: int = 0
@@ -384,8 +921,11 @@ class DataPath:
         self.input_address: int = input_address
         self.output_address: int = output_address
 
-        self.input_buffer: list[str] = []
-        self.output_buffer: list[str] = []
+        self.cache: Cache | None = None
+        self.instruction_cache: Cache | None = None
+
+        self.input_device: InputDevice = ListInput([])
+        self.output_device: OutputDevice = ListOutput()
 
     def select_left_register(self, register: Registers.Registers) -> None:
         self.src_left_register = register
@@ -435,17 +975,7 @@ class DataPath:
         if sel == Sel.DataRegister.ALU:
             self.data_register = self.alu.result
         elif sel == Sel.DataRegister.MEMORY:
-            if 0 > self.address_register > self.memory.memory_size:
-                raise ValueError("Memory cell number out of bounds")
-            if self.address_register == self.output_address:
-                raise ValueError("Can't read from output port")
-            if self.address_register == self.input_address:
-                try:
-                    self.data_register = self.input_buffer.pop(0)
-                except IndexError:
-                    raise HltError
-            else:
-                self.data_register = self.memory[Address(self.address_register)]
+            self.data_register = self.read_memory(self.address_register)
 
     def latch_address_register(self, sel: Sel.AddressRegister) -> None:
         assert isinstance(sel, Sel.AddressRegister), (
@@ -474,25 +1004,244 @@ class DataPath:
             self.registers[self.dst_register] = self.alu.flags[self.alu.Flags.CARRY]
 
     def latch_memory(self) -> None:
-        if 0 > self.address_register > self.memory.memory_size:
+        self.write_memory(self.address_register, self.data_register)
+
+    def read_memory(self, address: int) -> int | Instruction | None:
+        if not 0 <= address < self.memory.memory_size:
+            raise ValueError("Memory cell number out of bounds")
+        if address == self.output_address:
+            raise ValueError("Can't read from output port")
+        if address == self.input_address:
+            value = self.input_device.read()
+            if value is None:
+                raise HltError
+            return value
+        if self.cache is not None:
+            self.tick += self.cache.access(address, write=False)
+        return self.memory.read(address)
+
+    def write_memory(self, address: int, value: int | Instruction | None) -> None:
+        if not 0 <= address < self.memory.memory_size:
             raise ValueError("Memory cell number out of bounds")
-        if self.address_register == self.input_address:
+        if address == self.input_address:
             raise ValueError("Can't write to input port")
-        if self.address_register == self.output_address:
-            self.output_buffer += [self.data_register]
-        else:
-            self.memory[Address(self.address_register)] = self.data_register
+        if address == self.output_address:
+            self.output_device.write(value)
+            return
+        if self.cache is not None:
+            self.tick += self.cache.access(address, write=True)
+        self.memory.write(address, value)
+        self.control_unit.decoded.pop(address, None)
+
+    def fetch(self, address: int) -> int | Instruction | None:
+        """Выборка инструкции: через кэш инструкций, если он подключен, иначе как обычное чтение."""
+        icache = self.instruction_cache
+        if icache is None or not 0 <= address < self.memory.memory_size or address in (
+                self.input_address, self.output_address):
+            return self.read_memory(address)
+        self.tick += icache.access(address, write=False)
+        return self.memory.read(address)
+
+    def compile_fetch(self) -> Callable[[], None]:
+        def latch_fetch() -> None:
+            self.data_register = self.fetch(self.address_register)
+
+        return latch_fetch
 
     def hlt(self) -> None:
         raise HltError
 
+    def compile_latch_jump(self, sel: Sel.Jump) -> Callable[[], None]:
+        alu = self.alu
+
+        def latch_jump() -> None:
+            self.jump_register = alu.result
+
+        return latch_jump
+
+    def compile_latch_flag(self, sel: Sel.Flag) -> Callable[[], None]:
+        flag = FLAG_BY_SELECTOR[sel]
+
+        def latch_flag() -> None:
+            self.selected_flag = flag
+
+        return latch_flag
+
+    def compile_latch_inverse(self, sel: Sel.Inverse) -> Callable[[], None]:
+        inverse = sel == Sel.Inverse.INVERSE
+
+        def latch_inverse() -> None:
+            self.inverse_flag = inverse
+
+        return latch_inverse
+
+    def compile_latch_program_counter(self, sel: Sel.ProgramCounter) -> Callable[[], None]:
+        assert isinstance(sel, Sel.ProgramCounter), (
+            "selector must be ProgramCounter selector"
+        )
+        flags = self.alu.flags
+
+        def latch_condition() -> None:
+            if self.selected_flag is None or flags[self.selected_flag] ^ self.inverse_flag:
+                self.program_counter = self.jump_register
+            else:
+                self.program_counter += 1
+
+        def latch_next() -> None:
+            self.program_counter += 1
+
+        return {
+            Sel.ProgramCounter.CONDITION: latch_condition,
+            Sel.ProgramCounter.NEXT: latch_next,
+        }[sel]
+
+    def compile_latch_data_register(self, sel: Sel.DataRegister) -> Callable[[], None]:
+        assert isinstance(sel, Sel.DataRegister)
+        alu = self.alu
+
+        def latch_alu() -> None:
+            self.data_register = alu.result
+
+        def latch_memory() -> None:
+            self.data_register = self.read_memory(self.address_register)
+
+        return {
+            Sel.DataRegister.ALU: latch_alu,
+            Sel.DataRegister.MEMORY: latch_memory,
+        }[sel]
+
+    def compile_latch_address_register(self, sel: Sel.AddressRegister) -> Callable[[], None]:
+        assert isinstance(sel, Sel.AddressRegister), (
+            "selector must be AddressRegister selector"
+        )
+        alu = self.alu
+        registers = self.registers.registers_value
+        rsp = Registers.Registers.RSP
+
+        def latch_control_unit() -> None:
+            self.address_register = self.program_counter
+
+        def latch_alu() -> None:
+            self.address_register = alu.result
+
+        def latch_rsp() -> None:
+            self.address_register = registers[rsp]
+
+        def latch_dr() -> None:
+            self.address_register = self.data_register
+
+        return {
+            Sel.AddressRegister.CONTROL_UNIT: latch_control_unit,
+            Sel.AddressRegister.ALU: latch_alu,
+            Sel.AddressRegister.RSP: latch_rsp,
+            Sel.AddressRegister.DR: latch_dr,
+        }[sel]
+
+    def compile_latch_register(self, sel: Sel.Register) -> Callable[[], None]:
+        assert isinstance(sel, Sel.Register), "selector must be Register selector"
+        alu = self.alu
+        registers = self.registers.registers_value
+        carry = ALU.Flags.CARRY
+
+        def latch_alu() -> None:
+            registers[self.dst_register] = alu.result
+
+        def latch_dr() -> None:
+            registers[self.dst_register] = self.data_register
+
+        def latch_register() -> None:
+            registers[self.dst_register] = registers[self.src_left_register]
+
+        def latch_carry() -> None:
+            registers[self.dst_register] = alu.flags[carry]
+
+        return {
+            Sel.Register.ALU: latch_alu,
+            Sel.Register.DR: latch_dr,
+            Sel.Register.REGISTER: latch_register,
+            Sel.Register.CARRY: latch_carry,
+        }[sel]
+
+    def compile_latch_memory(self) -> Callable[[], None]:
+        def latch_memory() -> None:
+            self.write_memory(self.address_register, self.data_register)
+
+        return latch_memory
+
+    def compile_hlt(self) -> Callable[[], None]:
+        return self.hlt
+
+    def snapshot(self) -> bytes:
+        """Сохраняет состояние процессора в бинарный снимок.
+
+        Из ввода сохраняется только позиция чтения, из вывода - значения, еще не отданные устройством вывода.
+        """
+        control_unit = self.control_unit
+        decoded = Instruction(control_unit.opcode, control_unit.terms) if hasattr(control_unit, "opcode") else None
+        left_term, right_term = self.alu.latches()
+        registers = [self.registers[register] for register in Registers.Registers]
+
+        body = bytearray(struct.pack(
+            SNAPSHOT_HEADER, self.memory.memory_size, self.input_address, self.output_address, self.tick,
+            self.program_counter, control_unit.mprogram_counter, self.input_device.position,
+            len(self.output_device.values),
+            self.inverse_flag, -1 if self.selected_flag is None else self.selected_flag.value,
+            self.src_left_register.value, self.src_right_register.value, self.dst_register.value,
+        ))
+        for value in (*registers, left_term, right_term, self.alu.result, self.jump_register,
+                      self.address_register, self.data_register, control_unit.n, control_unit.decoded_n, decoded,
+                      *self.output_device.values, *self.memory.cells()):
+            pack_cell(body, value)
+        return SNAPSHOT_MAGIC + zlib.compress(bytes(body))
+
+    def restore(self, snapshot: bytes) -> None:
+        """Восстанавливает состояние из снимка; устройство ввода должно подавать тот же ввод, что и при сохранении."""
+        if not snapshot.startswith(SNAPSHOT_MAGIC):
+            raise ValueError("Not a processor snapshot")
+        body = zlib.decompress(snapshot[len(SNAPSHOT_MAGIC):])
+        (memory_size, self.input_address, self.output_address, self.tick, self.program_counter, mprogram_counter,
+         input_position, output_size, inverse_flag, selected_flag, src_left, src_right, dst,
+         ) = struct.unpack_from(SNAPSHOT_HEADER, body)
+        offset = struct.calcsize(SNAPSHOT_HEADER)
+        cells = []
+        while offset < len(body):
+            value, offset = unpack_cell(body, offset)
+            cells.append(value)
+
+        registers, cells = cells[:len(Registers.Registers)], cells[len(Registers.Registers):]
+        for register, value in zip(Registers.Registers, registers, strict=True):
+            self.registers[register] = value
+        (left_term, right_term, result, self.jump_register, self.address_register, self.data_register, n, decoded_n,
+         decoded) = cells[:9]
+        self.alu.load(left_term, right_term, result)
+        memory = cells[9 + output_size:]
+        # списки и словари изменяются на месте: на них ссылаются скомпилированные микрокоманды
+        self.output_device.values[:] = cells[9:9 + output_size]
+        self.input_device.seek(input_position)
+        if memory_size != self.memory.memory_size:
+            raise ValueError("Snapshot memory size mismatch")
+        self.memory.load_cells(memory)
+
+        self.inverse_flag = inverse_flag
+        self.selected_flag = None if selected_flag < 0 else ALU.Flags(selected_flag)
+        self.src_left_register = Registers.Registers(src_left)
+        self.src_right_register = Registers.Registers(src_right)
+        self.dst_register = Registers.Registers(dst)
+        self.control_unit.mprogram_counter = mprogram_counter
+        self.control_unit.n = n
+        self.control_unit.decoded_n = decoded_n
+        self.control_unit.decoded.clear()
+        if decoded is not None:
+            self.control_unit.opcode = decoded.opcode
+            self.control_unit.terms = decoded.terms
+            self.control_unit.entry_point = decoded.opcode.value
+
     def __repr__(self):
         """Вернуть строковое представление состояния процессора."""
 
-        value = self.memory[Address(self.program_counter)]
+        value = self.memory.read(self.program_counter)
         rsp = self.registers[Registers.Registers.RSP]
-        memory_slice = str([self.memory[Address(i)] for i in range(700, 720)])
-        registers = " ".join(f"{r.name}={v}" for r, v in self.registers.registers_value.items())
+        registers = REGISTERS_FORMAT.format(*self.registers.registers_value.values())
         if isinstance(value, Instruction):
             opcode = value.opcode
             instr_repr = str(opcode.name)
@@ -501,8 +1250,8 @@ class DataPath:
                 instr_repr += f" {term.value.name}"
 
             i = 1
-            while isinstance(self.memory[Address(self.program_counter + i)], int) and opcode != Opcode.HLT:
-                instr_repr += f" {self.memory[Address(self.program_counter + i)]}"
+            while isinstance(self.memory.read(self.program_counter + i), int) and opcode != Opcode.HLT:
+                instr_repr += f" {self.memory.read(self.program_counter + i)}"
                 i += 1
 
             state_repr = f"TICK: {self.tick:4} PC: {self.program_counter:3} SP: {rsp:4} INSTR: {instr_repr:3} REGS: {registers}"
@@ -512,98 +1261,753 @@ class DataPath:
         return state_repr
 
 
+def microcode_path(program: list[tuple], start: int) -> list[tuple]:
+    """Микрокоманды, исполняемые от адреса start до защелкивания mPC (HLT в путь не входит).
+
+    Путь заканчивается на первой микрокоманде, которая выбирает mPC не по PLUS_1:
+    ZERO (конец инструкции), OPCODE (конец выборки) или N (цикл N-арных операций).
+    """
+    path = []
+    address = start
+    while address < len(program):
+        signal, *maybe_sel = program[address]
+        sel = maybe_sel[0] if maybe_sel else None
+        if signal == Signal.HLT:
+            break
+        path.append((signal, sel))
+        if signal == Signal.LATCH_MPROGRAM_COUNTER and sel != Sel.MProgramCounter.PLUS_1:
+            break
+        address += 1
+    return path
+
+
+def path_selectors(path: list[tuple], signal: Signal) -> list:
+    return [sel for path_signal, sel in path if path_signal == signal]
+
+
+FETCH_TICKS = len(microcode_path(mprogram, 0))
+
+
+class InstructionSimulator:
+    """Покомандная модель процессора поверх того же DataPath.
+
+    Каждая инструкция исполняется одной функцией Python; tick увеличивается на длину
+    микропрограммы инструкции (выборка + сегмент опкода), поэтому на границах инструкций
+    состояние DataPath такое же, как в микропрограммной модели. Ветвлений микропрограммы
+    по флагам нет: переход стоит столько же тактов, сколько и отсутствие перехода; число тактов
+    зависит от пути только в N-арных операциях. Инструкции без обработчика (N-арные, MOV_ri2r,
+    MOV_mem2mem, HLT), инструкция, которая не укладывается в лимит тактов, и чтение
+    из пустого ввода исполняются микропрограммой.
+    """
+
+    def __init__(self, datapath: DataPath):
+        self.datapath = datapath
+        self.handlers: dict[Opcode, tuple[Callable[[int], None], int]] = {}
+        for opcode in DECODE_PLANS:
+            path = microcode_path(mprogram, opcode.value)
+            handler = self.compile_handler(opcode, path)
+            if handler is not None:
+                self.handlers[opcode] = (handler, FETCH_TICKS + len(path))
+
+    def compile_handler(self, opcode: Opcode, path: list[tuple]) -> Callable[[int], None] | None:
+        if not path or path[-1] != (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO):
+            return None
+        operations = path_selectors(path, Signal.EXECUTE_ALU)
+        operation = operations[-1] if operations else None
+        handler: Callable[[int], None] | None = None
+
+        if opcode in ALU_reg2reg_operations:
+            handler = self.compile_alu_reg2reg(operation)
+        elif opcode in ALU_mem2reg_operations:
+            handler = self.compile_alu_mem2reg(operation)
+        elif opcode in ALU_mix2reg1_operations:
+            handler = self.compile_alu_mix2reg1(operation)
+        elif opcode in ALU_mix2reg2_operations:
+            handler = self.compile_alu_mix2reg2(operation)
+        elif opcode in ALU_mem2mem_operations:
+            handler = self.compile_alu_mem2mem(operation)
+        elif opcode in (Opcode.BEQZ, Opcode.BNEZ, Opcode.BGZ, Opcode.BLZ):
+            flag = FLAG_BY_SELECTOR[path_selectors(path, Signal.LATCH_FLAG)[-1]]
+            inverse = path_selectors(path, Signal.LATCH_INVERSE)[-1] == Sel.Inverse.INVERSE
+            handler = self.compile_branch(flag, inverse=inverse)
+        elif opcode in (Opcode.INC_r, Opcode.DEC_r):
+            step = RIGHT_ALU_CONSTANTS[path_selectors(path, Signal.LATCH_RIGHT_ALU)[-1]]
+            handler = self.compile_step_register(step, operation)
+        elif opcode in (Opcode.INC_mem, Opcode.DEC_mem):
+            step = LEFT_ALU_CONSTANTS[path_selectors(path, Signal.LATCH_LEFT_ALU)[-1]]
+            handler = self.compile_step_memory(step, operation)
+        elif opcode == Opcode.CALL:
+            offset = RIGHT_ALU_CONSTANTS[path_selectors(path, Signal.LATCH_RIGHT_ALU)[0]]
+            handler = self.compile_call(offset)
+        else:
+            simple_handlers = {
+                Opcode.MOV_r2r: self.execute_mov_r2r,
+                Opcode.MOV_rd2r: self.execute_mov_rd2r,
+                Opcode.MOV_imm2r: self.execute_mov_imm2r,
+                Opcode.MOV_da2r: self.execute_mov_da2r,
+                Opcode.MOV_ia2r: self.execute_mov_ia2r,
+                Opcode.MOV_rel2r: self.execute_mov_rel2r,
+                Opcode.STORE_r2rd: self.execute_store_r2rd,
+                Opcode.STORE_r2ri: self.execute_store_r2ri,
+                Opcode.STORE_r2da: self.execute_store_r2da,
+                Opcode.STORE_r2ia: self.execute_store_r2ia,
+                Opcode.STORE_r2rel: self.execute_store_r2rel,
+                Opcode.JMP_r: self.execute_jmp_r,
+                Opcode.JMP_imm: self.execute_jmp_imm,
+                Opcode.RET: self.execute_ret,
+                Opcode.PUSH: self.execute_push,
+                Opcode.POP: self.execute_pop,
+                Opcode.GET_CARRY: self.execute_get_carry,
+            }
+            handler = simple_handlers.get(opcode)
+        return handler
+
+    def step(self, tick_limit: int) -> None:
+        """Исполняет одну инструкцию (или только часть, если лимит тактов наступит раньше)."""
+        datapath = self.datapath
+        control_unit = datapath.control_unit
+        pc = datapath.program_counter
+        instruction = datapath.memory.read(pc) if 0 <= pc < datapath.memory.memory_size else None
+        entry = self.handlers.get(instruction.opcode) if isinstance(instruction, Instruction) else None
+        if control_unit.mprogram_counter != 0 or entry is None or datapath.tick + entry[1] > tick_limit:
+            self.datapath.control_unit.run_instruction(tick_limit)
+            return
+
+        handler, ticks = entry
+        if datapath.cache is not None or datapath.instruction_cache is not None:
+            datapath.fetch(pc)
+        datapath.address_register = pc
+        datapath.data_register = instruction
+        control_unit.decode(instruction, pc)
+        try:
+            handler(pc)
+        except HltError:
+            # ввод закончился: до чтения обработчик ничего не менял, повторяем инструкцию по тактам
+            self.datapath.control_unit.run_instruction(tick_limit)
+            return
+        datapath.tick += ticks
+
+    def run(self, tick_limit: int) -> None:
+        datapath = self.datapath
+        while datapath.tick < tick_limit:
+            self.step(tick_limit)
+
+    def execute_mov_r2r(self, pc: int) -> None:
+        datapath = self.datapath
+        value = datapath.registers[datapath.src_left_register]
+        datapath.alu.load(value, 0, value)
+        datapath.registers[datapath.dst_register] = value
+        datapath.program_counter = pc + 1
+
+    def execute_mov_rd2r(self, pc: int) -> None:
+        datapath = self.datapath
+        address = datapath.registers[datapath.src_left_register]
+        value = datapath.read_memory(address)
+        datapath.address_register = address
+        datapath.data_register = value
+        datapath.alu.load(0, value, value)
+        datapath.registers[datapath.dst_register] = value
+        datapath.program_counter = pc + 1
+
+    def execute_mov_imm2r(self, pc: int) -> None:
+        datapath = self.datapath
+        value = datapath.read_memory(pc + 1)
+        datapath.address_register = pc + 1
+        datapath.data_register = value
+        datapath.registers[datapath.dst_register] = value
+        datapath.program_counter = pc + 2
+
+    def execute_mov_da2r(self, pc: int) -> None:
+        datapath = self.datapath
+        address = datapath.read_memory(pc + 1)
+        value = datapath.read_memory(address)
+        datapath.address_register = address
+        datapath.data_register = value
+        datapath.alu.load(0, value, value)
+        datapath.registers[datapath.dst_register] = value
+        datapath.program_counter = pc + 2
+
+    def execute_mov_ia2r(self, pc: int) -> None:
+        datapath = self.datapath
+        pointer = datapath.read_memory(pc + 1)
+        address = datapath.read_memory(pointer)
+        value = datapath.read_memory(address)
+        datapath.address_register = address
+        datapath.data_register = value
+        datapath.alu.load(0, value, value)
+        datapath.registers[datapath.dst_register] = value
+        datapath.program_counter = pc + 2
+
+    def execute_mov_rel2r(self, pc: int) -> None:
+        datapath = self.datapath
+        base = datapath.registers[datapath.src_left_register]
+        offset = datapath.read_memory(pc + 1)
+        address = base + offset
+        value = datapath.read_memory(address)
+        datapath.alu.load(base, offset, address)
+        datapath.address_register = address
+        datapath.data_register = value
+        datapath.registers[datapath.dst_register] = value
+        datapath.program_counter = pc + 2
+
+    def execute_store_r2rd(self, pc: int) -> None:
+        datapath = self.datapath
+        value = datapath.registers[datapath.src_right_register]
+        address = datapath.registers[datapath.src_left_register]
+        datapath.alu.load(address, 0, address)
+        datapath.data_register = value
+        datapath.address_register = address
+        datapath.write_memory(address, value)
+        datapath.program_counter = pc + 1
+
+    def execute_store_r2ri(self, pc: int) -> None:
+        datapath = self.datapath
+        address = datapath.read_memory(datapath.registers[datapath.src_left_register])
+        value = datapath.registers[datapath.src_right_register]
+        datapath.alu.load(0, value, value)
+        datapath.address_register = address
+        datapath.data_register = value
+        datapath.write_memory(address, value)
+        datapath.program_counter = pc + 1
+
+    def execute_store_r2da(self, pc: int) -> None:
+        datapath = self.datapath
+        address = datapath.read_memory(pc + 1)
+        value = datapath.registers[datapath.src_right_register]
+        datapath.alu.load(0, value, value)
+        datapath.address_register = address
+        datapath.data_register = value
+        datapath.write_memory(address, value)
+        datapath.program_counter = pc + 2
+
+    def execute_store_r2ia(self, pc: int) -> None:
+        datapath = self.datapath
+        address = datapath.read_memory(datapath.read_memory(pc + 1))
+        value = datapath.registers[datapath.src_right_register]
+        datapath.alu.load(0, value, value)
+        datapath.address_register = address
+        datapath.data_register = value
+        datapath.write_memory(address, value)
+        datapath.program_counter = pc + 2
+
+    def execute_store_r2rel(self, pc: int) -> None:
+        datapath = self.datapath
+        address = datapath.registers[datapath.src_left_register] + datapath.read_memory(pc + 1)
+        value = datapath.registers[datapath.src_right_register]
+        datapath.alu.load(0, value, value)
+        datapath.address_register = address
+        datapath.data_register = value
+        datapath.write_memory(address, value)
+        datapath.program_counter = pc + 2
+
+    def execute_jmp_r(self, pc: int) -> None:
+        datapath = self.datapath
+        target = datapath.registers[datapath.src_left_register]
+        datapath.alu.load(target, 0, target)
+        datapath.jump_register = target
+        datapath.selected_flag = None
+        datapath.program_counter = target
+
+    def execute_jmp_imm(self, pc: int) -> None:
+        datapath = self.datapath
+        target = datapath.read_memory(pc + 1)
+        datapath.address_register = pc + 1
+        datapath.data_register = target
+        datapath.alu.load(0, target, target)
+        datapath.jump_register = target
+        datapath.selected_flag = None
+        datapath.program_counter = target
+
+    def execute_ret(self, pc: int) -> None:
+        datapath = self.datapath
+        rsp = datapath.registers[Registers.Registers.RSP]
+        target = datapath.read_memory(rsp)
+        datapath.address_register = rsp
+        datapath.data_register = target
+        datapath.alu.load(0, target, target)
+        datapath.jump_register = target
+        datapath.selected_flag = None
+        datapath.registers[Registers.Registers.RSP] = rsp + 1
+        datapath.program_counter = target
+
+    def execute_push(self, pc: int) -> None:
+        datapath = self.datapath
+        rsp = datapath.registers[Registers.Registers.RSP] - 1
+        datapath.registers[Registers.Registers.RSP] = rsp
+        value = datapath.registers[datapath.src_left_register]
+        datapath.alu.load(value, 0, value)
+        datapath.address_register = rsp
+        datapath.data_register = value
+        datapath.write_memory(rsp, value)
+        datapath.program_counter = pc + 1
+
+    def execute_pop(self, pc: int) -> None:
+        datapath = self.datapath
+        rsp = datapath.registers[Registers.Registers.RSP]
+        value = datapath.read_memory(rsp)
+        datapath.address_register = rsp
+        datapath.data_register = value
+        datapath.registers[datapath.dst_register] = value
+        datapath.registers[Registers.Registers.RSP] += 1
+        datapath.program_counter = pc + 1
+
+    def execute_get_carry(self, pc: int) -> None:
+        datapath = self.datapath
+        datapath.registers[datapath.dst_register] = datapath.alu.flags[ALU.Flags.CARRY]
+        datapath.program_counter = pc + 1
+
+    def compile_call(self, offset: int) -> Callable[[int], None]:
+        datapath = self.datapath
+
+        def execute_call(pc: int) -> None:
+            rsp = datapath.registers[Registers.Registers.RSP] - 1
+            datapath.registers[Registers.Registers.RSP] = rsp
+            datapath.write_memory(rsp, pc + offset)
+            target = datapath.read_memory(pc + 1)
+            datapath.address_register = pc + 1
+            datapath.data_register = target
+            datapath.alu.load(0, target, target)
+            datapath.jump_register = target
+            datapath.selected_flag = None
+            datapath.program_counter = target
+
+        return execute_call
+
+    def compile_branch(self, flag: ALU.Flags, *, inverse: bool) -> Callable[[int], None]:
+        datapath = self.datapath
+        flags = datapath.alu.flags
+
+        def execute_branch(pc: int) -> None:
+            target = datapath.read_memory(pc + 1)
+            value = datapath.registers[datapath.src_left_register]
+            datapath.address_register = pc + 1
+            datapath.data_register = target
+            datapath.alu.load(value, 0, value)
+            datapath.jump_register = target
+            datapath.selected_flag = flag
+            datapath.inverse_flag = inverse
+            datapath.program_counter = target if flags[flag] ^ inverse else pc + 2
+
+        return execute_branch
+
+    def compile_step_register(self, step: int, operation: ALUOperations) -> Callable[[int], None]:
+        datapath = self.datapath
+        function = ALU_OPERATIONS[operation]
+
+        def execute_step_register(pc: int) -> None:
+            value = datapath.registers[datapath.src_left_register]
+            result = function(value, step)
+            datapath.alu.load(value, step, result)
+            datapath.registers[datapath.dst_register] = result
+            datapath.program_counter = pc + 1
+
+        return execute_step_register
+
+    def compile_step_memory(self, step: int, operation: ALUOperations) -> Callable[[int], None]:
+        datapath = self.datapath
+        function = ALU_OPERATIONS[operation]
+
+        def execute_step_memory(pc: int) -> None:
+            address = datapath.read_memory(pc + 1)
+            value = datapath.read_memory(address)
+            result = function(step, value)
+            datapath.alu.load(step, value, result)
+            datapath.address_register = address
+            datapath.data_register = result
+            datapath.write_memory(address, result)
+            datapath.program_counter = pc + 2
+
+        return execute_step_memory
+
+    def compile_alu_reg2reg(self, operation: ALUOperations) -> Callable[[int], None]:
+        datapath = self.datapath
+        registers = datapath.registers
+        function = ALU_OPERATIONS[operation]
+
+        def execute_reg2reg(pc: int) -> None:
+            left = registers[datapath.src_left_register]
+            right = registers[datapath.src_right_register]
+            result = function(left, right)
+            datapath.alu.load(left, right, result)
+            registers[datapath.dst_register] = result
+            datapath.program_counter = pc + 1
+
+        return execute_reg2reg
+
+    def compile_alu_mem2reg(self, operation: ALUOperations) -> Callable[[int], None]:
+        datapath = self.datapath
+        function = ALU_OPERATIONS[operation]
+
+        def execute_mem2reg(pc: int) -> None:
+            left = datapath.read_memory(datapath.read_memory(pc + 1))
+            address = datapath.read_memory(pc + 2)
+            right = datapath.read_memory(address)
+            result = function(left, right)
+            datapath.address_register = address
+            datapath.data_register = right
+            datapath.alu.load(left, right, result)
+            datapath.registers[datapath.dst_register] = result
+            datapath.program_counter = pc + 3
+
+        return execute_mem2reg
+
+    def compile_alu_mem2mem(self, operation: ALUOperations) -> Callable[[int], None]:
+        datapath = self.datapath
+        function = ALU_OPERATIONS[operation]
+
+        def execute_mem2mem(pc: int) -> None:
+            left = datapath.read_memory(datapath.read_memory(pc + 1))
+            right = datapath.read_memory(datapath.read_memory(pc + 2))
+            address = datapath.read_memory(pc + 3)
+            result = function(left, right)
+            datapath.address_register = address
+            datapath.data_register = result
+            datapath.alu.load(left, right, result)
+            datapath.write_memory(address, result)
+            datapath.program_counter = pc + 4
+
+        return execute_mem2mem
+
+    def compile_alu_mix2reg1(self, operation: ALUOperations) -> Callable[[int], None]:
+        datapath = self.datapath
+        function = ALU_OPERATIONS[operation]
+
+        def execute_mix2reg1(pc: int) -> None:
+            left = datapath.registers[datapath.src_left_register]
+            address = datapath.read_memory(pc + 1)
+            right = datapath.read_memory(address)
+            result = function(left, right)
+            datapath.address_register = address
+            datapath.data_register = right
+            datapath.alu.load(left, right, result)
+            datapath.registers[datapath.dst_register] = result
+            datapath.program_counter = pc + 2
+
+        return execute_mix2reg1
+
+    def compile_alu_mix2reg2(self, operation: ALUOperations) -> Callable[[int], None]:
+        datapath = self.datapath
+        function = ALU_OPERATIONS[operation]
+
+        def execute_mix2reg2(pc: int) -> None:
+            right = datapath.registers[datapath.src_right_register]
+            address = datapath.read_memory(pc + 1)
+            left = datapath.read_memory(address)
+            result = function(left, right)
+            datapath.address_register = address
+            datapath.data_register = left
+            datapath.alu.load(left, right, result)
+            datapath.registers[datapath.dst_register] = result
+            datapath.program_counter = pc + 2
+
+        return execute_mix2reg2
+
+
+def words_from_bytes(binary) -> array:
+    """Слова образа: по 4 байта big-endian, неполное последнее слово отбрасывается."""
+    words = array("I")
+    words.frombytes(memoryview(binary)[: len(binary) // 4 * 4])
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words
+
+
+def words_to_bytes(words) -> bytes:
+    """Обратное к words_from_bytes: слова по модулю 2**32 в байты big-endian."""
+    words = array("I", words)
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words.tobytes()
+
+
+def encode_program(code: list[Instruction | int]) -> array:
+    """Кодирует программу за один проход: инструкции - через encode_instruction, значения - по модулю 2**32."""
+    return array("I", [encode_instruction(cell) if isinstance(cell, Instruction) else cell & WORD_MASK for cell in code])
+
+
 def from_bytes(binary_code) -> list[Instruction | int]:
     """Преобразует бинарное представление машинного кода в структурированный формат."""
-    structured_code = []
-    # Обрабатываем байты по 4 за раз для получения 32-битных инструкций
+    structured_code = words_from_bytes(binary_code).tolist()
+    # одинаковые слова декодируются в один объект, как в ArrayMemory: инструкции не изменяются
+    decoded: dict[int, tuple[Instruction, int]] = {}
     i = 0
-    while i + 3 < len(binary_code):
+    while i < len(structured_code):
+        word = structured_code[i]
+        entry = decoded.get(word)
+        if entry is None:
+            instruction = decode_instruction(word)
+            entry = decoded[word] = instruction, immediates_amount(instruction.opcode, instruction.n)
+        structured_code[i] = entry[0]
+        i += 1 + entry[1]
+    return structured_code
 
-        # Формируем 32-битное слово из 4 байтов
-        binary_instr = (
-            (binary_code[i] << 24) | (binary_code[i + 1] << 16) | (binary_code[i + 2] << 8) | binary_code[i + 3]
-        )
-        # Извлекаем опкод (старшие 10 бит)
-        opcode_bin = (binary_instr >> 22)
-        opcode = Opcode(opcode_bin)
 
-        terms = []
-        for j in range(OPCODE_TO_TERMS_AMOUNT[opcode][0]):
-            value = binary_instr >> (19  - (j * 3)) & 0b111
-            terms += [Term(Registers.Registers(value))]
+def from_bytes_data(binary_data) -> list[int]:
+    return words_from_bytes(binary_data).tolist()
 
-        structured_code.append(Instruction(opcode, terms))
 
-        for _ in range(OPCODE_TO_TERMS_AMOUNT[opcode][1]):
-            i += 4
-            binary_instr = (
-                (binary_code[i] << 24) | (binary_code[i + 1] << 16) | (binary_code[i + 2] << 8) | binary_code[i + 3]
-            )
-            structured_code.append(binary_instr)
+def map_file(path) -> bytes | mmap.mmap:
+    """Отображает файл в память только для чтения (пустой файл отобразить нельзя, для него - b"")."""
+    with open(path, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return b""
 
-        i += 4
 
-    return structured_code
+class ProgramImage(NamedTuple):
+    """Карта памяти, точка входа и образы секций кода и данных (срезы прочитанных файлов без копирования)."""
 
-def from_bytes_data(binary_data) -> list[int]:
-    res = []
-    i = 0
-    while i + 3 < len(binary_data):
-        binary_value = (
-            (binary_data[i] << 24) | (binary_data[i + 1] << 16) | (binary_data[i + 2] << 8) | binary_data[i + 3]
-        )
-        res += [binary_value]
-        i += 4
-    return res
+    layout: MemoryLayout
+    entry: int
+    text: bytes | memoryview
+    data: bytes | memoryview | mmap.mmap
+    symbols: tuple[SymbolEntry, ...] = ()
+    lines: tuple[tuple[int, int], ...] = ()
 
 
+def read_program(code_file, data_file=None, *, mapped=False) -> ProgramImage:
+    """Читает контейнер (модуль container) или бинарный код, за заголовком карты памяти, и файл статических данных.
 
-def simulation(input_address, output_address, code, data, input_tokens, is_char_io) -> str:
-    datapath = DataPath(input_address, output_address)
-    for i, instr in enumerate(code):
-        datapath.memory[Address(i)] = instr
-    for i, value in enumerate(data):
-        datapath.memory[Address(i + 200)] = value
+    Если mapped, файлы не читаются - они отображаются в память (map_file).
+    """
 
-    datapath.input_buffer = input_tokens
+    def read(path) -> bytes | mmap.mmap:
+        if mapped:
+            return map_file(path)
+        with open(path, "rb") as f:
+            return f.read()
 
-    while datapath.tick < MAX_CYCLES:
-        try:
-            datapath.control_unit.run_single_micro()
-        except HltError:
-            logging.debug("HLT")
-            break
-        logging.debug(str(datapath))
-    else:
-        logging.error("Cycle limit hit")
+    binary = read(code_file)
+    if is_executable(binary):
+        executable = unpack(binary)
+        return ProgramImage(executable.layout, executable.entry, executable.text, executable.data,
+                            tuple(executable.symbols), tuple(executable.lines))
+    if data_file is None:
+        raise ValueError("Static data file is required for a binary that is not a container")
+    layout, offset = read_header(binary)
+    return ProgramImage(layout, layout.text_base, memoryview(binary)[offset:], read(data_file))
 
-    if is_char_io:
-        return "".join(chr(val) for val in datapath.output_buffer).encode().decode("unicode_escape")
-    return " ".join(str(val) for val in datapath.output_buffer)
 
-def main(code_file, data_file, input_file, input_address, output_address, is_char_io) -> None:
-    with open(code_file, "rb") as f:
-        bin_code = f.read()
-    with open(data_file, "rb") as f:
-        bin_data = f.read()
-    with open(input_file) as f:
-        input_text = f.read()
+def load_datapath(input_address, output_address, code, data, input_tokens, *, output_device=None,
+                  memory_backend="list", layout=DEFAULT_LAYOUT, cache_config=None, icache_config=None) -> DataPath:
+    """Создает процессор и загружает в память код и статические данные по карте памяти.
 
-    if is_char_io:
-        input_tokens = [ord(ch) for ch in input_text + "\0"]
-    elif input_text != "":
-        input_tokens = [int(num) for num in input_text.split("\n")]
+    input_tokens - список токенов или устройство ввода; без output_device вывод накапливается в ListOutput.
+    Без кэша инструкций выборка идет через кэш данных (общий кэш), иначе - только через кэш инструкций.
+    """
+    datapath = DataPath(input_address, output_address, memory_backend, layout)
+    for i, instr in enumerate(code):
+        datapath.memory.write(layout.text_base + i, instr)
+    for i, value in enumerate(data):
+        datapath.memory.write(layout.data_base + i, value)
+
+    # кэш подключается после загрузки, чтобы загрузка программы не попала в статистику
+    if cache_config is not None:
+        datapath.cache = Cache(cache_config, layout)
+    if icache_config is not None:
+        datapath.instruction_cache = Cache(icache_config, layout)
+    datapath.input_device = ListInput(input_tokens) if isinstance(input_tokens, list) else input_tokens
+    if output_device is not None:
+        datapath.output_device = output_device
+    return datapath
+
+
+def simulation(input_address, output_address, code, data, input_tokens, is_char_io, *,
+               fast=False, tracer=None, max_cycles=MAX_CYCLES, memory_backend="list", layout=DEFAULT_LAYOUT,
+               cache_config=None, icache_config=None, profiler=None) -> str:
+    """Запускает модель процессора и возвращает вывод; profiler (profiler.Profiler) собирает профиль."""
+    datapath = load_datapath(input_address, output_address, code, data, input_tokens,
+                             memory_backend=memory_backend, layout=layout, cache_config=cache_config,
+                             icache_config=icache_config)
+    run_datapath(datapath, fast=fast, tracer=tracer, max_cycles=max_cycles, profiler=profiler)
+    return format_output(datapath.output_device.values, is_char_io)
+
+
+def run_datapath(datapath, *, fast=False, tracer=None, max_cycles=MAX_CYCLES, profiler=None) -> bool:
+    """Исполняет не больше max_cycles тактов от текущего tick, возвращает True, если процессор остановился.
+
+    Без tracer при включенном DEBUG состояние пишется в корневой логгер после каждой микрокоманды.
+    При заданном profiler исполнение идет по инструкциям, и каждая передается в profiler.record; при
+    включенном tracer профиль не снимается (ValueError).
+    """
+    if profiler is not None and tracer is not None and tracer.enabled:
+        raise ValueError("Profiler and tracer can't be used together")
+    tick_limit = datapath.tick + max_cycles
+    control_unit = datapath.control_unit
+    if fast:
+        simulator = InstructionSimulator(datapath)
+        instruction_step, run = simulator.step, simulator.run
     else:
-        input_tokens = []
+        instruction_step, run = control_unit.run_instruction, control_unit.run
+
+    def micro_step(_tick_limit: int) -> None:
+        control_unit.run_single_micro()
+
+    halted = False
+    try:
+        if tracer is not None and tracer.enabled:
+            step = micro_step if tracer.granularity == Granularity.MICRO else instruction_step
+            traced_run(datapath, step, run, tracer, tick_limit)
+        elif profiler is not None:
+            profiled_run(datapath, instruction_step, profiler, tick_limit)
+        elif tracer is None and logging.getLogger().isEnabledFor(logging.DEBUG):
+            step = instruction_step if fast else micro_step
+            while datapath.tick < tick_limit:
+                step(tick_limit)
+                logging.debug(str(datapath))
+        else:
+            run(tick_limit)
+        logging.error("Cycle limit hit")
+    except HltError:
+        logging.debug("HLT")
+        halted = True
+    finally:
+        if tracer is not None:
+            tracer.close()
+    return halted
+
+
+def traced_run(datapath, step, run, tracer, tick_limit) -> None:
+    """До и после диапазона тактов трассировщика исполняет без записи, внутри пишет состояние после каждого шага."""
+    ticks = tracer.ticks or range(tick_limit)
+    run(min(ticks.start, tick_limit))
+    stop = min(ticks.stop, tick_limit)
+    while datapath.tick < stop:
+        step(tick_limit)
+        tracer.record(datapath, datapath.program_counter)
+    run(tick_limit)
+
+
+def profiled_run(datapath, step, profiler, tick_limit) -> None:
+    while datapath.tick < tick_limit:
+        pc, tick = datapath.program_counter, datapath.tick
+        instruction = datapath.memory.read(pc) if 0 <= pc < datapath.memory.memory_size else None
+        try:
+            step(tick_limit)
+        finally:
+            # HLT тоже попадает в профиль
+            profiler.record(pc, instruction, datapath.tick - tick, datapath.program_counter)
 
-    code = from_bytes(bin_code)
-    data = from_bytes_data(bin_data)
 
-    output = simulation(input_address, output_address, code, data, input_tokens, is_char_io)
-    print(output)
+def format_output(output_buffer, is_char_io) -> str:
+    if is_char_io:
+        return "".join(chr(val) for val in output_buffer).encode().decode("unicode_escape")
+    return " ".join(str(val) for val in output_buffer)
+
+def main(code_file, data_file, input_file, input_address, output_address, is_char_io, *,
+         fast=False, tracer=None, max_cycles=MAX_CYCLES, resume_file=None, snapshot_file=None,
+         memory_backend="list", cache_config=None, icache_config=None, output_buffer_size=4096,
+         profile_file=None, collapsed_file=None, coverage_file=None) -> None:
+    """Ввод читается из input_file ("-" - stdin) по мере обращений к порту, вывод пишется в stdout
+    порциями по output_buffer_size значений. profile_file и collapsed_file - куда записать плоский профиль
+    и стеки для flame graph (модуль profiler), имена функций и строки известны только для контейнера.
+    coverage_file - куда записать покрытие микропрограммы (модуль microcoverage)."""
+    image = read_program(code_file, data_file, mapped=memory_backend == "mmap")
+    layout = image.layout
+    # с mmap образы подключаются к памяти после создания процессора, без чтения и декодирования
+    code, data = ([], []) if memory_backend == "mmap" else (from_bytes(image.text), from_bytes_data(image.data))
+    if input_address is None:
+        input_address = layout.input_port
+    if output_address is None:
+        output_address = layout.output_port
+
+    input_context = contextlib.nullcontext(sys.stdin) if input_file == "-" else open(input_file, encoding="utf-8")  # noqa: SIM115
+    with input_context as input_stream:
+        output_device = StreamOutput(sys.stdout, is_char=bool(is_char_io), buffer_size=output_buffer_size)
+        datapath = load_datapath(input_address, output_address, code, data,
+                                 StreamInput(input_stream, is_char=bool(is_char_io)), output_device=output_device,
+                                 memory_backend=memory_backend, layout=layout, cache_config=cache_config,
+                                 icache_config=icache_config)
+        if memory_backend == "mmap":
+            datapath.memory.map(layout.text_base, image.text, is_code=True)
+            datapath.memory.map(layout.data_base, image.data)
+        datapath.program_counter = image.entry
+        if resume_file is not None:
+            with open(resume_file, "rb") as f:
+                datapath.restore(f.read())
+        profiler = None if profile_file is None and collapsed_file is None else Profiler(image.symbols, image.lines)
+        coverage = None
+        if coverage_file is not None:
+            coverage = MicrocodeCoverage(DECODE_PLANS)
+            coverage.attach(datapath.control_unit)
+        halted = run_datapath(datapath, fast=fast, tracer=tracer, max_cycles=max_cycles, profiler=profiler)
+    output_device.close()
+    print()
+    for path, write in ((profile_file, Profiler.report), (collapsed_file, Profiler.collapsed)):
+        if path is not None:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(write(profiler))
+    if coverage is not None:
+        with open(coverage_file, "w", encoding="utf-8") as f:
+            f.write(coverage.report())
+    if not halted and snapshot_file is not None:
+        with open(snapshot_file, "wb") as f:
+            f.write(datapath.snapshot())
+    if datapath.cache is not None or datapath.instruction_cache is not None:
+        print(f"ticks: {datapath.tick}")
+    if datapath.cache is not None:
+        print(datapath.cache.report())
+    if datapath.instruction_cache is not None:
+        print("instruction cache:")
+        print(datapath.instruction_cache.report())
 
 if __name__ == "__main__":
-    logging.getLogger().setLevel(logging.DEBUG)
-    _, code, data, inp, char_io = sys.argv
-    main(code, data, inp, 400, 401, is_char_io=int(char_io))
+    parser = argparse.ArgumentParser(description="Модель процессора")
+    parser.add_argument("code_file")
+    parser.add_argument("data_file", nargs="?", help="статические данные; для контейнера не указывается")
+    parser.add_argument("input_file", help='файл ввода, "-" - стандартный ввод')
+    parser.add_argument("is_char_io", type=int)
+    parser.add_argument("--fast", action="store_true", help="покомандная модель вместо микропрограммной")
+    parser.add_argument("--memory", choices=list(MEMORY_BACKENDS), default="list",
+                        help="array: знаковые 64-битные слова в array вместо списка объектов, "
+                             "mmap: образы отображаются в память и декодируются по страницам при обращении")
+    parser.add_argument("--cache-size", type=int, help="включить кэш данных указанного размера в словах")
+    parser.add_argument("--cache-line", type=int, default=CacheConfig.line_size)
+    parser.add_argument("--cache-ways", type=int, default=CacheConfig.associativity)
+    parser.add_argument("--cache-replacement", choices=[r.value for r in Replacement], default=Replacement.LRU.value)
+    parser.add_argument("--cache-write", choices=[w.value for w in WritePolicy], default=WritePolicy.WRITE_BACK.value)
+    parser.add_argument("--cache-miss-ticks", type=int, default=CacheConfig.miss_ticks)
+    parser.add_argument("--icache-size", type=int, help="включить отдельный кэш инструкций указанного размера")
+    parser.add_argument("--icache-line", type=int, default=CacheConfig.line_size)
+    parser.add_argument("--icache-ways", type=int, default=CacheConfig.associativity)
+    parser.add_argument("--icache-hit-ticks", type=int, default=CacheConfig.hit_ticks)
+    parser.add_argument("--icache-miss-ticks", type=int, default=CacheConfig.miss_ticks)
+    parser.add_argument("--output-buffer", type=int, default=4096, help="сколько значений вывода копить до записи")
+    parser.add_argument("--max-cycles", type=int, default=MAX_CYCLES, help="бюджет тактов на этот запуск")
+    parser.add_argument("--snapshot", metavar="FILE", help="куда сохранить снимок, если бюджет тактов исчерпан")
+    parser.add_argument("--resume", metavar="FILE", help="продолжить исполнение, загрузив снимок")
+    parser.add_argument("--trace", metavar="FILE", help="файл журнала состояний процессора")
+    parser.add_argument("--trace-level", choices=[g.value for g in Granularity], default=Granularity.MICRO.value)
+    parser.add_argument("--trace-ticks", type=parse_range, metavar="START:STOP")
+    parser.add_argument("--trace-pcs", type=parse_range, metavar="START:STOP")
+    parser.add_argument("--profile", metavar="FILE", help="записать профиль тактов по опкодам, функциям и строкам")
+    parser.add_argument("--profile-collapsed", metavar="FILE", help="записать стеки вызовов для flame graph")
+    parser.add_argument("--microcode-coverage", metavar="FILE",
+                        help="записать покрытие микропрограммы и самые частые микроадреса")
+    args = parser.parse_args()
+    if args.fast and args.microcode_coverage is not None:
+        parser.error("--microcode-coverage counts micro-instructions and needs the microcode model, drop --fast")
+    if args.trace is not None and Granularity(args.trace_level) != Granularity.NONE \
+            and (args.profile is not None or args.profile_collapsed is not None):
+        parser.error("--profile and --profile-collapsed can't be combined with --trace")
+
+    cache_config = None
+    if args.cache_size is not None:
+        cache_config = CacheConfig(args.cache_size, args.cache_line, args.cache_ways, Replacement(args.cache_replacement),
+                                   WritePolicy(args.cache_write), miss_ticks=args.cache_miss_ticks,
+                                   write_ticks=args.cache_miss_ticks)
+    icache_config = None
+    if args.icache_size is not None:
+        icache_config = CacheConfig(args.icache_size, args.icache_line, args.icache_ways,
+                                    hit_ticks=args.icache_hit_ticks, miss_ticks=args.icache_miss_ticks)
+    tracer = None
+    if args.trace is not None:
+        tracer = Tracer(FileSink(args.trace), Granularity(args.trace_level), args.trace_ticks, args.trace_pcs)
+    main(args.code_file, args.data_file, args.input_file, None, None,
+         is_char_io=args.is_char_io, fast=args.fast, tracer=tracer,
+         max_cycles=args.max_cycles, resume_file=args.resume, snapshot_file=args.snapshot,
+         memory_backend=args.memory, cache_config=cache_config, icache_config=icache_config,
+         output_buffer_size=args.output_buffer, profile_file=args.profile, collapsed_file=args.profile_collapsed,
+         coverage_file=args.microcode_coverage)
     # main("trash/out.bin", "trash/out.bin_data.bin", "trash/input.txt", 400, 401, is_char_io=False)
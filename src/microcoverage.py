@@ -0,0 +1,189 @@
+"""Покрытие микропрограммы: сколько раз исполнен каждый микроадрес.
+
+Микроадреса делятся на сегменты: выборка от нулевого адреса и сегменты опкодов, каждый от точки входа
+(значение Opcode) до следующей точки входа. MicrocodeCoverage.attach заменяет замыкания
+ControlUnit.compiled_mprogram счетчиками, поэтому счет идет при любом способе исполнения микрокоманд;
+без подключения модель ничего не теряет в скорости.
+"""
+
+import bisect
+import collections
+from collections.abc import Callable, Iterable
+
+from enums import Sel, Signal
+from isa import Opcode
+from microprogram import mprogram
+
+FETCH = "fetch"
+
+
+def format_micro(micro: tuple) -> str:
+    signal, *maybe_sel = micro
+    sel = maybe_sel[0] if maybe_sel else None
+    return signal.name if sel is None else f"{signal.name} {sel.name}"
+
+
+class MicrocodeCoverage:
+    def __init__(self, opcodes: Iterable[Opcode], program: list[tuple] = mprogram):
+        self.program = program
+        self.counts: list[int] = [0] * len(program)
+        # переходы с микроадреса в начало следующего сегмента без защелкивания mPC
+        self.fall_through: collections.Counter[int] = collections.Counter()
+        names = {0: FETCH}
+        for opcode in sorted(opcodes, key=lambda opcode: opcode.value):
+            names.setdefault(opcode.value, opcode.name)
+        self.starts = sorted(names)
+        self.names = [names[start] for start in self.starts]
+        self.compiled: list[Callable[[], int | None]] | None = None
+
+    def segment(self, address: int) -> int:
+        """Номер сегмента, которому принадлежит микроадрес."""
+        return bisect.bisect_right(self.starts, address) - 1
+
+    def location(self, address: int) -> str:
+        index = self.segment(address)
+        return f"{self.names[index]}+{address - self.starts[index]}"
+
+    def attach(self, control_unit) -> None:
+        self.compiled = control_unit.compiled_mprogram
+        starts = set(self.starts)
+        control_unit.compiled_mprogram = [
+            self.counted(address, step, boundary=address + 1 in starts and self.falls(address))
+            for address, step in enumerate(self.compiled)
+        ]
+
+    def detach(self, control_unit) -> None:
+        control_unit.compiled_mprogram = self.compiled
+
+    def counted(self, address: int, step: Callable[[], int | None], *, boundary: bool) -> Callable[[], int | None]:
+        counts = self.counts
+        if not boundary:
+            def count() -> int | None:
+                counts[address] += 1
+                return step()
+
+            return count
+
+        following = address + 1
+        fall_through = self.fall_through
+
+        def count_boundary() -> int | None:
+            counts[address] += 1
+            mpc_next = step()
+            if mpc_next is None or mpc_next == following:
+                fall_through[address] += 1
+            return mpc_next
+
+        return count_boundary
+
+    def falls(self, address: int) -> bool:
+        """Может ли исполнение перейти на следующий микроадрес без выбора mPC по опкоду."""
+        signal, *maybe_sel = self.program[address]
+        sel = maybe_sel[0] if maybe_sel else None
+        if signal == Signal.LATCH_MPROGRAM_COUNTER:
+            return sel in (Sel.MProgramCounter.PLUS_1, Sel.MProgramCounter.N)
+        return signal != Signal.HLT
+
+    def successors(self, address: int) -> list[int]:
+        signal, *maybe_sel = self.program[address]
+        sel = maybe_sel[0] if maybe_sel else None
+        if signal == Signal.HLT:
+            return []
+        if signal != Signal.LATCH_MPROGRAM_COUNTER or sel == Sel.MProgramCounter.PLUS_1:
+            return [address + 1]
+        if sel == Sel.MProgramCounter.ZERO:
+            return [0]
+        if sel == Sel.MProgramCounter.OPCODE:
+            return self.starts[1:]
+        # N: следующая микрокоманда или повтор с точки входа опкода
+        return [address + 1, self.starts[self.segment(address)]]
+
+    def reachable(self) -> set[int]:
+        """Микроадреса, достижимые от выборки по переходам микропрограммы."""
+        seen: set[int] = set()
+        pending = [0]
+        while pending:
+            address = pending.pop()
+            if address in seen or address >= len(self.program):
+                continue
+            seen.add(address)
+            pending.extend(self.successors(address))
+        return seen
+
+    def static_fall_through(self) -> list[int]:
+        """Достижимые микроадреса, после которых исполнение без перехода попадает в чужой сегмент."""
+        starts = set(self.starts)
+        return sorted(address for address in self.reachable() if address + 1 in starts and self.falls(address))
+
+    def dead(self) -> list[int]:
+        """Микроадреса, недостижимые ни из одной точки входа."""
+        reachable = self.reachable()
+        return [address for address in range(len(self.program)) if address not in reachable]
+
+    def by_segment(self) -> list[tuple[str, int, int, int, int]]:
+        """Сегменты: имя, исполнения первой микрокоманды, исполненные микрокоманды, покрытые и все микроадреса."""
+        bounds = [*self.starts, len(self.program)]
+        rows = []
+        for index, name in enumerate(self.names):
+            counts = self.counts[bounds[index]:bounds[index + 1]]
+            rows.append((name, counts[0], sum(counts), sum(1 for count in counts if count), len(counts)))
+        return rows
+
+    def sequences(self, length: int = 3) -> dict[tuple[tuple, ...], tuple[int, int]]:
+        """Повторяющиеся линейные цепочки из length микрокоманд -> (число мест в микропрограмме, исполнения).
+
+        Цепочка не содержит переходов mPC и не пересекает границу сегмента; исполнения в одном месте -
+        минимум счетчиков микроадресов цепочки. Соседние защелки левого и правого входов АЛУ независимы,
+        поэтому в ключе цепочки левая всегда идет первой.
+        """
+        starts = set(self.starts)
+        found: dict[tuple[tuple, ...], tuple[int, int]] = {}
+        for address in range(len(self.program) - length + 1):
+            window = range(address, address + length)
+            if any(self.program[a][0] in (Signal.LATCH_MPROGRAM_COUNTER, Signal.HLT) for a in window) or any(
+                    a in starts for a in window[1:]):
+                continue
+            micros = [tuple(self.program[a]) for a in window]
+            for i in range(length - 1):
+                if micros[i][0] == Signal.LATCH_RIGHT_ALU and micros[i + 1][0] == Signal.LATCH_LEFT_ALU:
+                    micros[i], micros[i + 1] = micros[i + 1], micros[i]
+            key = tuple(micros)
+            places, executions = found.get(key, (0, 0))
+            found[key] = places + 1, executions + min(self.counts[a] for a in window)
+        return {key: value for key, value in found.items() if value[0] > 1}
+
+    def report(self, limit: int = 20, length: int = 3) -> str:
+        total = sum(self.counts) or 1
+        covered = sum(1 for count in self.counts if count)
+        out = [f"micro-instructions: {sum(self.counts)}, covered: {covered}/{len(self.counts)}", "",
+               f"{'segment':16} {'entries':>10} {'micro':>12} {'%':>6} {'covered':>9}"]
+        rows = [row for row in self.by_segment() if row[2]]
+        for name, entries, micro, executed, size in sorted(rows, key=lambda row: -row[2]):
+            out.append(f"{name:16} {entries:10} {micro:12} {micro / total:6.1%} {executed:4}/{size:<4}")
+
+        out += ["", f"{'mpc':>5} {'location':20} {'count':>12} {'%':>6}  micro-instruction"]
+        hot = sorted(range(len(self.counts)), key=lambda address: -self.counts[address])[:limit]
+        for address in hot:
+            if self.counts[address]:
+                out.append(f"{address:5} {self.location(address):20} {self.counts[address]:12} "
+                           f"{self.counts[address] / total:6.1%}  {format_micro(self.program[address])}")
+
+        out += ["", f"repeated sequences of {length}:", f"{'places':>6} {'executions':>12} {'micro':>12}  sequence"]
+        sequences = sorted(self.sequences(length).items(), key=lambda item: (-item[1][1], -item[1][0]))
+        for key, (places, executions) in sequences[:limit]:
+            out.append(f"{places:6} {executions:12} {executions * length:12}  "
+                       + " / ".join(format_micro(micro) for micro in key))
+
+        out += ["", "dead microcode (unreachable):"]
+        out += [f"{address:5} {self.location(address):20} {format_micro(self.program[address])}"
+                for address in self.dead()] or ["none"]
+        out += ["", "not executed in executed segments:"]
+        reachable = self.reachable()
+        executed = {self.segment(address) for address, count in enumerate(self.counts) if count}
+        out += [f"{address:5} {self.location(address):20} {format_micro(self.program[address])}"
+                for address in sorted(reachable) if not self.counts[address] and self.segment(address) in executed
+                ] or ["none"]
+        out += ["", "fall-through into the next segment:"]
+        out += [f"{address:5} {self.location(address):20} -> {self.names[self.segment(address + 1)]}: "
+                f"{self.fall_through[address]}" for address in self.static_fall_through()] or ["none"]
+        return "\n".join(out) + "\n"
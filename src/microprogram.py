@@ -190,10 +190,7 @@ mprogram = [
     (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
     (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.CONTROL_UNIT),
     (Signal.LATCH_DATA_REGISTER, Sel.DataRegister.MEMORY),
-    (Signal.LATCH_RIGHT_ALU, Sel.RightALU.DR),
-    (Signal.LATCH_LEFT_ALU, Sel.LeftALU.ZERO),
-    (Signal.EXECUTE_ALU, ALUOperations.ADD),
-    (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.ALU),
+    (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.DR),  # mem[PC] -> AR
     (Signal.LATCH_DATA_REGISTER, Sel.DataRegister.MEMORY),  # mem[address] -> DR
     (Signal.LATCH_RIGHT_ALU, Sel.RightALU.DR),
     (Signal.LATCH_LEFT_ALU, Sel.LeftALU.REGISTER),
@@ -203,14 +200,15 @@ mprogram = [
     (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.N),
     (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
     (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    # unreachable, keeps the addresses of the following blocks
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
     # NSUB direct address (176)
     (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
     (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.CONTROL_UNIT),
     (Signal.LATCH_DATA_REGISTER, Sel.DataRegister.MEMORY),
-    (Signal.LATCH_RIGHT_ALU, Sel.RightALU.DR),
-    (Signal.LATCH_LEFT_ALU, Sel.LeftALU.ZERO),
-    (Signal.EXECUTE_ALU, ALUOperations.ADD),
-    (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.ALU),
+    (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.DR),  # mem[PC] -> AR
     (Signal.LATCH_DATA_REGISTER, Sel.DataRegister.MEMORY),  # mem[address] -> DR
     (Signal.LATCH_RIGHT_ALU, Sel.RightALU.DR),
     (Signal.LATCH_LEFT_ALU, Sel.LeftALU.REGISTER),
@@ -220,14 +218,15 @@ mprogram = [
     (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.N),
     (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
     (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    # unreachable, keeps the addresses of the following blocks
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
     # NOR direct address (192)
     (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
     (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.CONTROL_UNIT),
     (Signal.LATCH_DATA_REGISTER, Sel.DataRegister.MEMORY),
-    (Signal.LATCH_RIGHT_ALU, Sel.RightALU.DR),
-    (Signal.LATCH_LEFT_ALU, Sel.LeftALU.ZERO),
-    (Signal.EXECUTE_ALU, ALUOperations.ADD),
-    (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.ALU),
+    (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.DR),  # mem[PC] -> AR
     (Signal.LATCH_DATA_REGISTER, Sel.DataRegister.MEMORY),  # mem[address] -> DR
     (Signal.LATCH_RIGHT_ALU, Sel.RightALU.DR),
     (Signal.LATCH_LEFT_ALU, Sel.LeftALU.REGISTER),
@@ -237,23 +236,28 @@ mprogram = [
     (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.N),
     (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
     (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    # unreachable, keeps the addresses of the following blocks
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
     # AND direct address (208)
     (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
     (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.CONTROL_UNIT),
     (Signal.LATCH_DATA_REGISTER, Sel.DataRegister.MEMORY),
-    (Signal.LATCH_RIGHT_ALU, Sel.RightALU.DR),
-    (Signal.LATCH_LEFT_ALU, Sel.LeftALU.ZERO),
-    (Signal.EXECUTE_ALU, ALUOperations.ADD),
-    (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.ALU),
+    (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.DR),  # mem[PC] -> AR
     (Signal.LATCH_DATA_REGISTER, Sel.DataRegister.MEMORY),  # mem[address] -> DR
     (Signal.LATCH_RIGHT_ALU, Sel.RightALU.DR),
     (Signal.LATCH_LEFT_ALU, Sel.LeftALU.REGISTER),
-    (Signal.EXECUTE_ALU, ALUOperations.OR),
+    (Signal.EXECUTE_ALU, ALUOperations.AND),
     (Signal.LATCH_REGISTER, Sel.Register.ALU),  # dst_reg & mem[address + i] -> dst_reg
     (Signal.LATCH_N, Sel.N.MINUS_1),
     (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.N),
     (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
     (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    # unreachable, keeps the addresses of the following blocks
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
     # JUMP register (224)
     (Signal.LATCH_LEFT_ALU, Sel.LeftALU.REGISTER),
     (Signal.LATCH_RIGHT_ALU, Sel.RightALU.ZERO),
@@ -369,10 +373,7 @@ mprogram = [
     (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
     (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.CONTROL_UNIT),
     (Signal.LATCH_DATA_REGISTER, Sel.DataRegister.MEMORY),
-    (Signal.LATCH_RIGHT_ALU, Sel.RightALU.DR),
-    (Signal.LATCH_LEFT_ALU, Sel.LeftALU.ZERO),
-    (Signal.EXECUTE_ALU, ALUOperations.ADD),
-    (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.ALU),
+    (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.DR),  # mem[PC] -> AR
     (Signal.LATCH_DATA_REGISTER, Sel.DataRegister.MEMORY),  # mem[address] -> DR
     (Signal.LATCH_RIGHT_ALU, Sel.RightALU.DR),
     (Signal.LATCH_LEFT_ALU, Sel.LeftALU.REGISTER),
@@ -382,6 +383,10 @@ mprogram = [
     (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.N),
     (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
     (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    # unreachable, keeps the addresses of the following blocks
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
     # ADD reg to reg (337)
     (Signal.LATCH_LEFT_ALU, Sel.LeftALU.REGISTER),
     (Signal.LATCH_RIGHT_ALU, Sel.RightALU.REGISTER),
@@ -998,4 +1003,31 @@ mprogram = [
     (Signal.LATCH_REGISTER, Sel.Register.CARRY),
     (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
     (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    # MOV register relative (base register + offset) + 3
+    (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
+    (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.CONTROL_UNIT),
+    (Signal.LATCH_DATA_REGISTER, Sel.DataRegister.MEMORY),  # offset -> DR
+    (Signal.LATCH_LEFT_ALU, Sel.LeftALU.REGISTER),  # base register
+    (Signal.LATCH_RIGHT_ALU, Sel.RightALU.DR),
+    (Signal.EXECUTE_ALU, ALUOperations.ADD),
+    (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.ALU),  # base + offset -> AR
+    (Signal.LATCH_DATA_REGISTER, Sel.DataRegister.MEMORY),
+    (Signal.LATCH_REGISTER, Sel.Register.DR),  # mem[base + offset] -> dst register
+    (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
+    # STORE reg relative + 11
+    (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
+    (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.CONTROL_UNIT),
+    (Signal.LATCH_DATA_REGISTER, Sel.DataRegister.MEMORY),  # offset -> DR
+    (Signal.LATCH_LEFT_ALU, Sel.LeftALU.REGISTER),  # base register
+    (Signal.LATCH_RIGHT_ALU, Sel.RightALU.DR),
+    (Signal.EXECUTE_ALU, ALUOperations.ADD),
+    (Signal.LATCH_ADDRESS_REGISTER, Sel.AddressRegister.ALU),  # base + offset -> AR
+    (Signal.LATCH_RIGHT_ALU, Sel.RightALU.REGISTER),  # src register
+    (Signal.LATCH_LEFT_ALU, Sel.LeftALU.ZERO),
+    (Signal.EXECUTE_ALU, ALUOperations.ADD),
+    (Signal.LATCH_DATA_REGISTER, Sel.DataRegister.ALU),  # src_reg -> DR
+    (Signal.LATCH_MEMORY, None),  # src_reg -> mem[base + offset]
+    (Signal.LATCH_PROGRAM_COUNTER, Sel.ProgramCounter.NEXT),
+    (Signal.LATCH_MPROGRAM_COUNTER, Sel.MProgramCounter.ZERO),
 ]
@@ -0,0 +1,106 @@
+"""Профиль исполнения: такты по инструкциям, опкодам, функциям и строкам исходника.
+
+run_datapath передает профилировщику каждую исполненную инструкцию: адрес, инструкцию и потраченные такты.
+Вызовы отслеживаются теневым стеком: CALL кладет на него вызванную функцию и адрес возврата, переход на
+этот адрес снимает кадр. Имена функций и строки берутся из контейнера (модуль container); без них функция
+называется по адресу входа.
+"""
+
+import bisect
+import collections
+from collections.abc import Iterable
+
+from container import SymbolEntry, SymbolKind
+from isa import Instruction, Opcode, immediates_amount
+
+# кадр кода верхнего уровня программы
+ROOT_FRAME = "<top>"
+
+
+class Profiler:
+    def __init__(self, symbols: Iterable[SymbolEntry] = (), lines: Iterable[tuple[int, int]] = ()):
+        self.functions = {symbol.address: symbol.name for symbol in symbols if symbol.kind == SymbolKind.FUNCTION}
+        self.lines = sorted(lines)
+        self.line_addresses = [address for address, _ in self.lines]
+        self.counts: collections.Counter[int] = collections.Counter()
+        self.ticks: collections.Counter[int] = collections.Counter()
+        self.opcodes: dict[int, Opcode | None] = {}
+        # такты по стеку вызовов (от внешней функции к внутренней) и адресу инструкции
+        self.stacks: collections.Counter[tuple[tuple[str, ...], int]] = collections.Counter()
+        self.frames: tuple[str, ...] = (ROOT_FRAME,)
+        self.return_addresses: list[int] = []
+
+    def record(self, pc: int, instruction: Instruction | int | None, ticks: int, next_pc: int) -> None:
+        opcode = instruction.opcode if isinstance(instruction, Instruction) else None
+        self.counts[pc] += 1
+        self.ticks[pc] += ticks
+        self.opcodes[pc] = opcode
+        self.stacks[self.frames, pc] += ticks
+        if opcode == Opcode.CALL:
+            self.frames = (*self.frames, self.functions.get(next_pc, f"@{next_pc}"))
+            self.return_addresses.append(pc + 1 + immediates_amount(opcode, instruction.n))
+        elif self.return_addresses and next_pc == self.return_addresses[-1]:
+            self.frames = self.frames[:-1]
+            self.return_addresses.pop()
+
+    def line(self, pc: int) -> int:
+        """Строка исходника, породившая код по адресу pc, 0 - неизвестна."""
+        index = bisect.bisect_right(self.line_addresses, pc) - 1
+        return self.lines[index][1] if index >= 0 else 0
+
+    def by_opcode(self) -> dict[str, tuple[int, int]]:
+        """Опкод -> (число исполнений, такты)."""
+        totals: dict[str, tuple[int, int]] = {}
+        for pc, ticks in self.ticks.items():
+            name = self.opcodes[pc].name if self.opcodes[pc] is not None else "?"
+            count, total = totals.get(name, (0, 0))
+            totals[name] = count + self.counts[pc], total + ticks
+        return totals
+
+    def by_function(self) -> dict[str, tuple[int, int]]:
+        """Функция -> (собственные такты, такты включая вызванные функции)."""
+        totals: dict[str, tuple[int, int]] = {}
+        for (stack, _), ticks in self.stacks.items():
+            own, total = totals.get(stack[-1], (0, 0))
+            totals[stack[-1]] = own + ticks, total
+            # рекурсивная функция учитывается в стеке один раз
+            for name in set(stack):
+                own, total = totals.get(name, (0, 0))
+                totals[name] = own, total + ticks
+        return totals
+
+    def by_line(self) -> dict[int, int]:
+        totals: collections.Counter[int] = collections.Counter()
+        for pc, ticks in self.ticks.items():
+            totals[self.line(pc)] += ticks
+        return dict(totals)
+
+    def report(self, limit: int = 20) -> str:
+        """Плоский профиль: опкоды, функции, строки и самые затратные адреса, по убыванию тактов."""
+        total = sum(self.ticks.values()) or 1
+        out = [f"ticks: {sum(self.ticks.values())}, instructions: {sum(self.counts.values())}", "",
+               f"{'opcode':16} {'count':>10} {'ticks':>12} {'%':>6}"]
+        for name, (count, ticks) in sorted(self.by_opcode().items(), key=lambda item: -item[1][1]):
+            out.append(f"{name:16} {count:10} {ticks:12} {ticks / total:6.1%}")
+        out += ["", f"{'function':16} {'self':>12} {'%':>6} {'total':>12} {'%':>6}"]
+        for name, (own, inclusive) in sorted(self.by_function().items(), key=lambda item: -item[1][0]):
+            out.append(f"{name:16} {own:12} {own / total:6.1%} {inclusive:12} {inclusive / total:6.1%}")
+        if self.lines:
+            out += ["", f"{'line':>16} {'ticks':>12} {'%':>6}"]
+            for line, ticks in sorted(self.by_line().items(), key=lambda item: -item[1])[:limit]:
+                out.append(f"{line or '?':>16} {ticks:12} {ticks / total:6.1%}")
+        out += ["", f"{'pc':>16} {'opcode':16} {'count':>10} {'ticks':>12} {'%':>6}"]
+        for pc, ticks in self.ticks.most_common(limit):
+            name = self.opcodes[pc].name if self.opcodes[pc] is not None else "?"
+            out.append(f"{pc:16} {name:16} {self.counts[pc]:10} {ticks:12} {ticks / total:6.1%}")
+        return "\n".join(out) + "\n"
+
+    def collapsed(self) -> str:
+        """Стеки в формате collapsed (flamegraph.pl, speedscope): "f;g;h такты" на строку.
+
+        Если есть таблица строк, последний кадр - строка исходника внутри функции.
+        """
+        totals: collections.Counter[tuple[str, ...]] = collections.Counter()
+        for (stack, pc), ticks in self.stacks.items():
+            totals[(*stack, f"line {self.line(pc) or '?'}") if self.lines else stack] += ticks
+        return "".join(f"{';'.join(stack)} {ticks}\n" for stack, ticks in sorted(totals.items()) if ticks)
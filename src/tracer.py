@@ -0,0 +1,76 @@
+import collections
+import io
+from dataclasses import dataclass
+from enum import Enum
+from typing import Protocol
+
+
+class Granularity(Enum):
+    NONE = "none"
+    INSTRUCTION = "instruction"
+    MICRO = "micro"
+
+
+class TraceSink(Protocol):
+    def write(self, state: object) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class FileSink:
+    """Пишет записи в текстовый файл через большой буфер, строка формируется только здесь."""
+
+    def __init__(self, path: str, buffer_size: int = 1 << 20):
+        self.file = open(path, "w", encoding="utf-8", buffering=buffer_size)  # noqa: SIM115
+
+    def write(self, state: object) -> None:
+        self.file.write(f"{state}\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class RingBufferSink:
+    """Хранит в памяти только последние capacity записей."""
+
+    def __init__(self, capacity: int = 10_000):
+        self.records: collections.deque[str] = collections.deque(maxlen=capacity)
+
+    def write(self, state: object) -> None:
+        self.records.append(str(state))
+
+    def close(self) -> None:
+        pass
+
+    def dump(self, stream: io.TextIOBase) -> None:
+        stream.writelines(record + "\n" for record in self.records)
+
+
+@dataclass
+class Tracer:
+    """Что и куда трассировать: гранулярность, диапазоны тактов и PC, приемник записей.
+
+    Вне диапазона тактов модель работает без записи; диапазон PC проверяется после каждого шага.
+    """
+
+    sink: TraceSink
+    granularity: Granularity = Granularity.MICRO
+    ticks: range | None = None
+    pcs: range | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.granularity != Granularity.NONE
+
+    def record(self, state: object, program_counter: int) -> None:
+        if self.pcs is None or program_counter in self.pcs:
+            self.sink.write(state)
+
+    def close(self) -> None:
+        self.sink.close()
+
+
+def parse_range(text: str) -> range:
+    """Разбирает диапазон вида "start:stop" (любая граница может быть опущена)."""
+    start, _, stop = text.partition(":")
+    return range(int(start or 0), int(stop) if stop else 2**63)
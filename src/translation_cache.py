@@ -0,0 +1,102 @@
+import functools
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import NamedTuple
+
+from layout import MemoryLayout
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "csa_lab4" / "translations"
+DEFAULT_MAX_BYTES = 64 * 2**20
+
+# модули, от которых зависит результат трансляции: их изменение меняет все ключи
+TRANSLATOR_MODULES = ("translator.py", "isa.py", "layout.py", "machine.py", "container.py")
+
+
+class TranslationOutput(NamedTuple):
+    """Файлы транслятора: бинарный код (включая заголовок), листинг .hex, статические данные и контейнер
+    (см. container), объединяющий код, данные и отладочную информацию."""
+
+    code: bytes
+    listing: str
+    data: bytes
+    executable: bytes
+
+
+@functools.cache
+def translator_version() -> str:
+    """Хэш исходников транслятора и системы команд."""
+    digest = hashlib.sha256()
+    base = Path(__file__).parent
+    for name in TRANSLATOR_MODULES:
+        digest.update((base / name).read_bytes())
+    return digest.hexdigest()
+
+
+def cache_key(source: str, layout: MemoryLayout, optimization: int = 0, inline_threshold: int | None = None) -> str:
+    digest = hashlib.sha256(translator_version().encode())
+    digest.update(layout.header())
+    digest.update(f"-O{optimization} --inline {inline_threshold}".encode())
+    digest.update(source.encode())
+    return digest.hexdigest()
+
+
+class TranslationCache:
+    """Кэш результатов трансляции на диске, адресуемый содержимым (см. cache_key).
+
+    Запись - каталог из четырех файлов. Время доступа - mtime каталога, при превышении max_bytes
+    удаляются записи, к которым дольше всего не обращались.
+    """
+
+    FILES = ("code.bin", "code.hex", "data.bin", "executable.bin")
+
+    def __init__(self, directory: Path = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def get(self, key: str) -> TranslationOutput | None:
+        entry = self.directory / key
+        try:
+            code, listing, data, executable = (entry / name for name in self.FILES)
+            output = TranslationOutput(code.read_bytes(), listing.read_text(encoding="utf-8"), data.read_bytes(),
+                                       executable.read_bytes())
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return output
+
+    def put(self, key: str, output: TranslationOutput) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # запись собирается во временном каталоге и появляется целиком, переименованием
+        staging = Path(tempfile.mkdtemp(dir=self.directory, prefix=".tmp-"))
+        code, listing, data, executable = (staging / name for name in self.FILES)
+        code.write_bytes(output.code)
+        listing.write_text(output.listing, encoding="utf-8")
+        data.write_bytes(output.data)
+        executable.write_bytes(output.executable)
+        try:
+            staging.rename(self.directory / key)
+        except OSError:
+            # ту же запись уже положил параллельный процесс
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        total = 0
+        for entry in self.directory.iterdir():
+            if entry.name.startswith("."):
+                continue
+            try:
+                size = sum(file.stat().st_size for file in entry.iterdir())
+                entries.append((entry.stat().st_mtime, size, entry))
+            except FileNotFoundError:
+                continue  # запись удалил параллельный процесс
+            total += size
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
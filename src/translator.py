@@ -1,12 +1,16 @@
+import argparse
+import operator
 import re
-import sys
-from collections.abc import Callable
-from dataclasses import dataclass
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
 from enum import Enum, auto
-from typing import Union
+from typing import NamedTuple, TextIO, Union
 
-from isa import OPCODE_TO_TERMS_AMOUNT, Instruction, Opcode, Term
-from machine import Address, Memory, Registers
+from container import Executable, SymbolEntry, SymbolKind, pack, unpack
+from isa import MAX_N_OPERANDS, N_ARY_OPCODES, N_OPERANDS_MASK, Instruction, Opcode, Term, immediates_amount
+from layout import DEFAULT_LAYOUT, MemoryLayout, sized_layout
+from machine import DECODE_PLANS, Address, Memory, Registers, encode_program, words_to_bytes
+from translation_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, TranslationCache, TranslationOutput, cache_key
 
 
 @dataclass
@@ -57,6 +61,8 @@ class AddressingType(Enum):
 class Exp:
     operation: Operation | Atom
     operands: list[Union[Atom, "Exp"]]
+    # строка открывающей скобки в исходнике, 0 - выражение построено оптимизатором
+    line: int = field(default=0, compare=False)
 
 @dataclass
 class String:
@@ -122,6 +128,18 @@ BINOP_OPCODE: dict[Operation, dict[AddressingType, Opcode]] = {
     },
 }
 
+# (op a b c ...) с переменными в памяти после первых двух операндов - одна инструкция вместо цепочки
+# mix2reg1. Операнд в цикле N-арной инструкции стоит 11 тактов против 15 у mix2reg1, сама инструкция - еще 6
+# (выборка и выход из цикла), поэтому она выгоднее начиная с двух операндов
+N_ARY_MIN_OPERANDS = 2
+N_ARY_OPCODE: dict[Operation, Opcode] = {
+    Operation.ADD: Opcode.NADD_mem,
+    Operation.SUB: Opcode.NSUB_mem,
+    Operation.MUL: Opcode.NMUL_mem,
+    Operation.AND: Opcode.NAND_mem,
+    Operation.OR: Opcode.NOR_mem,
+}
+
 COMPARE_OPCODE: dict[Operation, Opcode] = {
     Operation.LT: Opcode.BLZ,
     Operation.GT: Opcode.BGZ,
@@ -129,53 +147,123 @@ COMPARE_OPCODE: dict[Operation, Opcode] = {
     Operation.NEQ: Opcode.BNEZ,
 }
 
+COND_INVERSE: dict[Operation, Operation] = {
+    Operation.EQ: Operation.NEQ,
+    Operation.NEQ: Operation.EQ,
+}
+
 
 # class Tokenizer:
 #     def tokenize(self, s: str) -> list[str]:
 #         return s.replace("(", " ( ").replace(")", " ) ").split()
 
+class Token(NamedTuple):
+    text: str
+    line: int
+    column: int
+
+
 class Tokenizer:
     _token_re = re.compile(
-        r'"(?:\\.|[^"])*"' # строка в кавычках
+        r';[^\n]*' # комментарий до конца строки
+        r'|"(?:\\[\s\S]|[^"\\])*"' # строка в кавычках (обратная косая черта всегда экранирует)
         r'|[()]' # или одна из скобок
-        r'|[^\s()"]+', # или любая непустая последовательность
+        r'|[^\s()";]+', # или любая непустая последовательность
     )
 
-    def tokenize(self, src: str) -> list[str]:
+    def tokenize(self, src: str) -> list[Token]:
+        return list(self.scan([src]))
+
+    def stream(self, file: TextIO, chunk_size: int = 1 << 16) -> Iterator[Token]:
+        """Токены файла, который читается кусками по chunk_size символов."""
+        return self.scan(iter(lambda: file.read(chunk_size), ""))
+
+    def scan(self, chunks: Iterable[str]) -> Iterator[Token]:
+        """Разбивает текст, поданный кусками, на токены; комментарии пропускаются.
+
+        Токен, который доходит до конца куска, и незакрытая строка откладываются до следующего куска.
+        """
         # снимать экранирование нужно только у строк-литералов
-        return self._token_re.findall(src)
+        buffer = ""
+        line, line_start, base = 1, 0, 0  # line_start и base - смещения от начала текста
+        chunks = iter(chunks)
+        eof = False
+        while not eof:
+            chunk = next(chunks, None)
+            eof = chunk is None
+            buffer += chunk or ""
+            scanned = 0  # до этой позиции буфера переводы строк уже посчитаны
+            keep = len(buffer)  # с этой позиции буфер переносится в следующий кусок
+            previous_end = 0
+            for match in self._token_re.finditer(buffer):
+                start = match.start()
+                if not eof:
+                    quote = buffer.find('"', previous_end, start)
+                    if quote >= 0 or match.end() == len(buffer):
+                        keep = quote if quote >= 0 else start
+                        break
+                previous_end = match.end()
+                newlines = buffer.count("\n", scanned, start)
+                if newlines:
+                    line += newlines
+                    line_start = base + buffer.rfind("\n", scanned, start) + 1
+                scanned = start
+                text = match.group()
+                if text[0] != ";":
+                    yield Token(text, line, base + start - line_start + 1)
+            else:
+                if not eof:
+                    quote = buffer.find('"', previous_end)
+                    keep = quote if quote >= 0 else len(buffer)
+            newlines = buffer.count("\n", scanned, keep)
+            if newlines:
+                line += newlines
+                line_start = base + buffer.rfind("\n", scanned, keep) + 1
+            buffer = buffer[keep:]
+            base += keep
 
 
+def syntax_error(message: str, token: Token) -> SyntaxError:
+    return SyntaxError(f"{message} at line {token.line}, column {token.column}")
+
 
 class Parser:
-    def parse(self, tokens: list[str]) -> Exp | Atom:
-        if not tokens:
-            err_message = "unexpected EOF"
-            raise SyntaxError(err_message)
+    def parse(self, tokens: Iterable[Token]) -> Exp | Atom:
+        """Разбирает первое выражение; токены берутся из итератора по одному.
+
+        Разбор итеративный: вместо рекурсии - явный стек незакрытых выражений, поэтому глубина
+        вложенности не ограничена стеком вызовов Python.
+        """
+        stack: list[tuple[Exp, Token]] = []  # незакрытые выражения и их открывающие скобки
+        tokens = iter(tokens)
+        for token in tokens:
+            node: Exp | Atom
+            if token.text == "(":
+                op_token = next(tokens, None)
+                if op_token is None:
+                    raise syntax_error('missing operation after "("', token)
+                op: Operation | Atom
+                try:
+                    op = Operation(op_token.text)
+                except ValueError:
+                    op = self.atom(op_token.text)
+                stack.append((Exp(operation=op, operands=[], line=token.line), token))
+                continue
+            if token.text == ")":
+                if not stack:
+                    raise syntax_error("unexpected ')'", token)
+                node = stack.pop()[0]
+            else:
+                node = self.atom(token.text)
 
-        token = tokens.pop(0)
+            if not stack:
+                return node
+            stack[-1][0].operands.append(node)
 
-        if token == "(":
-            if not tokens:
-                err_message = 'missing operation after "("'
-                raise SyntaxError(err_message)
-            op_token = tokens.pop(0)
-            op: Operation | Atom
-            try:
-                op = Operation(op_token)
-            except ValueError:
-                op = self.atom(op_token)
-
-            args = []
-            while tokens[0] != ")":
-                args.append(self.parse(tokens))
-            tokens.pop(0)  # remove ')'
-            return Exp(operation=op, operands=args)
-
-        if token == ")":
-            err_message = "unexpected ')'"
-            raise SyntaxError(err_message)
-        return self.atom(token)
+        if stack:
+            raise syntax_error("unexpected EOF, unclosed '('", stack[-1][1])
+        err_message = "unexpected EOF"
+        raise SyntaxError(err_message)
 
     def atom(self, token: str) -> Atom:
         if token.startswith('"') and token.endswith('"'):
@@ -186,18 +274,363 @@ class Parser:
             return Atom(Symbol(token))
 
 
+# непосредственный операнд декодируется как беззнаковое слово, свертка ведется только в [0, WORD_LIMIT)
+WORD_LIMIT = 2**31
+BINOP_ARITY = 2
+
+# значение сравнения - разность операндов в обратном порядке, как в Generator.handle_binop
+FOLD_FUNCTIONS: dict[Operation, Callable[[int, int], int]] = {
+    Operation.ADD: operator.add,
+    Operation.SUB: operator.sub,
+    Operation.MUL: operator.mul,
+    Operation.DIV: operator.floordiv,
+    Operation.RMD: operator.mod,
+    Operation.AND: operator.and_,
+    Operation.OR: operator.or_,
+    Operation.XOR: operator.xor,
+    Operation.LT: lambda a, b: b - a,
+    Operation.GT: lambda a, b: b - a,
+    Operation.EQ: lambda a, b: b - a,
+    Operation.NEQ: lambda a, b: b - a,
+}
+
+# при каких константных операндах выполняется тело while
+WHILE_CONDITIONS: dict[Operation, Callable[[int, int], bool]] = {
+    Operation.LT: operator.le,
+    Operation.GT: operator.gt,
+    Operation.EQ: operator.eq,
+    Operation.NEQ: operator.ne,
+}
+
+# то же для cond: Generator.handle_cond меняет == и != местами
+COND_CONDITIONS: dict[Operation, Callable[[int, int], bool]] = {
+    **WHILE_CONDITIONS,
+    Operation.EQ: operator.ne,
+    Operation.NEQ: operator.eq,
+}
+
+
+def constant(node: Exp | Atom) -> int | None:
+    if isinstance(node, Atom) and isinstance(node.value, Number) and 0 <= node.value.value < WORD_LIMIT:
+        return node.value.value
+    return None
+
+
+class Optimizer:
+    """Оптимизации AST между разбором и генерацией кода.
+
+    Уровень 1 (FOLD) - свертка константных выражений и условий cond/while, где операнды - константы.
+    Уровень 2 (DEAD_CODE) - еще и удаление мертвого кода: выражений без побочных эффектов, значение которых
+    begin отбрасывает, и функций, не достижимых по вызовам из кода верхнего уровня.
+    Уровень 3 (REGISTERS) AST не меняет: генератор держит переменные циклов в регистрах (см. Generator.handle_while).
+
+    Подстановка функций (inline_threshold > 0, по умолчанию - INLINE_THRESHOLD на уровнях 2 и 3): вызов
+    нерекурсивной функции, тело которой не больше inline_threshold узлов AST, заменяется телом (см. inline).
+    """
+
+    FOLD = 1
+    DEAD_CODE = 2
+    REGISTERS = 3
+    INLINE_THRESHOLD = 16
+
+    def __init__(self, level: int, special_forms: Iterable[str], inline_threshold: int | None = None):
+        self.level = level
+        self.special_forms = frozenset(special_forms)
+        self.inline_threshold = self.inline_limit(level, inline_threshold)
+        self.inlined: dict[str, Exp] = {}
+        self.inline_sites = 0
+
+    @classmethod
+    def inline_limit(cls, level: int, inline_threshold: int | None) -> int:
+        if inline_threshold is None:
+            return cls.INLINE_THRESHOLD if level >= cls.DEAD_CODE else 0
+        return inline_threshold
+
+    def optimize(self, expression: Exp | Atom) -> Exp | Atom:
+        if self.level >= self.FOLD:
+            expression = self.fold(expression)
+        if self.inline_threshold > 0:
+            expression = self.inline_functions(expression)
+        if self.level >= self.DEAD_CODE:
+            expression = self.remove_unused_functions(expression)
+        return expression
+
+    def fold(self, node: Exp | Atom) -> Exp | Atom:
+        if isinstance(node, Atom):
+            return node
+        op = node.operation
+        if isinstance(op, Operation):
+            return self.fold_binop(op, [self.fold(operand) for operand in node.operands], node.line)
+
+        name = op.value.value
+        if name == "defun":
+            # список параметров - не выражение, его не трогаем
+            fn_atom, args_exp, body = node.operands
+            folded = self.fold(body)
+            return Exp(op, [fn_atom, args_exp, folded if isinstance(folded, Exp) else body], node.line)
+        if name == "cond":
+            return self.fold_cond(node)
+        if name == "while":
+            return self.fold_while(node)
+        operands = [self.fold(operand) for operand in node.operands]
+        if name == "begin" and self.level >= self.DEAD_CODE:
+            operands = [operand for operand in operands[:-1] if not self.pure(operand)] + operands[-1:]
+        return Exp(op, operands, node.line)
+
+    @staticmethod
+    def fold_binop(op: Operation, operands: list[Exp | Atom], line: int = 0) -> Exp | Atom:
+        left, right = (constant(operand) for operand in operands) if len(operands) == BINOP_ARITY else (None, None)
+        if left is None or right is None or (op in (Operation.DIV, Operation.RMD) and right == 0):
+            return Exp(op, operands, line)
+        value = FOLD_FUNCTIONS[op](left, right)
+        return Atom(Number(value)) if 0 <= value < WORD_LIMIT else Exp(op, operands, line)
+
+    def fold_condition(self, condition: Exp | Atom) -> Exp | Atom:
+        """Сворачивает операнды условия, но не само сравнение: генератору нужна операция."""
+        if isinstance(condition, Exp) and condition.operation in WHILE_CONDITIONS:
+            return Exp(condition.operation, [self.fold(operand) for operand in condition.operands], condition.line)
+        return self.fold(condition)
+
+    @staticmethod
+    def condition_value(condition: Exp | Atom, conditions: dict[Operation, Callable[[int, int], bool]]) -> bool | None:
+        """Значение условия, если операнды - константы, иначе None."""
+        if not isinstance(condition, Exp) or condition.operation not in conditions or len(condition.operands) != BINOP_ARITY:
+            return None
+        left, right = (constant(operand) for operand in condition.operands)
+        if left is None or right is None:
+            return None
+        return conditions[condition.operation](left, right)
+
+    def fold_cond(self, node: Exp) -> Exp | Atom:
+        clauses = []
+        always = True  # все оставшиеся условия истинны при трансляции
+        for condition, body in zip(node.operands[::2], node.operands[1::2], strict=True):
+            folded = self.fold_condition(condition)
+            holds = self.condition_value(folded, COND_CONDITIONS)
+            if holds is False:
+                continue
+            always = always and holds is True
+            clauses.append((folded, self.fold(body)))
+        if not clauses:
+            return Atom(Number(0))
+        if always:
+            return Exp(Atom(Symbol("begin")), [body for _, body in clauses], node.line)
+        return Exp(node.operation, [item for clause in clauses for item in clause], node.line)
+
+    def fold_while(self, node: Exp) -> Exp | Atom:
+        condition = self.fold_condition(node.operands[0])
+        if self.condition_value(condition, WHILE_CONDITIONS) is False:
+            return Atom(Number(0))
+        return Exp(node.operation, [condition, *(self.fold(operand) for operand in node.operands[1:])], node.line)
+
+    def pure(self, node: Exp | Atom) -> bool:
+        """Вычисление выражения не имеет побочных эффектов (деление - только на ненулевую константу)."""
+        if isinstance(node, Atom):
+            # input и get_carry тоже записываются атомом
+            return not isinstance(node.value, Symbol) or node.value.value not in self.special_forms
+        op = node.operation
+        if not isinstance(op, Operation) or len(node.operands) < BINOP_ARITY:
+            return False
+        if op in (Operation.DIV, Operation.RMD) and not all(constant(operand) for operand in node.operands[1:]):
+            return False
+        return all(self.pure(operand) for operand in node.operands)
+
+    def remove_unused_functions(self, root: Exp | Atom) -> Exp | Atom:
+        calls: dict[str | None, set[str]] = {None: set()}  # None - код вне функций
+        self.collect_calls(root, None, calls)
+        reachable: set[str] = set()
+        pending = list(calls[None])
+        while pending:
+            name = pending.pop()
+            if name not in reachable:
+                reachable.add(name)
+                pending.extend(calls.get(name, ()))
+        return self.drop_functions(root, reachable)
+
+    def inline_functions(self, root: Exp | Atom) -> Exp | Atom:
+        definitions: dict[str, list[Exp]] = {}
+        self.collect_definitions(root, definitions)
+        calls: dict[str | None, set[str]] = {}
+        self.collect_calls(root, None, calls)
+        self.inlined = {
+            name: defuns[0] for name, defuns in definitions.items()
+            if len(defuns) == 1 and name not in self.special_forms and not self.recursive(name, calls)
+            and size(defuns[0].operands[2]) <= self.inline_threshold and not definitions_in(defuns[0].operands[2])
+        }
+        return self.inline(root)
+
+    def collect_definitions(self, node: Exp | Atom, definitions: dict[str, list[Exp]]) -> None:
+        if isinstance(node, Atom):
+            return
+        if isinstance(node.operation, Atom) and node.operation.value.value == "defun":
+            definitions.setdefault(node.operands[0].value.value, []).append(node)
+        for operand in node.operands:
+            self.collect_definitions(operand, definitions)
+
+    @staticmethod
+    def recursive(name: str, calls: dict[str | None, set[str]]) -> bool:
+        """Функция name вызывает себя, прямо или через другие функции."""
+        pending, seen = list(calls.get(name, ())), set()
+        while pending:
+            callee = pending.pop()
+            if callee == name:
+                return True
+            if callee not in seen:
+                seen.add(callee)
+                pending.extend(calls.get(callee, ()))
+        return False
+
+    def inline(self, node: Exp | Atom) -> Exp | Atom:
+        """Подставляет тела функций из self.inlined на место их вызовов.
+
+        (f a b) превращается в (begin (setq p2 b) (setq p1 a) (setq l 0) тело): аргументы вычисляются
+        в том же порядке, что и при вызове, локальные переменные обнуляются, как в кадре, если тело
+        не присваивает их первым делом. Имена параметров и локальных переменных получают префикс
+        "<функция> <номер подстановки> ": пробела не бывает в идентификаторах, и имена программы не пересекаются.
+        """
+        if isinstance(node, Atom):
+            return node
+        operands = [self.inline(operand) for operand in node.operands]
+        op = node.operation
+        defun = self.inlined.get(op.value.value) if isinstance(op, Atom) else None
+        if defun is None or len(defun.operands[1].operands) != len(operands):
+            return Exp(op, operands, node.line)
+
+        fn_name, args_exp, body = defun.operands
+        params = [arg.value.value for arg in args_exp.operands]
+        local_names: dict[str, None] = {}
+        self.collect_local_names(body, set(params), local_names)
+        self.inline_sites += 1
+        prefix = f"{fn_name.value.value} {self.inline_sites} "
+        body = self.inline(rename(body, {name: prefix + name for name in (*params, *local_names)}))
+
+        def setq(name: str, value: Exp | Atom) -> Exp:
+            return Exp(Atom(Symbol("setq")), [Atom(Symbol(prefix + name)), value], node.line)
+
+        bindings = [setq(param, argument) for param, argument in reversed(list(zip(params, operands, strict=True)))]
+        zeroes = [setq(name, Atom(Number(0))) for name in local_names if not assigned_first(body, prefix + name)]
+        return Exp(Atom(Symbol("begin")), [*bindings, *zeroes, body], node.line)
+
+    def collect_local_names(self, node: Exp | Atom, params: set[str], names: dict[str, None]) -> None:
+        """Как Generator.collect_locals: имена переменных тела функции, кроме параметров."""
+        if isinstance(node, Exp):
+            for operand in node.operands:
+                self.collect_local_names(operand, params, names)
+        elif isinstance(node.value, Symbol) and node.value.value not in params \
+                and node.value.value not in self.special_forms:
+            names[node.value.value] = None
+
+    def collect_calls(self, node: Exp | Atom, owner: str | None, calls: dict[str | None, set[str]]) -> None:
+        if isinstance(node, Atom):
+            return
+        op = node.operation
+        if isinstance(op, Atom):
+            name = op.value.value
+            if name == "defun":
+                owner = node.operands[0].value.value
+                calls.setdefault(owner, set())
+            elif name not in self.special_forms:
+                calls.setdefault(owner, set()).add(name)
+        for operand in node.operands:
+            self.collect_calls(operand, owner, calls)
+
+    def drop_functions(self, node: Exp | Atom, reachable: set[str]) -> Exp | Atom:
+        """Убирает из begin определения недостижимых функций, включая вложенные определения."""
+        if isinstance(node, Atom):
+            return node
+        operands = [self.drop_functions(operand, reachable) for operand in node.operands]
+        if isinstance(node.operation, Atom) and node.operation.value.value == "begin":
+            operands = [operand for operand in operands[:-1] if self.used(operand, reachable)] + operands[-1:]
+        return Exp(node.operation, operands, node.line)
+
+    def used(self, node: Exp | Atom, reachable: set[str]) -> bool:
+        """Выражение не defun либо определяет (в том числе во вложенных defun) достижимую функцию."""
+        if isinstance(node, Atom) or not isinstance(node.operation, Atom) or node.operation.value.value != "defun":
+            return True
+        calls: dict[str | None, set[str]] = {}
+        self.collect_calls(node, None, calls)
+        return bool(calls.keys() & reachable)
+
+
+def size(node: Exp | Atom) -> int:
+    """Число узлов AST."""
+    if isinstance(node, Atom):
+        return 1
+    return 1 + sum(size(operand) for operand in node.operands)
+
+
+def definitions_in(node: Exp | Atom) -> bool:
+    if isinstance(node, Atom):
+        return False
+    if isinstance(node.operation, Atom) and node.operation.value.value == "defun":
+        return True
+    return any(definitions_in(operand) for operand in node.operands)
+
+
+def mentions(node: Exp | Atom, name: str) -> bool:
+    if isinstance(node, Atom):
+        return node.value == Symbol(name)
+    return any(mentions(operand, name) for operand in node.operands)
+
+
+def rename(node: Exp | Atom, names: dict[str, str]) -> Exp | Atom:
+    """Копия node, где переменные переименованы по names (операции и вызовы не трогаются)."""
+    if isinstance(node, Atom):
+        if isinstance(node.value, Symbol) and node.value.value in names:
+            return Atom(Symbol(names[node.value.value]))
+        return node
+    return Exp(node.operation, [rename(operand, names) for operand in node.operands], node.line)
+
+
+def assigned_first(body: Exp | Atom, name: str) -> bool:
+    """Одно из выражений верхнего уровня begin присваивает name, и ни до него, ни в присваиваемом значении
+    name не читается."""
+    statements = body.operands if isinstance(body, Exp) and body.operation == Atom(Symbol("begin")) else [body]
+    for statement in statements:
+        if (isinstance(statement, Exp) and statement.operation == Atom(Symbol("setq"))
+                and statement.operands[0] == Atom(Symbol(name))):
+            return not mentions(statement.operands[1], name)
+        if mentions(statement, name):
+            return False
+    return False
+
+
 class Program:
     def __init__(self, memory: Memory):
         self.memory = memory
         self.idx = 0
 
 
+# во сколько раз упоминание переменной во вложенном цикле весомее, чем в объемлющем
+LOOP_WEIGHT = 8
+# до стольких слов стек освобождается командами POP (10 тактов), дальше - MOV_imm2r и ADD_reg2reg (20 тактов)
+POP_DROP_LIMIT = 2
+
+
+class GeneratorState(NamedTuple):
+    """Снимок генератора для отката пробной генерации."""
+
+    pc: int
+    program: list[Instruction | int]
+    next_free: int
+    scopes: list[dict[str, "Address | FrameSlot"]]
+    available: list[int]
+    pinned: set[int]
+    variable_registers: dict[str, Registers.Registers]
+    stack_depth: int
+    lines: int
+    line: int
+
+
 class Generator:
     def __init__(
         self,
         var_allocator: "VariableAllocator",
         reg_controller: "RegisterController",
         program: list[Instruction | int],
+        layout: MemoryLayout = DEFAULT_LAYOUT,
+        *,
+        loop_registers: bool = False,
     ):
         self.handlers_map: dict[str, Callable[[list[Exp]], Address | None]] = {
             "begin": self.handle_begin,
@@ -219,10 +652,55 @@ class Generator:
         self.var_allocator = var_allocator
         self.reg_controller = reg_controller
         self.program = program
-        self.PC = 0
+        self.layout = layout
+        self.PC = layout.text_base
         self.label_map: dict[str, dict[str: Address | int]] = {}
+        # переменные циклов в регистрах (см. handle_while): имя переменной -> регистр
+        self.loop_registers = loop_registers
+        self.variable_registers: dict[str, Registers.Registers] = {}
+        # сколько слов функция положила на стек поверх своего кадра (см. handle_call)
+        self.stack_depth = 0
+        # id самовызовов в хвостовой позиции тела функции (см. handle_tail_call)
+        self.tail_calls: set[int] = set()
+        # таблица строк: (адрес, строка исходника), с которого идет код формы с этой строки
+        self.lines: list[tuple[int, int]] = []
+        self.line = 0
+        # имена функций, тела которых сейчас генерируются (см. handle_defun)
+        self.defining: list[str] = []
+        # регистры назначения cond, которые тело ветви перезапишет: вызовы их не сохраняют (см. handle_cond)
+        self.unset: set[Registers.Registers] = set()
+
+    def generate(self, expression: Exp | Atom,
+                 dst_reg: Registers.Registers | None = None) -> Address | Registers.Registers | None:
+        """Генерирует код выражения; при заданном dst_reg значение оказывается в нем.
+
+        Операция, begin и cond пишут результат прямо в dst_reg, остальное пересылается в него.
+        """
+        if isinstance(expression, Exp) and expression.line:
+            # код после вложенной формы снова относится к строке объемлющей
+            outer, self.line = self.line, expression.line
+            self.lines.append((self.PC, self.line))
+            value = self.generate_node(expression, dst_reg)
+            self.line = outer
+            self.lines.append((self.PC, outer))
+            return value
+        return self.generate_node(expression, dst_reg)
+
+    def generate_node(self, expression: Exp | Atom,
+                      dst_reg: Registers.Registers | None = None) -> Address | Registers.Registers | None:
+        if isinstance(expression, Exp):
+            op = expression.operation
+            if isinstance(op, Operation):
+                return self.handle_binop(op, expression.operands, dst_reg)
+            if dst_reg is not None and op in (Atom(Symbol("begin")), Atom(Symbol("cond"))):
+                return self.handlers_map[op.as_symbol()](expression.operands, dst_reg)
+        value = self.generate_value(expression)
+        if dst_reg is None or value is None:
+            return value
+        self.move(dst_reg, value)
+        return dst_reg
 
-    def generate(self, expression: Exp | Atom) -> Address | Registers.Registers | None:
+    def generate_value(self, expression: Exp | Atom) -> Address | Registers.Registers | None:
         if isinstance(expression, Atom):
             if expression.value.value in self.handlers_map:
                 return self.handlers_map[expression.as_symbol()]()
@@ -234,18 +712,47 @@ class Generator:
             if isinstance(op, Atom):
                 if op.value.value in self.handlers_map:
                     return self.handlers_map[op.as_symbol()](expression.operands)
+                if id(expression) in self.tail_calls:
+                    return self.handle_tail_call(op, expression.operands)
                 return self.handle_call(op, expression.operands)
 
         err_message = f"operation: f{op}"
         raise RuntimeError(err_message)
 
+    def move(self, dst_reg: Registers.Registers, value: Address | Registers.Registers) -> None:
+        if isinstance(value, Address):
+            self.emit(Opcode.MOV_da2r, [Term(dst_reg)], [value.value])
+        elif value != dst_reg:
+            self.emit(Opcode.MOV_r2r, [Term(dst_reg), Term(value)], [])
+            self.reg_controller.release(value)
+
     def emit(self, opcode: Opcode, terms: list[Term], imm_terms: list[int | None]) -> None:
-        self.program[self.PC] = Instruction(opcode, terms)
+        # у N-арной операции непосредственные операнды - адреса, их число записывается в инструкцию
+        self.program[self.PC] = Instruction(opcode, terms, len(imm_terms) if opcode in N_ARY_OPCODES else 0)
         self.PC += 1
         for imm in imm_terms:
             self.program[self.PC] = imm
             self.PC += 1
 
+    def save(self) -> "GeneratorState":
+        return GeneratorState(self.PC, self.program.copy(), self.var_allocator.next_free,
+                              [scope.copy() for scope in self.var_allocator.scopes],
+                              self.reg_controller.available.copy(), self.reg_controller.pinned.copy(),
+                              self.variable_registers.copy(), self.stack_depth, len(self.lines), self.line)
+
+    def restore(self, state: "GeneratorState") -> None:
+        self.PC = state.pc
+        self.program[:] = state.program
+        self.var_allocator.next_free = state.next_free
+        # снимок может понадобиться еще раз, поэтому восстанавливаются копии
+        self.var_allocator.scopes = [scope.copy() for scope in state.scopes]
+        self.reg_controller.available = state.available.copy()
+        self.reg_controller.pinned = state.pinned.copy()
+        self.variable_registers = state.variable_registers.copy()
+        self.stack_depth = state.stack_depth
+        del self.lines[state.lines:]
+        self.line = state.line
+
     def _store_string(self, text: str) -> Address:
         addr = self.var_allocator.new_addr()
         for i, ch in enumerate(text.encode() + b"\0"):
@@ -254,16 +761,39 @@ class Generator:
         return addr
 
 
-    def handle_begin(self, operands: list[Exp]) -> None:
+    def handle_begin(self, operands: list[Exp], dst_reg: Registers.Registers | None = None) -> None:
         for operand in operands[:-1]:
             value = self.generate(operand)
             if isinstance(value, Registers.Registers):
                 self.reg_controller.release(value)
-        return self.generate(operands[-1])
+        return self.generate(operands[-1], dst_reg)
+
+    def load_variable(self, register: Registers.Registers, variable: "Address | FrameSlot") -> None:
+        if isinstance(variable, FrameSlot):
+            self.emit(Opcode.MOV_rel2r, [Term(register), Term(Registers.Registers.RSP)],
+                      [variable.index + self.stack_depth])
+        else:
+            self.emit(Opcode.MOV_da2r, [Term(register)], [variable.value])
+
+    def store_variable(self, register: Registers.Registers, variable: "Address | FrameSlot") -> None:
+        if isinstance(variable, FrameSlot):
+            self.emit(Opcode.STORE_r2rel, [Term(register), Term(Registers.Registers.RSP)],
+                      [variable.index + self.stack_depth])
+        else:
+            self.emit(Opcode.STORE_r2da, [Term(register)], [variable.value])
 
     def handle_atom(self, atom: Atom) -> Address | Registers.Registers:
         if isinstance(atom.value, Symbol):
-            return self.var_allocator.allocate(atom.value.value)
+            name = atom.value.value
+            variable = self.var_allocator.allocate(name)
+            if name in self.variable_registers:
+                return self.variable_registers[name]
+            if isinstance(variable, FrameSlot):
+                # локальная переменная функции читается из кадра относительно RSP
+                dst_reg = self.reg_controller.alloc()
+                self.load_variable(dst_reg, variable)
+                return dst_reg
+            return variable
         if isinstance(atom.value, Number):
             dst_reg = self.reg_controller.alloc()
             self.emit(Opcode.MOV_imm2r, [Term(dst_reg)], [atom.value.value])
@@ -279,19 +809,19 @@ class Generator:
     def handle_print(self, operands: list[Exp]) -> Registers.Registers:
         value = self.generate(operands[0])
         if isinstance(value, Registers.Registers):
-            self.emit(Opcode.STORE_r2da, [Term(value)], [401])
+            self.emit(Opcode.STORE_r2da, [Term(value)], [self.layout.output_port])
 
         if isinstance(value, Address):
             tmp_reg = self.reg_controller.alloc()
             self.emit(Opcode.MOV_da2r, [Term(tmp_reg)], [value.value])
-            self.emit(Opcode.STORE_r2da, [Term(tmp_reg)], [401])
+            self.emit(Opcode.STORE_r2da, [Term(tmp_reg)], [self.layout.output_port])
             self.reg_controller.release(tmp_reg)
             value = tmp_reg
         return value
 
     def handle_input(self) -> Registers.Registers:
         dst_reg = self.reg_controller.alloc()
-        self.emit(Opcode.MOV_da2r, [Term(dst_reg)], [400])
+        self.emit(Opcode.MOV_da2r, [Term(dst_reg)], [self.layout.input_port])
         return dst_reg
 
     def handle_dereferencing(self, operands: list[Exp]) -> Registers.Registers:
@@ -343,9 +873,11 @@ class Generator:
 
         self.reg_controller.release(value_reg)
 
-    def handle_setq(self, operands: list[Exp]) -> Address:
-        var_address = self.generate(operands[0])
-        assert isinstance(var_address, Address)
+    def handle_setq(self, operands: list[Exp]) -> Address | Registers.Registers:
+        name = operands[0].as_symbol()
+        variable = self.var_allocator.allocate(name)
+        if name in self.variable_registers:
+            return self.setq_register(self.variable_registers[name], operands[1])
 
         var_value = self.generate(operands[1])
         assert isinstance(var_value, Registers.Registers | Address)
@@ -353,23 +885,56 @@ class Generator:
         if isinstance(var_value, Address):
             tmp_reg = self.reg_controller.alloc()
             self.emit(Opcode.MOV_da2r, [Term(tmp_reg)], [var_value.value])
-            self.emit(Opcode.STORE_r2da, [Term(tmp_reg)], [var_address.value])
-            self.reg_controller.release(tmp_reg)
-
-        elif isinstance(var_value, Registers.Registers):
-            self.emit(Opcode.STORE_r2da, [Term(var_value)], [var_address.value])
-            self.reg_controller.release(var_value)
-
-        return var_address
+            var_value = tmp_reg
+        self.store_variable(var_value, variable)
+
+        if isinstance(variable, FrameSlot):
+            # ячейка кадра сдвигается вместе с RSP, поэтому результатом остается регистр со значением
+            return var_value
+        self.reg_controller.release(var_value)
+        return variable
+
+    def setq_register(self, var_reg: Registers.Registers, expression: Exp | Atom) -> Registers.Registers:
+        if isinstance(expression, Exp) and isinstance(expression.operation, Operation):
+            # операнды прочитаны раньше записи результата: операция пишет прямо в регистр переменной
+            return self.handle_binop(expression.operation, expression.operands, var_reg)
+        value = self.generate(expression)
+        if isinstance(value, Address):
+            self.emit(Opcode.MOV_da2r, [Term(var_reg)], [value.value])
+        elif value != var_reg:
+            self.emit(Opcode.MOV_r2r, [Term(var_reg), Term(value)], [])
+            self.reg_controller.release(value)
+        return var_reg
 
     def handle_binop(
         self,
         operation: Operation,
         operands: list[Atom | Exp],
+        dst_reg: Registers.Registers | None = None,
     ) -> Registers.Registers:
-        first = self.generate(operands[0])
-        second = self.generate(operands[1])
-        dst_reg = self.reg_controller.alloc()
+        if len(operands) > BINOP_ARITY:
+            return self.handle_nary(operation, operands, dst_reg)
+        if self.calls(operands[1]) and isinstance(operands[0], Atom) and not self.assigns(operands[1], operands[0]):
+            # переменная или константа читается после вызова, чтобы не сохранять ее регистр на стеке
+            second = self.generate(operands[1])
+            first = self.generate(operands[0])
+        else:
+            first = self.generate(operands[0])
+            variable = isinstance(first, Address) or first in self.variable_registers.values()
+            if variable and self.assigns_any(operands[1]):
+                # значение переменной нужно до того, как второй операнд ее перезапишет
+                value, first = first, self.reg_controller.alloc()
+                if isinstance(value, Address):
+                    self.emit(Opcode.MOV_da2r, [Term(first)], [value.value])
+                else:
+                    self.emit(Opcode.MOV_r2r, [Term(first), Term(value)], [])
+            second = self.generate(operands[1])
+        if dst_reg is None:
+            # операнды читаются раньше записи результата, поэтому он может занять регистр операнда
+            for operand in (first, second):
+                if isinstance(operand, Registers.Registers):
+                    self.reg_controller.release(operand)
+            dst_reg = self.reg_controller.alloc()
 
         if operation in (Operation.LT, Operation.GT, Operation.EQ, Operation.NEQ):
             operation = Operation.SUB
@@ -378,12 +943,9 @@ class Generator:
         if isinstance(first, Registers.Registers):
             if isinstance(second, Registers.Registers):
                 self.emit(BINOP_OPCODE[operation][AddressingType.REG2REG], [Term(dst_reg), Term(first), Term(second)], [])
-                self.reg_controller.release(first)
-                self.reg_controller.release(second)
 
             elif isinstance(second, Address):
                 self.emit(BINOP_OPCODE[operation][AddressingType.MIX2REG1], [Term(dst_reg), Term(first)], [second.value])
-                self.reg_controller.release(first)
 
         elif isinstance(first, Address):
             if isinstance(second, Address):
@@ -391,13 +953,167 @@ class Generator:
 
             elif isinstance(second, Registers.Registers):
                 self.emit(BINOP_OPCODE[operation][AddressingType.MIX2REG2], [Term(dst_reg), Term(second)], [first.value])
-                self.reg_controller.release(second)
 
+        for operand in (first, second):
+            if isinstance(operand, Registers.Registers) and operand != dst_reg:
+                self.reg_controller.release(operand)
+        return dst_reg
+
+    def handle_nary(self, operation: Operation, operands: list[Atom | Exp],
+                    dst_reg: Registers.Registers | None) -> Registers.Registers:
+        """(op a b c ...) = ((a op b) op c) ...
+
+        Если операнды после первого - переменные в памяти (и их не меньше N_ARY_MIN_OPERANDS), первый
+        загружается в регистр результата, остальные читаются одной N-арной инструкцией (по MAX_N_OPERANDS
+        адресов на инструкцию). Если и первый операнд в памяти, (a op b) дешевле вычислить одной mem2reg.
+        """
+        first_in_memory = self.memory_variable(operands[0]) is not None
+        rest = operands[BINOP_ARITY:] if first_in_memory else operands[1:]
+        addresses = [self.memory_variable(operand) for operand in rest]
+        if operation not in N_ARY_OPCODE or None in addresses or len(addresses) < N_ARY_MIN_OPERANDS:
+            return self.handle_binop(operation, [Exp(operation, operands[:-1]), operands[-1]], dst_reg)
+
+        if first_in_memory:
+            dst_reg = self.handle_binop(operation, operands[:BINOP_ARITY], dst_reg)
+        else:
+            first = self.generate(operands[0])
+            if dst_reg is None:
+                free = isinstance(first, Registers.Registers) and first.value not in self.reg_controller.pinned
+                dst_reg = first if free else self.reg_controller.alloc()
+            if isinstance(first, Address):
+                self.emit(Opcode.MOV_da2r, [Term(dst_reg)], [first.value])
+            elif first != dst_reg:
+                self.emit(Opcode.MOV_r2r, [Term(dst_reg), Term(first)], [])
+                self.reg_controller.release(first)
+        for start in range(0, len(addresses), MAX_N_OPERANDS):
+            chunk = [address.value for address in addresses[start:start + MAX_N_OPERANDS]]
+            self.emit(N_ARY_OPCODE[operation], [Term(dst_reg)], chunk)
         return dst_reg
 
-    def handle_while(self, operands: list[Exp]) -> None:
+    def memory_variable(self, operand: Atom | Exp) -> Address | None:
+        """Адрес переменной, значение которой сейчас в памяти (не в регистре цикла и не в кадре)."""
+        if not isinstance(operand, Atom) or not isinstance(operand.value, Symbol) \
+                or operand.value.value in self.handlers_map or operand.value.value in self.variable_registers:
+            return None
+        variable = self.var_allocator.allocate(operand.value.value)
+        return variable if isinstance(variable, Address) else None
+
+    def calls_any(self, node: Exp | Atom, names: set[str]) -> bool:
+        """Вызывает ли node (включая вложенные defun) одну из функций names."""
+        if not isinstance(node, Exp):
+            return False
+        if isinstance(node.operation, Atom) and node.operation.value.value in names:
+            return True
+        return any(self.calls_any(operand, names) for operand in node.operands)
+
+    def calls(self, node: Exp | Atom) -> bool:
+        if not isinstance(node, Exp):
+            return False
+        if isinstance(node.operation, Atom) and node.operation.value.value not in self.handlers_map:
+            return True
+        return any(self.calls(operand) for operand in node.operands)
+
+    @staticmethod
+    def overwrites(node: Exp | Atom) -> bool:
+        """Дает ли node значение: store и defun значения не дают, и регистр назначения cond остается прежним."""
+        while isinstance(node, Exp) and node.operation == Atom(Symbol("begin")):
+            node = node.operands[-1]
+        return not (isinstance(node, Exp) and node.operation in (Atom(Symbol("store")), Atom(Symbol("defun"))))
+
+    @staticmethod
+    def assigns(node: Exp | Atom, variable: Atom) -> bool:
+        """Есть ли в node setq переменной variable."""
+        if not isinstance(node, Exp):
+            return False
+        if node.operation == Atom(Symbol("setq")) and node.operands[0] == variable:
+            return True
+        return any(Generator.assigns(operand, variable) for operand in node.operands)
+
+    @staticmethod
+    def assigns_any(node: Exp | Atom) -> bool:
+        if not isinstance(node, Exp):
+            return False
+        if node.operation == Atom(Symbol("setq")):
+            return True
+        return any(Generator.assigns_any(operand) for operand in node.operands)
+
+    def handle_while(self, operands: list[Exp]) -> Registers.Registers:
+        """Цикл; при loop_registers самые используемые в нем переменные на время цикла живут в регистрах.
+
+        Кандидаты - переменные цикла без вызовов функций и defun (вызываемый код читает переменные из памяти),
+        упорядоченные по числу упоминаний (во вложенном цикле упоминание весит в LOOP_WEIGHT раз больше). Сколько регистров можно
+        отдать переменным, показывает пробная генерация цикла без них: остальные нужны временным значениям.
+        Перед циклом переменные загружаются в регистры, на выходе измененные выгружаются обратно в память.
+        """
         assert isinstance(operands[0].operation, Operation)
+        counts: dict[str, int] = {}
+        assigned: set[str] = set()
+        if not self.loop_registers or not self.count_variables(operands, 1, counts, assigned):
+            self.generate_loop(operands)
+            return self.reg_controller.alloc()
+
+        state = self.save()
+        self.loop_registers = False
+        self.reg_controller.peak = self.reg_controller.in_use()
+        self.generate_loop(operands)
+        spare = len(ALLOCATABLE_REGISTERS) - len(self.reg_controller.pinned) - self.reg_controller.peak
+        self.restore(state)
+        self.loop_registers = True
+
+        names = sorted(counts, key=counts.get, reverse=True)
+        slots = [self.var_allocator.allocate(name) for name in names]
+        variables = [(name, slot) for name, slot in zip(names, slots, strict=True)
+                     if name not in self.variable_registers][:max(spare, 0)]
+        if not variables:
+            self.generate_loop(operands)
+            return self.reg_controller.alloc()
 
+        try:
+            self.generate_register_loop(operands, variables, assigned)
+        except IndexError:
+            # временным значениям не хватило регистров: цикл без закрепленных переменных
+            self.restore(state)
+            self.generate_loop(operands)
+        return self.reg_controller.alloc()
+
+    def generate_register_loop(self, operands: list[Exp], variables: list[tuple[str, "Address | FrameSlot"]],
+                               assigned: set[str]) -> None:
+        registers = self.reg_controller.pin(len(variables))
+        for (name, variable), register in zip(variables, registers, strict=True):
+            self.variable_registers[name] = register
+            self.load_variable(register, variable)
+
+        self.generate_loop(operands)
+
+        for (name, variable), register in zip(variables, registers, strict=True):
+            if name in assigned:
+                self.store_variable(register, variable)
+            del self.variable_registers[name]
+        self.reg_controller.unpin(registers)
+
+    def count_variables(self, nodes: list[Exp | Atom], weight: int, counts: dict[str, int],
+                        assigned: set[str]) -> bool:
+        """Считает упоминания переменных в nodes; False, если там есть вызов функции или defun."""
+        for node in nodes:
+            if isinstance(node, Atom):
+                name = node.value.value
+                if isinstance(node.value, Symbol) and name not in self.handlers_map:
+                    counts[name] = counts.get(name, 0) + weight
+                continue
+            inner = weight
+            if isinstance(node.operation, Atom):
+                name = node.operation.as_symbol()
+                if name == "defun" or name not in self.handlers_map:
+                    return False
+                if name == "while":
+                    inner = weight * LOOP_WEIGHT
+                if name == "setq" and isinstance(node.operands[0], Atom):
+                    assigned.add(node.operands[0].value.value)
+            if not self.count_variables(node.operands, inner, counts, assigned):
+                return False
+        return True
+
+    def generate_loop(self, operands: list[Exp]) -> None:
         start_pc = self.PC
         cond_reg = self.generate(operands[0])
         jmp_pc = self.PC + 1
@@ -413,111 +1129,257 @@ class Generator:
         self.emit(Opcode.JMP_imm, [], [start_pc])
         self.program[jmp_pc] = self.PC
 
-        return self.reg_controller.alloc()
+    def handle_cond(self, operands: list[Exp], dst_reg: Registers.Registers | None = None) -> Registers.Registers:
+        """Условия проверяются по очереди, тело каждого истинного пишет значение в dst_reg.
 
-    def handle_cond(self, operands: list[Exp]) -> Registers.Registers:
-        dst_reg = self.reg_controller.alloc()
+        Пока вычисляется тело, которое перепишет dst_reg, прежнее значение не нужно, и вызовы в теле не
+        сохраняют этот регистр (self.unset). R0 портит любой вызов, поэтому прямо в R0 cond пишет, только если в
+        условиях после первого вызовов нет.
+        """
+        if dst_reg is not None and dst_reg.value not in ALLOCATABLE_REGISTERS \
+                and any(self.calls(condition) for condition in operands[2::2]):
+            self.move(dst_reg, self.handle_cond(operands))
+            return dst_reg
+        if dst_reg is None:
+            dst_reg = self.reg_controller.alloc()
         for i, op in enumerate(operands):
             if i % 2 == 0:
                 cond_reg = self.generate(op)
                 jmp_pc = self.PC + 1
-                if op.operation == Operation.EQ:
-                    op.operation = Operation.NEQ
-                elif op.operation == Operation.NEQ:
-                    op.operation = Operation.EQ
-                self.emit(COMPARE_OPCODE[op.operation], [Term(cond_reg)], [None])
+                # cond переходит при ложном условии: == и != меняются местами (AST не трогаем - цикл
+                # с cond может генерироваться дважды, см. handle_while)
+                operation = COND_INVERSE.get(op.operation, op.operation)
+                self.emit(COMPARE_OPCODE[operation], [Term(cond_reg)], [None])
                 self.reg_controller.release(cond_reg)
             else:
-                tmp = self.generate(op)
-                if isinstance(tmp, Registers.Registers):
-                    self.emit(Opcode.MOV_r2r, [Term(dst_reg), Term(tmp)], [])
-                    self.reg_controller.release(tmp)
-                elif isinstance(tmp, Address):
-                    self.emit(Opcode.MOV_da2r, [Term(dst_reg)], [tmp.value])
+                unset = dst_reg not in self.unset and self.overwrites(op)
+                if unset:
+                    self.unset.add(dst_reg)
+                try:
+                    self.generate(op, dst_reg)
+                finally:
+                    if unset:
+                        self.unset.discard(dst_reg)
                 self.program[jmp_pc] = self.PC
 
         return dst_reg
 
     def handle_defun(self, operands: list[Exp]) -> None:
+        """Функция; результат - в R0, аргументы на стеке снимает вызывающий код.
+
+        Функция, которая может войти в себя повторно (вызывает себя или объемлющую функцию), держит переменные
+        в кадре на стеке. Кадр от RSP на входе в тело: локальные переменные, адрес возврата, аргументы.
+        Переменные остальных функций - статические адреса, аргументы в них записывает вызывающий код.
+        Обнуляются только локальные переменные, которые могут быть прочитаны до первого присваивания.
+        """
         jmp_pc = self.PC + 1
         self.emit(Opcode.JMP_imm, [], [None])
 
         fn_atom, args_exp, body_exprs = operands
         fn_name = fn_atom.value.value
         args = [a.value.value for a in args_exp.operands]
+        local_names: dict[str, None] = {}
+        self.collect_locals(body_exprs.operands, set(args), local_names)
+        self.defining.append(fn_name)
+        frame = self.calls_any(body_exprs, set(self.defining))
 
-        self.var_allocator.push_fn_scope(fn_name, args)
-        args_slots = [self.var_allocator[p] for p in args]
+        self.var_allocator.push_fn_scope(fn_name, args, list(local_names), frame=frame)
+        depth, self.stack_depth = self.stack_depth, 0
 
         self.label_map[fn_name] = {
             "address": Address(self.PC),
             "args_amount": len(args),
-            "locals_amount": None,
+            "locals_amount": len(local_names) if frame else 0,
+            "params": args,
+            "slots": None if frame else [self.var_allocator[arg] for arg in args],
         }
-
-        tmp_ret = self.reg_controller.alloc()
-        self.emit(Opcode.POP, [Term(tmp_ret)], [])
-
-        for slot in args_slots:
-            tmp = self.reg_controller.alloc()
-            self.emit(Opcode.POP, [Term(tmp)], [])
-            self.emit(Opcode.STORE_r2da, [Term(tmp)], [slot.value])
-            self.reg_controller.release(tmp)
-
-        self.emit(Opcode.PUSH, [Term(tmp_ret)], [])
-        self.reg_controller.release(tmp_ret)
-
-        [self.generate(exp) for exp in body_exprs.operands[:-1]]
-        ret_reg = self.generate(body_exprs.operands[-1])
-
-
-        if isinstance(ret_reg, Address):
-            self.emit(Opcode.MOV_da2r, [Term(Registers.Registers.R0)], [ret_reg.value])
-        elif isinstance(ret_reg, Registers.Registers):
-            self.emit(Opcode.MOV_r2r, [Term(Registers.Registers.R0), Term(ret_reg)], [])
-            self.reg_controller.release(ret_reg)
-        else:
+        self.tail_calls.update(id(call) for call in self.find_tail_calls(body_exprs, fn_name, len(args)))
+
+        unset = [name for name in local_names if not assigned_first(body_exprs, name)]
+        if frame and unset:
+            zero = self.reg_controller.alloc()
+            self.emit(Opcode.MOV_imm2r, [Term(zero)], [0])
+            for _ in local_names:
+                self.emit(Opcode.PUSH, [Term(zero)], [])
+            self.reg_controller.release(zero)
+        elif frame:
+            self.reserve(len(local_names))
+        elif unset:
+            zero = self.reg_controller.alloc()
+            self.emit(Opcode.MOV_imm2r, [Term(zero)], [0])
+            for name in unset:
+                self.store_variable(zero, self.var_allocator[name])
+            self.reg_controller.release(zero)
+
+        for exp in body_exprs.operands[:-1]:
+            value = self.generate(exp)
+            if isinstance(value, Registers.Registers):
+                self.reg_controller.release(value)
+        ret_reg = self.generate(body_exprs.operands[-1], Registers.Registers.R0)
+        if ret_reg is None:
             err_message = f"incorrect operand type: {ret_reg}"
             raise TypeError(err_message)
 
+        self.drop(self.label_map[fn_name]["locals_amount"])
         self.emit(Opcode.RET, [], [])
 
+        self.stack_depth = depth
         self.var_allocator.pop_fn_scope()
+        self.defining.pop()
 
+        self.label_map[fn_name]["end"] = Address(self.PC)
         self.program[jmp_pc] = self.PC
 
+    def find_tail_calls(self, node: Exp | Atom, fn_name: str, arity: int) -> Iterator[Exp]:
+        """Вызовы fn_name, значение которых - значение node: последнее выражение begin, тело последней ветви cond.
+
+        Остальные ветви cond не хвостовые: после ветви проверяются следующие условия.
+        """
+        if not isinstance(node, Exp) or not isinstance(node.operation, Atom) or not node.operands:
+            return
+        name = node.operation.value.value
+        if name == fn_name and len(node.operands) == arity:
+            yield node
+        elif name in ("begin", "cond"):
+            yield from self.find_tail_calls(node.operands[-1], fn_name, arity)
+
+    def collect_locals(self, nodes: list[Exp | Atom], params: set[str], names: dict[str, None]) -> None:
+        """Имена переменных тела функции в порядке появления; вложенные defun пропускаются."""
+        for node in nodes:
+            if isinstance(node, Exp):
+                if isinstance(node.operation, Atom) and node.operation.value == Symbol("defun"):
+                    continue
+                self.collect_locals(node.operands, params, names)
+            elif isinstance(node.value, Symbol) and node.value.value not in params \
+                    and node.value.value not in self.handlers_map:
+                names[node.value.value] = None
+
+    def reserve(self, words: int) -> None:
+        """Сдвигает RSP на words слов вниз, не записывая их."""
+        if words == 0:
+            return
+        if words == 1:
+            self.emit(Opcode.PUSH, [Term(Registers.Registers.R0)], [])
+            return
+        scratch = self.reg_controller.alloc()
+        self.emit(Opcode.MOV_imm2r, [Term(scratch)], [words])
+        self.emit(Opcode.SUB_reg2reg, [Term(Registers.Registers.RSP), Term(Registers.Registers.RSP), Term(scratch)], [])
+        self.reg_controller.release(scratch)
+
+    def drop(self, words: int) -> None:
+        """Сдвигает RSP на words слов вверх."""
+        if words == 0:
+            return
+        scratch = self.reg_controller.alloc()
+        if words <= POP_DROP_LIMIT:
+            for _ in range(words):
+                self.emit(Opcode.POP, [Term(scratch)], [])
+        else:
+            self.emit(Opcode.MOV_imm2r, [Term(scratch)], [words])
+            self.emit(Opcode.ADD_reg2reg, [Term(Registers.Registers.RSP), Term(Registers.Registers.RSP), Term(scratch)], [])
+        self.reg_controller.release(scratch)
+
+    def push(self, register: Registers.Registers) -> None:
+        self.emit(Opcode.PUSH, [Term(register)], [])
+        self.stack_depth += 1
 
     def handle_call(self, op: Operation, operands: list[Exp | Atom]) -> Registers.Registers:
         fn_name = op.value.value
-
-        for param in self.var_allocator.scopes[-1]:
-            temp = self.reg_controller.alloc()
-            self.emit(Opcode.MOV_da2r, [Term(temp)], [self.var_allocator[param].value])
-            self.emit(Opcode.PUSH, [Term(temp)], [])
-            self.reg_controller.release(temp)
-
-        for arg_expr in reversed(operands):
-            value = self.generate(arg_expr)
-
-            if isinstance(value, Registers.Registers):
-                self.emit(Opcode.PUSH, [Term(value)], [])
-                self.reg_controller.release(value)
+        function = self.label_map[fn_name]
+
+        # вызываемая функция портит регистры: занятые временными значениями сохраняются на стеке
+        live = [Registers.Registers(reg) for reg in ALLOCATABLE_REGISTERS
+                if reg not in self.reg_controller.available and Registers.Registers(reg) not in self.unset]
+        for reg in live:
+            self.push(reg)
+
+        if function["slots"] is None:
+            for arg_expr in reversed(operands):
+                register = self.argument_register(arg_expr)
+                self.push(register)
+                self.reg_controller.release(register)
+        else:
+            self.store_arguments(operands, function["slots"])
+
+        self.emit(Opcode.CALL, [], [function["address"].value])
+
+        result = self.reg_controller.alloc()
+        self.emit(Opcode.MOV_r2r, [Term(result), Term(Registers.Registers.R0)], [])
+        if function["slots"] is None:
+            self.drop(len(operands))
+            self.stack_depth -= len(operands)
+        for reg in reversed(live):
+            self.emit(Opcode.POP, [Term(reg)], [])
+            self.stack_depth -= 1
+        return result
+
+    def store_arguments(self, operands: list[Exp | Atom], slots: list[Address]) -> None:
+        """Записывает аргументы в статические ячейки параметров.
+
+        Аргумент пишется сразу, если следующие за ним по вычислению аргументы функций не вызывают: иначе вызов
+        той же функции перезаписал бы ячейку. Остальные ждут на стеке, пока не вычислены все.
+        """
+        waiting = []
+        for index in reversed(range(len(operands))):
+            register = self.argument_register(operands[index])
+            if any(self.calls(operand) for operand in operands[:index]):
+                self.push(register)
+                waiting.append(slots[index])
             else:
-                tmp = self.reg_controller.alloc()
-                self.emit(Opcode.MOV_da2r, [Term(tmp)], [value.value])
-                self.emit(Opcode.PUSH, [Term(tmp)], [])
-                self.reg_controller.release(tmp)
-
-        self.emit(Opcode.CALL, [], [self.label_map[fn_name]["address"].value])
-
-        for param in reversed(self.var_allocator.scopes[-1]):
-            param_reg = self.reg_controller.alloc()
-            self.emit(Opcode.POP, [Term(param_reg)], [])
-            self.emit(Opcode.STORE_r2da, [Term(param_reg)],[self.var_allocator[param].value])
-            self.reg_controller.release(param_reg)
+                self.store_variable(register, slots[index])
+            self.reg_controller.release(register)
+        if waiting:
+            register = self.reg_controller.alloc()
+            for slot in reversed(waiting):
+                self.emit(Opcode.POP, [Term(register)], [])
+                self.stack_depth -= 1
+                self.store_variable(register, slot)
+            self.reg_controller.release(register)
+
+    def handle_tail_call(self, op: Atom, operands: list[Exp | Atom]) -> Registers.Registers:
+        """Самовызов в хвостовой позиции: аргументы пишутся на место параметров в текущем кадре,
+        локальные переменные снимаются, и выполняется переход на начало функции - стек не растет."""
+        function = self.label_map[op.value.value]
+        # аргумент, равный своему же параметру, не меняется
+        changed = [(operand, self.var_allocator[param]) for operand, param in zip(operands, function["params"], strict=True)
+                   if operand != Atom(Symbol(param))]
+        state = self.save()
+        try:
+            self.rebind_registers(changed)
+        except IndexError:
+            # значения не поместились в регистры: пересылка через стек
+            self.restore(state)
+            self.rebind_stack(changed)
+        self.drop(function["locals_amount"])
+        self.emit(Opcode.JMP_imm, [], [function["address"].value])
+        return self.reg_controller.alloc()
 
-        return Registers.Registers.R0
+    def argument_register(self, expression: Exp | Atom) -> Registers.Registers:
+        value = self.generate(expression)
+        if isinstance(value, Address):
+            register = self.reg_controller.alloc()
+            self.emit(Opcode.MOV_da2r, [Term(register)], [value.value])
+            return register
+        return value
 
+    def rebind_registers(self, changed: list[tuple[Exp | Atom, "FrameSlot"]]) -> None:
+        # все аргументы вычисляются до первой записи: они могут читать старые значения параметров
+        registers = [self.argument_register(operand) for operand, _ in reversed(changed)][::-1]
+        for register, (_, slot) in zip(registers, changed, strict=True):
+            self.store_variable(register, slot)
+            self.reg_controller.release(register)
+
+    def rebind_stack(self, changed: list[tuple[Exp | Atom, "FrameSlot"]]) -> None:
+        for operand, _ in reversed(changed):
+            register = self.argument_register(operand)
+            self.push(register)
+            self.reg_controller.release(register)
+        register = self.reg_controller.alloc()
+        for _, slot in changed:
+            self.emit(Opcode.POP, [Term(register)], [])
+            self.stack_depth -= 1
+            self.store_variable(register, slot)
+        self.reg_controller.release(register)
 
     def handle_cons(self, operands: list[Exp]) -> Registers.Registers | Address:
         value = self.generate(operands[0])
@@ -574,7 +1436,7 @@ class Generator:
         self.emit(Opcode.MOV_imm2r, [Term(one)], [1])
 
         if isinstance(ptr, Registers.Registers):
-            self.emit(Opcode.ADD_reg2reg, [Term(one), Term(ptr), Term(one)])
+            self.emit(Opcode.ADD_reg2reg, [Term(one), Term(ptr), Term(one)], [])
             self.reg_controller.release(ptr)
         elif isinstance(ptr, Address):
             self.emit(Opcode.ADD_mix2reg1, [Term(one), Term(one)], [ptr.value])
@@ -631,51 +1493,328 @@ class Generator:
         self.emit(Opcode.GET_CARRY, [Term(dst_reg)], [])
         return dst_reg
 
+# непосредственный операнд этих инструкций - адрес в коде
+JUMP_OPCODES = (Opcode.JMP_imm, Opcode.CALL, Opcode.BEQZ, Opcode.BNEZ, Opcode.BGZ, Opcode.BLZ)
+# после них линейный участок кончается
+CONTROL_OPCODES = (*JUMP_OPCODES, Opcode.JMP_r, Opcode.RET, Opcode.HLT)
+# читают флаги, оставленные предыдущей инструкцией
+FLAG_READERS = (Opcode.BEQZ, Opcode.BNEZ, Opcode.BGZ, Opcode.BLZ, Opcode.GET_CARRY)
+
+REG2REG_OPERATION: dict[Opcode, Operation] = {
+    opcodes[AddressingType.REG2REG]: operation for operation, opcodes in BINOP_OPCODE.items()
+}
+
+
+class Line(NamedTuple):
+    """Инструкция и непосредственные операнды; address - адрес до текущего прохода."""
+
+    instruction: Instruction
+    immediates: list[int]
+    address: int
+
+    @property
+    def opcode(self) -> Opcode:
+        return self.instruction.opcode
+
+    def register(self, index: int) -> Registers.Registers:
+        return self.instruction.terms[index].value
+
+    def size(self) -> int:
+        return 1 + len(self.immediates)
+
+
+def line(opcode: Opcode, registers: list[Registers.Registers], immediates: list[int], address: int) -> Line:
+    return Line(Instruction(opcode, [Term(register) for register in registers]), immediates, address)
+
+
+class Peephole:
+    """Локальные оптимизации сгенерированного кода: окно из двух соседних инструкций.
+
+    - MOV_r2r в тот же регистр и JMP_imm на следующую инструкцию удаляются;
+    - MOV_da2r (MOV_rel2r) сразу после STORE_r2da (STORE_r2rel) в то же слово заменяется на MOV_r2r (или удаляется);
+    - MOV_imm2r Rk 1 и ADD_reg2reg/SUB_reg2reg, где операнд - Rk, превращаются в INC_r/DEC_r результата;
+    - MOV_da2r Rk и операция reg2reg над Rk превращаются в операцию mix2reg.
+    - инструкция, пишущая результат в Rk, и MOV_r2r Rm Rk превращаются в одну инструкцию, пишущую в Rm.
+
+    Регистр Rk заменяется, только если на всех путях дальше запись в Rk идет раньше чтения.
+    Вторая инструкция окна не должна быть целью перехода. Проходы повторяются, пока код сокращается;
+    после каждого адреса переходов (операнды JUMP_OPCODES) пересчитываются.
+    """
+
+    def __init__(self, layout: MemoryLayout = DEFAULT_LAYOUT):
+        self.ports = (layout.input_port, layout.output_port)
+        self.positions: dict[int, int] = {}  # адрес строки -> индекс в текущем проходе
+        # адрес до оптимизации -> адрес после нее, для символов и таблицы строк
+        self.moved: dict[int, int] = {}
+
+    def optimize(self, program: list[Instruction | int], start: int, end: int) -> int:
+        """Переписывает код program[start:end] на месте, возвращает новый конец кода."""
+        self.moved = {address: address for address in range(start, end + 1)}
+        while True:
+            lines = self.decode(program, start, end)
+            optimized = self.rewrite(lines, {target for ln in lines if ln.opcode in JUMP_OPCODES
+                                             for target in ln.immediates})
+            if len(optimized) == len(lines):
+                return end
+            new_address = self.relocate(program, start, end, optimized)
+            self.moved = {old: new_address[address] for old, address in self.moved.items()}
+            end = new_address[end]
+
+    @staticmethod
+    def decode(program: list[Instruction | int], start: int, end: int) -> list[Line]:
+        lines = []
+        address = start
+        while address < end:
+            instruction = program[address]
+            immediates = immediates_amount(instruction.opcode, instruction.n)
+            lines.append(Line(instruction, program[address + 1:address + 1 + immediates], address))
+            address += 1 + immediates
+        return lines
+
+    @staticmethod
+    def relocate(program: list[Instruction | int], start: int, end: int, lines: list[Line]) -> dict[int, int]:
+        """Раскладывает строки подряд от start и переводит адреса переходов; возвращает новые адреса
+        старых (адрес удаленной строки переходит к следующей, end - к новому концу кода)."""
+        new_address = {}
+        address = start
+        for ln in lines:
+            new_address[ln.address] = address
+            address += ln.size()
+        new_end = moved = new_address[end] = address
+        for old in range(end - 1, start - 1, -1):
+            moved = new_address.setdefault(old, moved)
+
+        address = start
+        for ln in lines:
+            program[address] = ln.instruction
+            immediates = [new_address[target] for target in ln.immediates] if ln.opcode in JUMP_OPCODES \
+                else ln.immediates
+            program[address + 1:address + 1 + len(immediates)] = immediates
+            address += ln.size()
+        program[new_end:end] = [0] * (end - new_end)
+        return new_address
+
+    def rewrite(self, lines: list[Line], targets: set[int]) -> list[Line]:
+        self.positions = {ln.address: index for index, ln in enumerate(lines)}
+        result: list[Line] = []
+        i = 0
+        while i < len(lines):
+            current = lines[i]
+            following = lines[i + 1] if i + 1 < len(lines) else None
+            if self.removable(current, lines, i):
+                i += 1
+                continue
+            if following is not None and following.address not in targets:
+                replacement = self.combine(current, following, lines, i + 2)
+                if replacement is not None:
+                    result.extend(replacement)
+                    i += 2
+                    continue
+            result.append(current)
+            i += 1
+        return result
+
+    @staticmethod
+    def reads_flags(lines: list[Line], index: int) -> bool:
+        return index < len(lines) and lines[index].opcode in FLAG_READERS
+
+    def removable(self, current: Line, lines: list[Line], index: int) -> bool:
+        if self.reads_flags(lines, index + 1):
+            return False
+        if current.opcode == Opcode.MOV_r2r:
+            return current.register(0) == current.register(1)
+        if current.opcode == Opcode.JMP_imm:
+            following = lines[index + 1].address if index + 1 < len(lines) else current.address + current.size()
+            return current.immediates[0] == following
+        return False
+
+    def combine(self, first: Line, second: Line, lines: list[Line], rest: int) -> list[Line] | None:
+        """Замена пары инструкций; rest - индекс строки после пары."""
+        if self.reloads(first, second):
+            source, target = first.register(0), second.register(0)
+            if source != target:
+                return [first, line(Opcode.MOV_r2r, [target, source], [], second.address)]
+            return None if self.reads_flags(lines, rest) else [first]
+
+        if second.opcode == Opcode.MOV_r2r and first.opcode not in CONTROL_OPCODES:
+            return self.retarget(first, second, lines, rest)
+        if first.opcode not in (Opcode.MOV_imm2r, Opcode.MOV_da2r) or not self.dead(first.register(0), second, lines, rest):
+            return None
+        if first.opcode == Opcode.MOV_da2r and second.opcode in REG2REG_OPERATION:
+            return self.mix(first, second)
+        one = first.opcode == Opcode.MOV_imm2r and first.immediates == [1]
+        return self.step(first.register(0), second, first.address) if one else None
+
+    def reloads(self, store: Line, load: Line) -> bool:
+        """load читает то слово памяти, которое только что записала store."""
+        if store.opcode == Opcode.STORE_r2da and load.opcode == Opcode.MOV_da2r:
+            return store.immediates == load.immediates and store.immediates[0] not in self.ports
+        return (store.opcode == Opcode.STORE_r2rel and load.opcode == Opcode.MOV_rel2r
+                and store.immediates == load.immediates and store.register(1) == load.register(1))
+
+    def retarget(self, first: Line, copy: Line, lines: list[Line], rest: int) -> list[Line] | None:
+        """first пишет сразу в приемник следующего за ней MOV_r2r, если копируемый регистр дальше не читается."""
+        dst, left, right = DECODE_PLANS[first.opcode]
+        # у INC_r/DEC_r приемник - он же операнд: его не заменить
+        if dst is None or dst in (left, right) or self.reads_flags(lines, rest):
+            return None
+        result, (target, source) = first.register(dst), (copy.register(0), copy.register(1))
+        if source != result or target == result:
+            return None
+        if not self.dead(result, copy, lines, rest):
+            return None
+        registers = [target if index == dst else first.register(index) for index in range(len(first.instruction.terms))]
+        return [line(first.opcode, registers, first.immediates, first.address)]
+
+    @staticmethod
+    def mix(load: Line, second: Line) -> list[Line] | None:
+        """Операция mix2reg вместо загрузки операнда из памяти и операции reg2reg."""
+        loaded = load.register(0)
+        dst, left, right = (second.register(index) for index in range(3))
+        opcodes = BINOP_OPCODE[REG2REG_OPERATION[second.opcode]]
+        if left != loaded and right == loaded:
+            return [line(opcodes[AddressingType.MIX2REG1], [dst, left], load.immediates, load.address)]
+        if left == loaded and right != loaded:
+            return [line(opcodes[AddressingType.MIX2REG2], [dst, right], load.immediates, load.address)]
+        return None
+
+    @staticmethod
+    def step(one: Registers.Registers, second: Line, address: int) -> list[Line] | None:
+        """INC_r/DEC_r вместо ADD/SUB, где регистр one хранит 1."""
+        opcode, dst = second.opcode, second.register(0)
+        if opcode in (Opcode.ADD_reg2reg, Opcode.SUB_reg2reg):
+            left, right = second.register(1), second.register(2)
+            if opcode == Opcode.ADD_reg2reg and left == one:
+                left, right = right, left
+            if right != one or left == one:
+                return None
+            step = Opcode.INC_r if opcode == Opcode.ADD_reg2reg else Opcode.DEC_r
+            if dst == left:
+                return [line(step, [dst], [], address)]
+            return [line(Opcode.MOV_r2r, [dst, left], [], address), line(step, [dst], [], second.address)]
+        # ADD_mix2reg с 1 не трогаем: MOV_da2r + INC_r дольше, чем MOV_imm2r + ADD_mix2reg
+        return None
+
+    def dead(self, register: Registers.Registers, second: Line, lines: list[Line], rest: int) -> bool:
+        """Значение register после second не нужно: second либо на всех путях после нее (переходы
+        прослеживаются по self.positions) запись в register идет раньше чтения."""
+        dst, _, _ = DECODE_PLANS[second.opcode]
+        if dst is not None and second.register(dst) == register:
+            return True
+        pending, seen = [rest], set()
+        while pending:
+            index = pending.pop()
+            if index in seen:
+                continue
+            if index >= len(lines):
+                return False
+            seen.add(index)
+            ln = lines[index]
+            dst, left, right = DECODE_PLANS[ln.opcode]
+            if register in {ln.register(i) for i in (left, right) if i is not None}:
+                return False
+            if dst is not None and ln.register(dst) == register:
+                continue
+            if ln.opcode == Opcode.CALL:
+                # функции берут аргументы со стека и не читают регистры вызывающего кода
+                pending.append(index + 1)
+            elif ln.opcode in JUMP_OPCODES:
+                if ln.immediates[0] not in self.positions:
+                    return False
+                pending.append(self.positions[ln.immediates[0]])
+                if ln.opcode != Opcode.JMP_imm:
+                    pending.append(index + 1)
+            elif ln.opcode in CONTROL_OPCODES:
+                return False
+            else:
+                pending.append(index + 1)
+        return True
+
+
 MAX_REGISTER = 7
 MIN_REGISTER = 1
+ALLOCATABLE_REGISTERS = (1, 2, 3, 4, 5)
 class RegisterController:
+    """Стек свободных регистров для промежуточных значений.
+
+    Регистры переменных циклов (pinned, см. Generator.handle_while) изъяты из стека и при освобождении
+    в него не возвращаются. peak - наибольшее число регистров, занятых временными значениями (обнуляет вызывающий код).
+    """
+
     def __init__(self):
-        self.available = [1, 2, 3, 4, 5]
+        self.available = list(ALLOCATABLE_REGISTERS)
+        self.pinned: set[int] = set()
+        self.peak = 0
 
     def alloc(self) -> Registers.Registers:
-        return Registers.Registers(self.available.pop())
+        reg = Registers.Registers(self.available.pop())
+        self.peak = max(self.peak, self.in_use())
+        return reg
 
     def release(self, reg: Registers.Registers) -> None:
-        if MIN_REGISTER <= reg.value <= MAX_REGISTER:
+        # значение print освобождается дважды: повтор не должен класть регистр в стек второй раз
+        if MIN_REGISTER <= reg.value <= MAX_REGISTER and reg.value not in self.pinned \
+                and reg.value not in self.available:
             self.available.append(reg.value)
 
+    def in_use(self) -> int:
+        return len(ALLOCATABLE_REGISTERS) - len(self.available) - len(self.pinned)
+
+    def pin(self, count: int) -> list[Registers.Registers]:
+        """Закрепляет count свободных регистров снизу стека, чтобы временным значениям оставалась вершина."""
+        registers, self.available = self.available[:count], self.available[count:]
+        self.pinned.update(registers)
+        return [Registers.Registers(reg) for reg in registers]
+
+    def unpin(self, registers: list[Registers.Registers]) -> None:
+        for reg in registers:
+            self.pinned.discard(reg.value)
+        self.available[:0] = [reg.value for reg in registers]
+
+
+@dataclass(frozen=True)
+class FrameSlot:
+    """Переменная функции: слово кадра по смещению index от RSP на входе в тело функции."""
+
+    index: int
+
 
 class VariableAllocator:
+    """Глобальные переменные - статические адреса в секции данных, параметры и локальные
+    переменные функций - ячейки кадра на стеке (FrameSlot) или статические адреса (см. handle_defun)."""
+
     def __init__(self, base_address: int = 200) -> None:
         self.base_address = base_address
         self.next_free = base_address
-        self.scopes: list[dict[str, Address]] = [{}]
+        self.scopes: list[dict[str, Address | FrameSlot]] = [{}]
 
     def new_addr(self) -> Address:
         addr = Address(self.next_free)
         self.next_free += 1
         return addr
 
-    def get(self, name: str) -> Address:
+    def get(self, name: str) -> Address | FrameSlot:
         for scope in reversed(self.scopes):
             if name in scope:
                 return scope[name]
         raise KeyError(name)
 
-    def allocate(self, name: str) -> Address:
+    def allocate(self, name: str) -> Address | FrameSlot:
         scope = self.scopes[-1]
         if name not in scope:
             scope[name] = self.new_addr()
         return scope[name]
 
-    def push_fn_scope(self, fn_name: str, params: list[str]) -> None:
-        frame: dict[str, Address] = {}
-        for p in params:
-            if p in frame:
+    def push_fn_scope(self, fn_name: str, params: list[str], local_names: list[str] = (), *, frame: bool = True) -> None:
+        """Область функции; при frame=False переменные получают статические адреса."""
+        scope: dict[str, Address | FrameSlot] = {
+            name: FrameSlot(index) if frame else self.new_addr() for index, name in enumerate(local_names)}
+        for index, p in enumerate(params, len(scope) + 1):
+            if p in scope:
                 err_message = f"parameter {p!r} repeated"
                 raise SyntaxError(err_message)
-            frame[p] = self.new_addr()
-        self.scopes.append(frame)
+            scope[p] = FrameSlot(index) if frame else self.new_addr()
+        self.scopes.append(scope)
 
     def pop_fn_scope(self) -> None:
         if len(self.scopes) == 1:
@@ -683,54 +1822,26 @@ class VariableAllocator:
             raise RuntimeError(err_message)
         self.scopes.pop()
 
-    def __getitem__(self, name: str) -> Address:
+    def __getitem__(self, name: str) -> Address | FrameSlot:
         return self.get(name)
 
 
 def to_bytes(code) -> bytes:
     """Преобразует инструкции в бинарное представление"""
-    binary_bytes = bytearray()
-    for instr in code:
-        if isinstance(instr, Instruction):
-            # Получаем бинарный код операции
-            binary_instr = instr.opcode.value << 22
-            for i, term in enumerate(instr.terms):
-                binary_instr = binary_instr | (term.value.value << (19 - i * 3))
-            # Преобразуем 32-битное целое число в 4 байта (big-endian)
-            binary_bytes.extend(
-                ((binary_instr >> 24) & 0xFF, (binary_instr >> 16) & 0xFF, (binary_instr >> 8) & 0xFF, binary_instr & 0xFF),
-            )
-        else:
-            binary_bytes.extend(
-                ((instr >> 24) & 0xFF, (instr >> 16) & 0xFF, (instr >> 8) & 0xFF, instr & 0xFF),
-            )
-
-    return bytes(binary_bytes)
+    return words_to_bytes(encode_program(code))
 
 
 def to_hex(code: list[Instruction | int]) -> list[str]:
     code_repr = []
-    binary_code = to_bytes(code)
+    words = encode_program(code)
     i = 0
-    while i + 3 < len(binary_code):
-        instr_repr = ""
-        binary_instr = (
-            (binary_code[i] << 24) | (binary_code[i + 1] << 16) | (binary_code[i + 2] << 8) | binary_code[i + 3]
-        )
-        opcode = Opcode(binary_instr >> 22)
-        instr_repr += f"{binary_instr:08X}"
-        for _ in range(OPCODE_TO_TERMS_AMOUNT[opcode][1]):
-            i += 4
-            binary_instr = (
-                (binary_code[i] << 24) | (binary_code[i + 1] << 16) | (binary_code[i + 2] << 8) | binary_code[i + 3]
-            )
-            instr_repr += f"{binary_instr:08X}"
-        code_repr += [instr_repr]
-        i += 4
+    while i < len(words):
+        end = i + 1 + immediates_amount(Opcode(words[i] >> 22), words[i] & N_OPERANDS_MASK)
+        code_repr.append("".join(f"{word:08X}" for word in words[i:end]))
+        i = end
     return code_repr
 
 
-
 def program_debug_info(code: list[Instruction | int]) -> str:
     hex_repr = to_hex(code)
     program_repr = []
@@ -752,35 +1863,154 @@ def program_debug_info(code: list[Instruction | int]) -> str:
                                                                                          strict=False))
 
 
-def main(source, target) -> None:
-    """Функция запуска транслятора. Параметры -- исходный и целевой файлы."""
-    reg_controller = RegisterController()
-    var_allocator = VariableAllocator()
-    program = [0] * 1024
+class Translation(NamedTuple):
+    """Машинный код, статические данные и отладочная информация для контейнера (см. container)."""
 
-    tokenizer = Tokenizer()
-    parser = Parser()
-    generator = Generator(var_allocator, reg_controller, program)
+    code: list[Instruction | int]
+    data: list[int]
+    symbols: list[SymbolEntry]
+    lines: list[tuple[int, int]]
 
-    with open(source, encoding="utf-8") as f:
-        source = f.read()
-    generator.generate(parser.parse(tokenizer.tokenize(source)))
+
+def translate(source: str | TextIO, layout: MemoryLayout = DEFAULT_LAYOUT, optimization: int = 0,
+              inline_threshold: int | None = None) -> tuple[list[Instruction | int], list[int]]:
+    """Транслирует исходный текст или файл (читается кусками), возвращает машинный код и статические данные.
+
+    optimization - уровень оптимизаций AST (см. Optimizer), 0 - без оптимизаций; inline_threshold - предельный
+    размер подставляемой функции, None - по уровню оптимизаций.
+    """
+    translation = translate_program(source, layout, optimization, inline_threshold)
+    return translation.code, translation.data
+
+
+def translate_program(source: str | TextIO, layout: MemoryLayout = DEFAULT_LAYOUT, optimization: int = 0,
+                      inline_threshold: int | None = None) -> Translation:
+    """Как translate, но еще и символы и таблица строк для контейнера."""
+    tokenizer = Tokenizer()
+    tokens = tokenizer.scan([source]) if isinstance(source, str) else tokenizer.stream(source)
+    tree = Parser().parse(tokens)
+    inline_threshold = Optimizer.inline_limit(optimization, inline_threshold)
+    try:
+        return generate_program(tree, layout, optimization, inline_threshold)
+    except (IndexError, RuntimeError):
+        # подставленные тела занимают больше регистров и памяти: если не поместились, то без подстановки
+        if inline_threshold == 0:
+            raise
+    return generate_program(tree, layout, optimization, 0)
+
+
+def generate_program(tree: Exp | Atom, layout: MemoryLayout, optimization: int, inline_threshold: int) -> Translation:
+    reg_controller = RegisterController()
+    var_allocator = VariableAllocator(layout.data_base)
+    sections = layout.sections()
+    program = [0] * max(sections["text"].stop, sections["data"].stop)
+
+    generator = Generator(var_allocator, reg_controller, program, layout,
+                          loop_registers=optimization >= Optimizer.REGISTERS)
+    optimizer = Optimizer(optimization, generator.handlers_map, inline_threshold)
+    generator.generate(optimizer.optimize(tree))
+    moved: dict[int, int] = {}  # адреса, которые сдвинул Peephole
+    if optimization >= Optimizer.FOLD:
+        peephole = Peephole(layout)
+        generator.PC = peephole.optimize(program, layout.text_base, generator.PC)
+        moved = peephole.moved
     program[generator.PC] = Instruction(Opcode.HLT, [])
     generator.PC += 1
+    text_end = generator.PC
+    if text_end > sections["text"].stop:
+        err_message = f"program text ({text_end - layout.text_base} words) exceeds text section"
+        raise RuntimeError(err_message)
+    if var_allocator.next_free > sections["data"].stop:
+        err_message = f"static data ({var_allocator.next_free - layout.data_base} words) exceeds data section"
+        raise RuntimeError(err_message)
+    symbols = []
+    for name, function in generator.label_map.items():
+        start, end = (moved.get(function[key].value, function[key].value) for key in ("address", "end"))
+        symbols.append(SymbolEntry(SymbolKind.FUNCTION, start, end - start, name))
+    symbols += [SymbolEntry(SymbolKind.VARIABLE, address.value, 1, name)
+                for name, address in var_allocator.scopes[0].items()]
+    return Translation(program[layout.text_base:text_end], program[var_allocator.base_address:var_allocator.next_free],
+                       symbols, line_table(generator.lines, moved, text_end))
+
+
+def line_table(lines: list[tuple[int, int]], moved: dict[int, int], text_end: int) -> list[tuple[int, int]]:
+    """Записи генератора после перемещения кода: на каждый адрес - последняя, без повторов строки подряд."""
+    by_address = {moved.get(address, address): line for address, line in lines}
+    table: list[tuple[int, int]] = []
+    for address, line in sorted(by_address.items()):
+        if address < text_end and (not table or table[-1][1] != line):
+            table.append((address, line))
+    return table
+
+
+def build(source: str | TextIO, layout: MemoryLayout = DEFAULT_LAYOUT, optimization: int = 0,
+          inline_threshold: int | None = None) -> TranslationOutput:
+    """Транслирует исходный текст в содержимое файлов транслятора."""
+    code, data, symbols, lines = translate_program(source, layout, optimization, inline_threshold)
+    binary_code, binary_data = to_bytes(code), to_bytes(data)
+    executable = Executable(layout, layout.text_base, binary_code, binary_data, symbols, lines)
+    return TranslationOutput(layout.header() + binary_code, program_debug_info(code), binary_data, pack(executable))
+
+
+def cached_build(source: str, layout: MemoryLayout, cache: TranslationCache, optimization: int = 0,
+                 inline_threshold: int | None = None) -> TranslationOutput:
+    key = cache_key(source, layout, optimization, inline_threshold)
+    output = cache.get(key)
+    if output is None:
+        output = build(source, layout, optimization, inline_threshold)
+        cache.put(key, output)
+    return output
+
+
+def main(source, target, layout=DEFAULT_LAYOUT, cache: TranslationCache | None = None, optimization: int = 0,
+         *, inline_threshold: int | None = None, executable: bool = False, compress: bool = False) -> None:
+    """Функция запуска транслятора. Параметры -- исходный и целевой файлы, карта памяти, кэш трансляций,
+    уровень оптимизаций, предельный размер подставляемой функции.
+
+    При попадании в кэш токенизатор, парсер и генератор не запускаются. Если executable, вместо трех файлов
+    пишется один контейнер (модуль container); compress включает сжатие содержимого.
+    """
+    with open(source, encoding="utf-8") as f:
+        # ключу кэша нужен весь текст, без кэша файл читается кусками по ходу разбора
+        output = build(f, layout, optimization, inline_threshold) if cache is None \
+            else cached_build(f.read(), layout, cache, optimization, inline_threshold)
 
-    program_info = program_debug_info(program[:generator.PC])
+    if executable:
+        with open(target, "wb") as f:
+            f.write(pack(unpack(output.executable), compress=True) if compress else output.executable)
+        return
 
     with open(target, "wb") as f:
-        f.write(to_bytes(program[:generator.PC]))
+        f.write(output.code)
 
     with open(target + ".hex", "w") as f:
-        f.write(program_info)
+        f.write(output.listing)
 
     with open(target + "_data.bin", "wb") as f:
-        f.write(to_bytes(program[var_allocator.base_address:var_allocator.next_free]))
+        f.write(output.data)
 
 
 if __name__ == "__main__":
-    _, source, target = sys.argv
-    main(source, target)
+    arg_parser = argparse.ArgumentParser(description="Транслятор Lisp")
+    arg_parser.add_argument("source")
+    arg_parser.add_argument("target")
+    arg_parser.add_argument("--heap-size", type=int, default=DEFAULT_LAYOUT.heap_size, help="размер кучи в словах")
+    arg_parser.add_argument("--stack-size", type=int, default=DEFAULT_LAYOUT.stack_size, help="размер стека в словах")
+    arg_parser.add_argument("-O", dest="optimization", type=int, choices=(0, 1, 2, 3), default=0,
+                            help="уровень оптимизаций: 1 - свертка констант, 2 - и удаление мертвого кода, "
+                                 "3 - и переменные циклов в регистрах")
+    arg_parser.add_argument("--inline", dest="inline_threshold", type=int, metavar="N",
+                            help="подставлять нерекурсивные функции, тело которых не больше N узлов AST, 0 - "
+                                 f"не подставлять (по умолчанию {Optimizer.INLINE_THRESHOLD} на -O2 и -O3, иначе 0)")
+    arg_parser.add_argument("--executable", action="store_true",
+                            help="записать один файл-контейнер: код, данные, символы и таблица строк")
+    arg_parser.add_argument("--compress", action="store_true", help="сжать содержимое контейнера zlib")
+    arg_parser.add_argument("--no-cache", action="store_true", help="не использовать кэш трансляций")
+    arg_parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="каталог кэша трансляций")
+    arg_parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES // 2**20,
+                            help="предельный размер кэша трансляций, МиБ")
+    args = arg_parser.parse_args()
+    translation_cache = None if args.no_cache else TranslationCache(args.cache_dir, args.cache_size * 2**20)
+    main(args.source, args.target, sized_layout(args.heap_size, args.stack_size), translation_cache, args.optimization,
+         inline_threshold=args.inline_threshold, executable=args.executable, compress=args.compress)
     # main("trash/bigint.lisp", "trash/out.bin")